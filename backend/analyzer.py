@@ -0,0 +1,97 @@
+"""
+Pluggable text analyzers shared by BM25 indexing and querying. The analyzer an index was built
+with is stored in bm25/meta.json ("analyzer": name, version, stopwords) and the same one is
+rebuilt on load, so queries are always tokenized like the documents they are matched against.
+"""
+import os, re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple, Type
+
+BM25_ANALYZER = os.getenv("BM25_ANALYZER", "code")
+DEFAULT_STOPWORDS = frozenset("""
+a an and are as at be by for from has have if in into is it its of on or that the this to was were will with
+""".split())
+
+def _stopwords_from_env() -> FrozenSet[str]:
+    raw = os.getenv("BM25_STOPWORDS")
+    if raw is None:
+        return DEFAULT_STOPWORDS
+    return frozenset(w.strip().lower() for w in raw.split(",") if w.strip())   # "" disables stopwords
+
+class Analyzer:
+    name = "base"
+    version = 1
+
+    def __init__(self, stopwords: Iterable[str] = ()):
+        self.stopwords = frozenset(stopwords)
+
+    def analyze(self, text: str) -> List[str]:
+        raise NotImplementedError
+
+    def spec(self) -> Dict[str, Any]:
+        return {"name": self.name, "version": self.version, "stopwords": sorted(self.stopwords)}
+
+ANALYZERS: Dict[str, Type[Analyzer]] = {}   # name -> class; the only lookup for BM25_ANALYZER and index metas
+
+def register_analyzer(cls: Type[Analyzer]) -> Type[Analyzer]:
+    """Class decorator: make an Analyzer subclass selectable via BM25_ANALYZER."""
+    ANALYZERS[cls.name] = cls
+    return cls
+
+@register_analyzer
+class WhitespaceAnalyzer(Analyzer):
+    """lower().split(): what every index built before analyzers were stored used."""
+    name = "whitespace"
+
+    def analyze(self, text: str) -> List[str]:
+        toks = text.lower().split()
+        return [t for t in toks if t not in self.stopwords] if self.stopwords else toks
+
+_WORD = re.compile(r"[^\W_]+(?:_+[^\W_]+)*")   # runs of letters/digits joined by underscores
+_SUBWORD = re.compile(r"[A-Z]+[0-9]*(?=[A-Z][a-z])|[A-Z]?[a-z]+[0-9]*|[A-Z]+[0-9]*|[0-9]+|[^\W\d_]+")
+
+@lru_cache(maxsize=1 << 16)
+def _expand(word: str) -> Tuple[str, ...]:
+    """build_index → (build_index, build, index); BM25Okapi → (bm25okapi, bm25, okapi)."""
+    whole = word.lower()
+    parts = [p.lower() for piece in word.split("_") if piece for p in _SUBWORD.findall(piece)]
+    if len(parts) <= 1:
+        return (whole,)
+    return (whole, *parts)
+
+@register_analyzer
+class CodeAnalyzer(Analyzer):
+    """
+    Splits on punctuation and whitespace, keeps each identifier whole and adds its
+    snake_case/camelCase/digit-boundary subwords, lowercases, and drops stopwords.
+    """
+    name = "code"
+
+    def analyze(self, text: str) -> List[str]:
+        out: List[str] = []
+        stop = self.stopwords
+        for word in _WORD.findall(text):
+            for term in _expand(word):
+                if term not in stop:
+                    out.append(term)
+        return out
+
+def current_analyzer() -> Analyzer:
+    """The analyzer new indexes are built with (BM25_ANALYZER, BM25_STOPWORDS)."""
+    if BM25_ANALYZER not in ANALYZERS:
+        raise ValueError(f"Unknown BM25_ANALYZER {BM25_ANALYZER!r}; choose one of {sorted(ANALYZERS)}")
+    return ANALYZERS[BM25_ANALYZER](_stopwords_from_env())
+
+def analyzer_for_index(spec: Optional[Dict[str, Any]]) -> Tuple[Analyzer, bool]:
+    """
+    Rebuild the analyzer recorded in an index's meta. Returns (analyzer, mismatch) where mismatch
+    means the index differs from the current configuration and should be re-ingested.
+    Indexes without a recorded analyzer were built with the whitespace analyzer.
+    """
+    spec = spec or {"name": "whitespace", "version": 1, "stopwords": []}
+    cls = ANALYZERS.get(spec.get("name"))
+    if cls is None or cls.version != spec.get("version"):
+        raise ValueError(f"Index was built with analyzer {spec.get('name')} v{spec.get('version')}, "
+                         f"which this version cannot reproduce; re-ingest with full=true")
+    analyzer = cls(spec.get("stopwords") or ())
+    return analyzer, analyzer.spec() != current_analyzer().spec()
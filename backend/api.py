@@ -1,48 +1,136 @@
-import os, re
+import os, re, json, time
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Literal
+from typing import Iterable, List, Literal, Optional
 from .repo_indexer import build_index
-from .retriever import Retriever
+from .retriever_cache import RETRIEVERS, get_retriever
+from .federated import SHARDS, FederatedSearch
+from .llm_cache import CACHE as LLM_CACHE
 from .detectors import detect_modes
-from .blueprint import generate_blueprint
+from .blueprint import PRECOMPUTE_BLUEPRINTS, generate_blueprint, stream_blueprint, precompute_blueprints
+from .jobs import Job, JobConflictError, JobManager, QueueFullError
+from .storage import active_dir, new_version_dir, publish, discard
+from .telemetry import TELEMETRY, gauge, inc, observe, render, span, trace
 
 app = FastAPI(title="Repo-Ops API")
 DATA_ROOT = Path(os.getenv("INDEX_ROOT", "data"))
 
+class _RequestMetrics:
+    """ASGI middleware: latency until the response starts and a request count per route and status."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TELEMETRY:
+            return await self.app(scope, receive, send)
+        t0, status = time.perf_counter(), [500]
+
+        async def send_observed(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                observe("http_request_seconds", time.perf_counter() - t0, **_route_labels(scope))
+            await send(message)
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            inc("http_requests_total", status=status[0], **_route_labels(scope))
+
+def _route_labels(scope) -> dict:
+    route = scope.get("route")   # set by the router; templates keep label cardinality bounded
+    return {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+
+app.add_middleware(_RequestMetrics)
+
+@app.on_event("startup")
+def _warm_retrievers():
+    RETRIEVERS.warm(DATA_ROOT)   # repo_ids from WARM_REPOS
+
 class IngestRequest(BaseModel):
     repo_url: str
+    full: bool = False   # force a full rebuild instead of an incremental re-ingest
+    wait: bool = False   # block until the job finishes and return its result
 
 class AskRequest(BaseModel):
-    repo_id: str
+    repo_id: Optional[str] = None          # one repo; otherwise all of repo_ids (default: every ingested repo)
+    repo_ids: Optional[List[str]] = None
     query: str
     mode: Literal["explain","stack","run","deploy","test"] = "explain"
 
+class SearchRequest(BaseModel):
+    query: str
+    repo_ids: Optional[List[str]] = None   # default: every ingested repo
+    k: int = 10
+
 class BlueprintRequest(BaseModel):
     repo_id: str
     mode: Literal["run","test","deploy","understand","stack"]
+    refresh: bool = False   # regenerate instead of serving the stored blueprint
 
-@app.post("/ingest")
-def ingest(req: IngestRequest):
+def _run_ingest(job: Job) -> dict:
+    repo_dir = DATA_ROOT / job.repo_id  # <— per-repo directory
+    vdir = new_version_dir(repo_dir)     # built off to the side, swapped in atomically
+    with trace() as timings:            # ingest.<stage> spans, bm25/dense/repo_map/publish/blueprints
+        try:
+            stats = build_index(job.repo_url, vdir, full=job.full, prev_dir=active_dir(repo_dir),
+                                progress=job.update)
+        except Exception:
+            discard(vdir)
+            if not any(repo_dir.iterdir()):
+                repo_dir.rmdir()   # first ingest failed: don't leave an empty repo_id behind
+            raise
+        with span("ingest.publish"):
+            if stats.get("unchanged"):
+                discard(vdir)
+            else:
+                publish(repo_dir, vdir)
+                RETRIEVERS.invalidate(job.repo_id)   # drop the stale in-memory index
+        modes = detect_modes(repo_dir)
+        if PRECOMPUTE_BLUEPRINTS:
+            # the new index is already live; blueprints are filled in behind it
+            with span("ingest.blueprints"):
+                stats["blueprints"] = precompute_blueprints(repo_dir, modes, progress=job.update)
+    return {
+        "ok": True,
+        "repo_id": job.repo_id,
+        "source_url": job.repo_url,
+        "modes": modes,
+        **stats,    # includes: n_files, n_chunks, sample_paths
+        "timings": timings,
+    }
+
+JOBS = JobManager(_run_ingest)
+gauge("ingest_jobs_active", "Ingest jobs queued or running", lambda: JOBS.stats()["active"])
+gauge("retriever_cache_entries", "Retrievers loaded in memory", lambda: RETRIEVERS.stats()["entries"])
+gauge("retriever_cache_bytes", "Approximate memory held by loaded retrievers", lambda: RETRIEVERS.stats()["bytes"])
+
+@app.post("/ingest", status_code=202)
+def ingest(req: IngestRequest, response: Response):
     DATA_ROOT.mkdir(parents=True, exist_ok=True)
     repo_id = req.repo_url.rstrip("/").split("/")[-1]
     if repo_id.endswith(".git"):
         repo_id = repo_id[:-4]
-
-    repo_dir = DATA_ROOT / repo_id  # <— per-repo directory
     try:
-        stats = build_index(req.repo_url, repo_dir)   # writes into data/<repo_id>/*
-        modes = detect_modes(repo_dir)
-        return {
-            "ok": True,
-            "repo_id": repo_id,
-            "source_url": req.repo_url,
-            "modes": modes,
-            **stats     # includes: n_files, n_chunks, sample_paths
-        }
-    except Exception as e:
-        raise HTTPException(400, f"Ingest failed: {e}")
+        job, attached = JOBS.submit(repo_id, req.repo_url, full=req.full)
+    except QueueFullError as e:
+        raise HTTPException(429, str(e))
+    except JobConflictError as e:
+        raise HTTPException(409, str(e))
+    if req.wait:
+        job.wait()
+        if job.status == "failed":
+            raise HTTPException(400, job.error)
+        response.status_code = 200   # the body is the finished result, not an accepted job
+        return job.result
+    return {"ok": True, "job_id": job.id, "repo_id": repo_id, "status": job.status, "attached": attached}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job_id: {job_id}")
+    return {"ok": True, **job.to_dict()}
 
 @app.post("/blueprints")
 def blueprints(req: BlueprintRequest):
@@ -50,19 +138,93 @@ def blueprints(req: BlueprintRequest):
     if not repo_dir.exists():
         raise HTTPException(404, f"Unknown repo_id: {req.repo_id}")
     try:
-        answer = generate_blueprint(repo_dir, req.mode)
-        return {"ok": True, "mode": req.mode, "answer": answer}
+        out = generate_blueprint(repo_dir, req.mode, refresh=req.refresh)
+        return {"ok": True, "mode": req.mode, **out}
     except Exception as e:
         raise HTTPException(400, f"Blueprint failed: {e}")
 
+def _federated(repo_ids: Optional[List[str]]) -> FederatedSearch:
+    unknown = [r for r in repo_ids or [] if r.startswith(("_", ".")) or not (DATA_ROOT / r).is_dir()]
+    if unknown:
+        raise HTTPException(404, f"Unknown repo_id: {', '.join(unknown)}")
+    try:
+        return FederatedSearch(DATA_ROOT, repo_ids)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/search")
+def search(req: SearchRequest):
+    fed = _federated(req.repo_ids)
+    try:
+        with trace() as timings:   # federated.stats, federated.topk, federated.fetch
+            hits = fed.topk(req.query, k=max(1, min(req.k, 100)))
+    except Exception as e:
+        raise HTTPException(400, f"Search failed: {e}")
+    return {"ok": True, "repos": len(fed.repo_ids) - len(fed.errors), "skipped": fed.errors,
+            "hits": [{"repo_id": h["repo_id"], "citation": h["citation"], "score": h["score"],
+                      "text": h["text"], "meta": h["meta"]} for h in hits],
+            "timings": timings}
+
 @app.post("/ask")
 def ask(req: AskRequest):
+    fed = _federated(req.repo_ids) if req.repo_id is None else None   # multi-repo question
+    repo_dir = DATA_ROOT / req.repo_id if fed is None else None
+    if repo_dir is not None and not repo_dir.exists():
+        raise HTTPException(404, f"Unknown repo_id: {req.repo_id}")
+    try:
+        with trace() as timings:   # retriever.load (on a cache miss) or federated.*, retrieve.*, llm
+            r = fed or get_retriever(repo_dir)  # <— cached repo-scoped retriever
+            out = r.answer_with_stats(req.query, mode=req.mode)
+        return {"ok": True, **out, "timings": timings}
+    except Exception as e:
+        raise HTTPException(400, f"Answer failed: {e}")
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_events(stream: Iterable[str], **extra):
+    # stream: ChatStream or BlueprintStream (text deltas, then .result)
+    # token* then done (with llm stats incl. ttft_s) or error; errors after the 200 can only travel in-band
+    try:
+        for delta in stream:
+            yield _sse("token", {"text": delta})
+        yield _sse("done", {"ok": True, **extra, "llm": stream.result.stats(), "context": stream.context})
+    except Exception as e:
+        yield _sse("error", {"ok": False, "error": f"Answer failed: {e}"})
+
+def _event_stream(stream: Iterable[str], **extra) -> StreamingResponse:
+    return StreamingResponse(_stream_events(stream, **extra), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/blueprints/stream")
+def blueprints_stream(req: BlueprintRequest):
     repo_dir = DATA_ROOT / req.repo_id
     if not repo_dir.exists():
         raise HTTPException(404, f"Unknown repo_id: {req.repo_id}")
     try:
-        r = Retriever(repo_dir)  # <— repo-scoped retriever
-        out = r.answer(req.query, mode=req.mode)
-        return {"ok": True, "answer": out}
+        stream = stream_blueprint(repo_dir, req.mode, refresh=req.refresh)   # retrieval happens here, before the 200
+    except Exception as e:
+        raise HTTPException(400, f"Blueprint failed: {e}")
+    return _event_stream(stream, mode=req.mode)
+
+@app.post("/ask/stream")
+def ask_stream(req: AskRequest):
+    fed = _federated(req.repo_ids) if req.repo_id is None else None
+    repo_dir = DATA_ROOT / req.repo_id if fed is None else None
+    if repo_dir is not None and not repo_dir.exists():
+        raise HTTPException(404, f"Unknown repo_id: {req.repo_id}")
+    try:
+        with trace() as timings:   # retrieval only; the LLM's latency/ttft arrive in `llm`
+            stream = (fed or get_retriever(repo_dir)).answer_stream(req.query, mode=req.mode)
     except Exception as e:
         raise HTTPException(400, f"Answer failed: {e}")
+    return _event_stream(stream, timings=timings)
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"ok": True, "retrievers": RETRIEVERS.stats(), "shards": SHARDS.stats(), "llm": LLM_CACHE.stats(),
+            "jobs": JOBS.stats()}
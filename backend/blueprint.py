@@ -1,38 +1,155 @@
-from typing import Literal
-from .retriever import Retriever
+import os, json, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal, Dict, Any, Callable, Iterator, Optional
+from .llm import ChatResult, ChatStream
+from .llm_cache import cache_key
+from .retriever import ANSWER_PROMPT_VERSION
+from .retriever_cache import get_retriever
+from .storage import active_dir
+
+PRECOMPUTE_BLUEPRINTS = os.getenv("PRECOMPUTE_BLUEPRINTS", "1") == "1"   # generate all enabled blueprints at ingest
 
 BlueprintMode = Literal["run","test","deploy","understand","stack"]
+BLUEPRINT_MODES = ("run", "test", "deploy", "understand", "stack")
 
 PROMPTS = {
     "run": (
         "Give exact local run steps: installation (pip/poetry/conda), "
         "env variables if evident, and the main entrypoint command. "
-        "If alternatives exist, propose both. Cite file paths inline like [path:chunk]."
+        "If alternatives exist, propose both. Cite file paths inline like [path:start-end]."
     ),
     "test": (
         "How to run the tests with pytest (and coverage if present). "
-        "Show minimal commands. Cite evidence with [path:chunk]."
+        "Show minimal commands. Cite evidence with [path:start-end]."
     ),
     "deploy": (
         "Propose a minimal Docker + uvicorn/ASGI deployment plan. "
         "If a Dockerfile exists, show build/run commands. If not, provide a minimal Dockerfile "
         "and a one-service docker-compose.yml exposing the correct port. "
-        "Call out secrets/ports. Cite evidence with [path:chunk]."
+        "Call out secrets/ports. Cite evidence with [path:start-end]."
     ),
     "understand": (
         "Explain briefly what this repo does: main modules, data flow, and entry points "
-        "in ≤10 bullets. Cite evidence with [path:chunk]."
+        "in ≤10 bullets. Cite evidence with [path:start-end]."
     ),
     "stack": (
         "List the main frameworks, ML libs, serving libs, data deps, and config files. "
-        "Include versions when available (requirements/pyproject). Cite with [path:chunk]."
+        "Include versions when available (requirements/pyproject). Cite with [path:start-end]."
     ),
 }
 
-def generate_blueprint(repo_dir, mode: BlueprintMode) -> str:
-    r = Retriever(repo_dir)
-    instruction = PROMPTS[mode]
+def _query(mode: BlueprintMode) -> Dict[str, Any]:
     # We pass the instruction as the 'query' so the model uses retrieved context
-    return r.answer(query=instruction, mode={
+    return {"query": PROMPTS[mode], "mode": {
         "understand": "explain"  # map to retriever's internal name
-    }.get(mode, mode))
+    }.get(mode, mode)}
+
+def _prompt_version(mode: str) -> str:
+    # a stored blueprint is stale once its prompt changes, even for the same index version
+    return cache_key(ANSWER_PROMPT_VERSION, PROMPTS[mode])[:16]
+
+def _blueprint_path(vdir: Path, mode: str) -> Path:
+    return Path(vdir) / "blueprints" / f"{mode}.json"
+
+def _index_version(vdir: Path) -> str:
+    try:
+        return json.loads((Path(vdir) / "bm25" / "meta.json").read_text(encoding="utf-8")).get("version", "")
+    except (OSError, ValueError):
+        return ""   # legacy index: no version, nothing is stored
+
+def load_blueprint(repo_dir, mode: BlueprintMode) -> Optional[Dict[str, Any]]:
+    """Stored blueprint for the active index version and current prompt, or None. Just a file read, no retriever load."""
+    vdir = active_dir(repo_dir)
+    version = _index_version(vdir)
+    if not version:
+        return None
+    try:
+        row = json.loads(_blueprint_path(vdir, mode).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return row if row.get("index_version") == version and row.get("prompt_version") == _prompt_version(mode) else None
+
+def _save_blueprint(vdir: Path, version: str, mode: str, answer: str, llm: Dict[str, Any],
+                    context: Optional[Dict[str, Any]] = None) -> None:
+    if not version:
+        return
+    path = _blueprint_path(vdir, mode)
+    path.parent.mkdir(exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps({"mode": mode, "index_version": version, "prompt_version": _prompt_version(mode),
+                               "answer": answer, "llm": llm, "context": context, "created": time.time()},
+                              ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _stored_result(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"answer": row["answer"], "llm": {**row.get("llm", {}), "cached": True},
+            "context": row.get("context"), "precomputed": True, "created": row.get("created")}
+
+def generate_blueprint(repo_dir, mode: BlueprintMode, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Returns {"answer", "llm", "context", "precomputed"} where llm holds latency/retries/usage of the call
+    and context the prompt's token counts.
+    Served from data/<repo_id>/.../blueprints/<mode>.json when it matches the index version;
+    refresh=True regenerates (bypassing the LLM cache) and overwrites it.
+    """
+    row = None if refresh else load_blueprint(repo_dir, mode)
+    if row is not None:
+        return _stored_result(row)
+    r = get_retriever(repo_dir)
+    out = r.answer_with_stats(**_query(mode), cache=not refresh)
+    _save_blueprint(r.repo_dir, r.bm25.version, mode, out["answer"], out["llm"], out["context"])
+    return {**out, "precomputed": False}
+
+class BlueprintStream:
+    """ChatStream-compatible: replays a stored blueprint, or streams a fresh one and stores it when complete."""
+    def __init__(self, row: Optional[Dict[str, Any]] = None, live: Optional[ChatStream] = None,
+                 vdir: Optional[Path] = None, version: str = "", mode: str = ""):
+        self._row, self._live, self._vdir, self._version, self._mode = row, live, vdir, version, mode
+        self.result: Optional[ChatResult] = None
+        self.context = row.get("context") if row is not None else live.context
+
+    def __iter__(self) -> Iterator[str]:
+        if self._row is not None:
+            stored = self._row.get("llm", {})
+            self.result = ChatResult(text=self._row["answer"], latency=0.0, retries=0,
+                                     usage=stored.get("usage") or {}, cached=True, ttft=0.0)
+            yield self._row["answer"]
+            return
+        yield from self._live
+        self.result = self._live.result
+        _save_blueprint(self._vdir, self._version, self._mode, self.result.text, self.result.stats(), self.context)
+
+def stream_blueprint(repo_dir, mode: BlueprintMode, refresh: bool = False) -> BlueprintStream:
+    """Streaming generate_blueprint(); shares its stored blueprints and LLM cache entries."""
+    row = None if refresh else load_blueprint(repo_dir, mode)
+    if row is not None:
+        return BlueprintStream(row=row)
+    r = get_retriever(repo_dir)
+    return BlueprintStream(live=r.answer_stream(**_query(mode), cache=not refresh),
+                           vdir=r.repo_dir, version=r.bm25.version, mode=mode)
+
+def precompute_blueprints(repo_dir, modes: Dict[str, bool], refresh: bool = False,
+                          progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """
+    Generate and store the blueprints of every enabled mode in parallel (ingest stage).
+    Modes whose blueprint is already stored for this index version are skipped unless refresh=True.
+    A failing mode is reported, not raised: it can still be generated on demand.
+    """
+    report = progress or (lambda stage, **counters: None)
+    todo = [m for m in BLUEPRINT_MODES if modes.get(m) and (refresh or load_blueprint(repo_dir, m) is None)]
+    t0, done, failed = time.perf_counter(), [], {}
+    report("blueprints", blueprints_total=len(todo), blueprints_done=0)
+    if todo:
+        with ThreadPoolExecutor(max_workers=len(todo), thread_name_prefix="blueprint") as pool:
+            futures = {m: pool.submit(generate_blueprint, repo_dir, m, refresh) for m in todo}
+            for m, fut in futures.items():
+                try:
+                    fut.result()
+                    done.append(m)
+                except Exception as e:
+                    failed[m] = str(e)
+                report("blueprints", blueprints_done=len(done) + len(failed))
+    return {"generated": done, "failed": failed,
+            "skipped": [m for m in BLUEPRINT_MODES if m not in todo],
+            "seconds": round(time.perf_counter() - t0, 3)}
@@ -0,0 +1,454 @@
+"""
+On-disk BM25 (Okapi) inverted index, scored identically to rank_bm25.BM25Okapi.
+
+Layout of <repo_dir>/bm25/ (all flat .npy arrays, opened with mmap):
+    meta.json          format, n_docs, avgdl, k1, b, epsilon, idf_mean, version, analyzer (see analyzer.py)
+    terms.npy          uint8   utf-8 bytes of the sorted vocabulary, concatenated
+    term_offsets.npy   uint64  (V+1) byte offsets of each term into terms.npy
+    idf.npy            float64 (V)   precomputed IDF per term
+    postings_ptr.npy   int64   (V+1) slice of postings_doc/postings_tf per term
+    postings_doc.npy   int32   doc ids, ascending within each term
+    postings_tf.npy    uint32  term frequency in that doc
+    doc_len.npy        int32   (N)   tokens per doc
+    term_max.npy       float64 (V)   max BM25 contribution of each term (MaxScore bound)
+"""
+import copy, json, os, shutil
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+import numpy as np
+
+INDEX_FORMAT = 1
+K1, B, EPSILON = 1.5, 0.75, 0.25   # rank_bm25 defaults
+ARRAYS = ("terms", "term_offsets", "idf", "postings_ptr", "postings_doc", "postings_tf", "doc_len")
+OPTIONAL_ARRAYS = ("term_max",)
+PRUNE = os.getenv("BM25_PRUNE", "1") == "1"
+
+def build_arrays(tokenized: Iterable[List[str]]) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    ids: Dict[str, int] = {}
+    t, d, f = [], [], []
+    doc_len: List[int] = []
+    for doc_id, toks in enumerate(tokenized):
+        doc_len.append(len(toks))
+        for term, tf in Counter(toks).items():
+            t.append(ids.setdefault(term, len(ids)))
+            d.append(doc_id)
+            f.append(tf)
+    vocab = [term.encode("utf-8") for term in ids]   # insertion order == provisional id
+    return _assemble(vocab, np.asarray(t, dtype=np.int64), np.asarray(d, dtype=np.int32),
+                     np.asarray(f, dtype=np.uint32), np.asarray(doc_len, dtype=np.int32))
+
+def _assemble(vocab: List[bytes], t: np.ndarray, d: np.ndarray, f: np.ndarray,
+              doc_len: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Build the index arrays from (term id into `vocab`, doc, tf) triplets."""
+    # byte order == binary-search order; terms without postings are dropped
+    used = np.unique(t)
+    order = sorted(used.tolist(), key=lambda i: vocab[i])
+    remap = np.full(len(vocab), -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    encoded = [vocab[i] for i in order]
+    t = remap[t]
+    srt = np.lexsort((d, t))
+    t, d, f = t[srt], d[srt].astype(np.int32), f[srt].astype(np.uint32)
+
+    n_docs = len(doc_len)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+    ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(t, minlength=len(encoded)))
+    meta = {
+        "format": INDEX_FORMAT,
+        "n_docs": n_docs,
+        "avgdl": float(doc_len.sum() / n_docs) if n_docs else 0.0,
+        "k1": K1, "b": B, "epsilon": EPSILON,
+    }
+    idf = compute_idf(np.diff(ptr), n_docs)
+    meta["idf_mean"] = _idf_mean(idf)
+    arrays = {
+        "terms": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "term_offsets": offsets,
+        "idf": idf,
+        "postings_ptr": ptr,
+        "postings_doc": d,
+        "postings_tf": f,
+        "doc_len": doc_len.astype(np.int32),
+        "term_max": compute_term_max(ptr, d, f, doc_len, idf, meta["avgdl"] or 1.0),
+    }
+    return arrays, meta
+
+def compute_term_max(ptr, docs, tfs, doc_len, idf, avgdl) -> np.ndarray:
+    if not len(docs):
+        return np.zeros(len(idf))
+    tf = tfs.astype(np.float64)
+    dl = doc_len[docs].astype(np.float64)
+    per_posting = tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+    # every term has at least one posting, so reduceat segments are non-empty
+    return idf * np.maximum.reduceat(per_posting, ptr[:-1])
+
+def compute_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    # Same as BM25Okapi._calc_idf: negative IDFs are floored to epsilon * mean IDF
+    df = df.astype(np.float64)
+    idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+    if len(idf):
+        idf[idf < 0] = EPSILON * float(idf.mean())
+    return idf
+
+def _idf_mean(idf: np.ndarray) -> float:
+    # vocabulary mean of the floored IDFs; federated search weighs shards by it without reading idf.npy
+    return float(idf.mean()) if len(idf) else 0.0
+
+def _publish(tmp: Path, index_dir: Path) -> None:
+    # never overwrite arrays in place: live Retrievers may have them mmapped
+    old = index_dir.with_name(index_dir.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if index_dir.exists():
+        index_dir.rename(old)
+    tmp.rename(index_dir)
+    shutil.rmtree(old, ignore_errors=True)
+
+def save_index(index_dir: Path, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+    tmp = index_dir.with_name(index_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name in ARRAYS + OPTIONAL_ARRAYS:
+        np.save(tmp / f"{name}.npy", arrays[name])
+    (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    _publish(tmp, index_dir)
+
+class IndexBuilder:
+    """
+    Streaming index writer with bounded memory. Postings are buffered as (term, doc, tf)
+    triplets and spilled to segment files once `buffer_bytes` is reached; finish() merges
+    the segments with a two-pass counting sort straight into memory-mapped output arrays.
+    Resident memory is the buffer plus the vocabulary and one int32 per doc.
+    """
+    SEGMENTS = (("seg_t.bin", np.int64), ("seg_d.bin", np.int32), ("seg_f.bin", np.uint32))
+
+    def __init__(self, index_dir: Path, buffer_bytes: int = 64 << 20):
+        self.index_dir = index_dir
+        self.tmp = index_dir.with_name(index_dir.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.ids: Dict[str, int] = {}
+        self.doc_len = array("i")
+        self._buf = (array("q"), array("i"), array("I"))
+        self._limit = max(1024, buffer_bytes // 16)   # 16 bytes per buffered triplet
+        self._files = [open(self.tmp / name, "ab") for name, _ in self.SEGMENTS]
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, tf: Dict[str, int], length: int) -> int:
+        doc = len(self.doc_len)
+        self.doc_len.append(length)
+        t, d, f = self._buf
+        for term, n in tf.items():
+            i = self.ids.get(term)
+            if i is None:
+                i = self.ids[term] = len(self.ids)
+            t.append(i); d.append(doc); f.append(n)
+        if len(t) >= self._limit:
+            self._flush()
+        return doc
+
+    def add_existing(self, index: "BM25Index", keep: np.ndarray, block: int = 1 << 20) -> None:
+        """Carry over the postings of docs with keep[doc] from an existing index, renumbered
+        in order. Must be called before add(); nothing is re-tokenized."""
+        if self.doc_len:
+            raise RuntimeError("add_existing() must come before add()")
+        self._flush()
+        renum = (np.cumsum(keep) - 1).astype(np.int32)
+        self.doc_len.frombytes(np.asarray(index.doc_len)[keep].astype(np.int32).tobytes())
+        term_ids = np.fromiter((self.ids.setdefault(index._term(i).decode("utf-8"), len(self.ids))
+                                for i in range(index.n_terms)), dtype=np.int64, count=index.n_terms)
+        ptr = np.asarray(index.postings_ptr)
+        total = int(ptr[-1])
+        for s in range(0, total, block):
+            e = min(s + block, total)
+            d = np.asarray(index.postings_doc[s:e])
+            live = keep[d]
+            t = term_ids[np.searchsorted(ptr, np.arange(s, e), side="right") - 1]
+            self._write(t[live], renum[d[live]], np.asarray(index.postings_tf[s:e])[live])
+
+    def _write(self, t: np.ndarray, d: np.ndarray, f: np.ndarray) -> None:
+        for fh, arr, (_, dtype) in zip(self._files, (t, d, f), self.SEGMENTS):
+            np.asarray(arr, dtype=dtype).tofile(fh)
+
+    def _flush(self) -> None:
+        for fh, buf in zip(self._files, self._buf):
+            buf.tofile(fh)
+            del buf[:]
+
+    def _segment(self, i: int) -> np.ndarray:
+        name, dtype = self.SEGMENTS[i]
+        path = self.tmp / name
+        if path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def finish(self, version: str = "", analyzer: Optional[Dict[str, Any]] = None,
+               block: int = 1 << 20) -> Dict[str, Any]:
+        self._flush()
+        for fh in self._files:
+            fh.close()
+        seg_t, seg_d, seg_f = (self._segment(i) for i in range(3))
+        n_post, n_docs = len(seg_t), len(self.doc_len)
+
+        # pass 1: document frequencies (each triplet is one (term, doc) pair)
+        df = np.zeros(len(self.ids), dtype=np.int64)
+        for s in range(0, n_post, block):
+            df += np.bincount(seg_t[s:s + block], minlength=len(self.ids))
+        vocab = [term.encode("utf-8") for term in self.ids]
+        order = sorted(np.flatnonzero(df).tolist(), key=lambda i: vocab[i])
+        remap = np.full(len(vocab), -1, dtype=np.int64)
+        remap[order] = np.arange(len(order))
+        encoded = [vocab[i] for i in order]
+        df = df[order]
+
+        doc_len = np.frombuffer(self.doc_len, dtype=np.int32) if n_docs else np.empty(0, dtype=np.int32)
+        avgdl = float(doc_len.sum() / n_docs) if n_docs else 0.0
+        idf = compute_idf(df, n_docs)
+        ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(df)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+
+        # pass 2: counting sort into place; segments are in doc order, so a stable sort
+        # per block keeps each term's postings ascending by doc
+        out_d = _open_out(self.tmp / "postings_doc.npy", np.int32, n_post)
+        out_f = _open_out(self.tmp / "postings_tf.npy", np.uint32, n_post)
+        cursor = ptr[:-1].copy()
+        best = np.zeros(len(encoded))   # max per-posting BM25 factor per term
+        norm = K1 * (1 - B + B * doc_len.astype(np.float64) / (avgdl or 1.0))
+        for s in range(0, n_post, block):
+            t = remap[np.asarray(seg_t[s:s + block])]
+            o = np.argsort(t, kind="stable")
+            t, d, f = t[o], np.asarray(seg_d[s:s + block])[o], np.asarray(seg_f[s:s + block])[o]
+            counts = np.bincount(t, minlength=len(encoded))
+            pos = cursor[t] + np.arange(len(t)) - (np.cumsum(counts) - counts)[t]
+            out_d[pos], out_f[pos] = d, f
+            cursor += counts
+            tf = f.astype(np.float64)
+            np.maximum.at(best, t, tf * (K1 + 1) / (tf + norm[d]))
+        for out in (out_d, out_f):
+            if isinstance(out, np.memmap):
+                out.flush()
+        del out_d, out_f, seg_t, seg_d, seg_f
+
+        meta = {
+            "format": INDEX_FORMAT,
+            "n_docs": n_docs,
+            "avgdl": avgdl,
+            "k1": K1, "b": B, "epsilon": EPSILON,
+            "idf_mean": _idf_mean(idf),
+            "version": version,
+            "analyzer": analyzer,
+        }
+        arrays = {
+            "terms": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "term_offsets": offsets,
+            "idf": idf,
+            "postings_ptr": ptr,
+            "doc_len": doc_len,
+            "term_max": idf * best,
+        }
+        for name, arr in arrays.items():
+            np.save(self.tmp / f"{name}.npy", arr)
+        (self.tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        for name, _ in self.SEGMENTS:
+            (self.tmp / name).unlink()
+        _publish(self.tmp, self.index_dir)
+        return meta
+
+    def abort(self) -> None:
+        for fh in self._files:
+            fh.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def _open_out(path: Path, dtype, n: int) -> np.ndarray:
+    if n == 0:
+        np.save(path, np.empty(0, dtype=dtype))
+        return np.empty(0, dtype=dtype)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n,))
+
+def write_index(index_dir: Path, tokenized: Iterable[List[str]], version: str = "",
+                analyzer: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    arrays, meta = build_arrays(tokenized)
+    meta["version"] = version
+    meta["analyzer"] = analyzer
+    save_index(index_dir, arrays, meta)
+    return meta
+
+class BM25Index:
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        self.meta = meta
+        self.n_docs = int(meta["n_docs"])
+        self.avgdl = float(meta["avgdl"]) or 1.0
+        self.k1, self.b = float(meta["k1"]), float(meta["b"])
+        self.version = meta.get("version", "")
+        self.analyzer = meta.get("analyzer")   # spec the docs were tokenized with; None = whitespace
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.term_max = arrays.get("term_max")   # absent in indexes written before pruning
+        self.n_terms = len(self.term_offsets) - 1
+
+    @classmethod
+    def open(cls, index_dir: Path) -> "BM25Index":
+        meta = json.loads((index_dir / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Unsupported BM25 index format {meta.get('format')} in {index_dir}")
+        arrays = {name: np.load(index_dir / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        for name in OPTIONAL_ARRAYS:
+            if (index_dir / f"{name}.npy").exists():
+                arrays[name] = np.load(index_dir / f"{name}.npy", mmap_mode="r")
+        return cls(arrays, meta)
+
+    @classmethod
+    def from_tokenized(cls, tokenized: Iterable[List[str]]) -> "BM25Index":
+        # legacy indexes (tokenized.json) are converted in memory
+        arrays, meta = build_arrays(tokenized)
+        return cls(arrays, meta)
+
+    def with_stats(self, idf: Dict[str, float], avgdl: float) -> "BM25Index":
+        """
+        A view scored with external term statistics (e.g. IDF and average length over several
+        indexes, so their scores are comparable). Only the terms in `idf` can be scored through it.
+        """
+        view = copy.copy(self)
+        view.avgdl = avgdl or 1.0
+        view.idf = {tid: w for tid, w in ((self.term_id(t), w) for t, w in idf.items()) if tid >= 0}
+        view.term_max = {}
+        for tid, w in view.idf.items():
+            local = float(self.idf[tid])
+            if self.term_max is not None and local > 0 and view.avgdl <= self.avgdl:
+                # a shorter average length only lowers the tf part, so the stored maximum still bounds it
+                view.term_max[tid] = float(self.term_max[tid]) / local * w
+            else:
+                view.term_max[tid] = float(view.contributions(tid)[1].max())
+        return view
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self.terms[int(self.term_offsets[i]):int(self.term_offsets[i + 1])])
+
+    def term_id(self, term: str) -> int:
+        # binary search over the mmapped vocabulary; touches O(log V) pages
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self._term(lo) == key else -1
+
+    def postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        s, e = int(self.postings_ptr[tid]), int(self.postings_ptr[tid + 1])
+        return np.asarray(self.postings_doc[s:e]), np.asarray(self.postings_tf[s:e], dtype=np.float64)
+
+    def contributions(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        docs, tf = self.postings(tid)
+        return docs, self._bm25(tid, docs, tf)
+
+    def _bm25(self, tid: int, docs: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        dl = np.asarray(self.doc_len[docs], dtype=np.float64)
+        denom = tf + self.k1 * (1 - self.b + self.b * dl / self.avgdl)
+        return float(self.idf[tid]) * (tf * (self.k1 + 1) / denom)
+
+    def _contributions_for(self, tid: int, cand: np.ndarray) -> np.ndarray:
+        # score only the candidate docs (sorted) that appear in this term's postings
+        s, e = int(self.postings_ptr[tid]), int(self.postings_ptr[tid + 1])
+        docs = self.postings_doc[s:e]
+        pos = np.searchsorted(docs, cand)
+        hit = pos < len(docs)
+        hit[hit] = np.asarray(docs[pos[hit]]) == cand[hit]
+        out = np.zeros(len(cand))
+        if hit.any():
+            tf = np.asarray(self.postings_tf[s:e][pos[hit]], dtype=np.float64)
+            out[hit] = self._bm25(tid, cand[hit], tf)
+        return out
+
+    def _upper_bound(self, tid: int) -> float:
+        if self.term_max is not None:
+            return float(self.term_max[tid])
+        return float(self.contributions(tid)[1].max())
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        scores = np.zeros(self.n_docs)
+        for tok in tokens:   # duplicates count twice, as in BM25Okapi
+            tid = self.term_id(tok)
+            if tid < 0:
+                continue
+            docs, contrib = self.contributions(tid)
+            scores[docs] += contrib
+        return scores
+
+    def topk(self, tokens: List[str], k: int, prune: bool = PRUNE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Term-at-a-time top-k over the query terms' postings only.
+        Returns (doc_ids, scores) ranked exactly like a full get_scores() + stable sort:
+        score descending, ties by ascending doc id, zero-score docs fill up to k.
+        With prune=True, MaxScore stops admitting new candidates once the remaining
+        terms' upper bounds cannot lift an unseen doc above the current k-th score.
+        """
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        weights = Counter(t for t in (self.term_id(tok) for tok in tokens) if t >= 0)
+        terms = [(tid, w, w * self._upper_bound(tid)) for tid, w in weights.items()]
+        terms.sort(key=lambda x: x[2], reverse=True)
+        # pruning is only sound when no contribution can be negative
+        prune = prune and all(float(self.idf[tid]) >= 0 for tid, _, _ in terms)
+        # upper bound of everything from term i onwards (with slack for float rounding)
+        bounds = [sum(ub for _, _, ub in terms[i:]) * (1 + 1e-9) for i in range(len(terms) + 1)]
+
+        cand = np.empty(0, dtype=np.int64)
+        cand_scores = np.empty(0)
+        for i, (tid, w, _) in enumerate(terms):
+            theta = _kth_largest(cand_scores, k) if prune else None
+            if theta is not None and bounds[i] < theta:
+                # non-essential term: unseen docs can't reach top-k, only update candidates
+                cand_scores += w * self._contributions_for(tid, cand)
+                keep = cand_scores + bounds[i + 1] >= theta
+                cand, cand_scores = cand[keep], cand_scores[keep]
+            else:
+                docs, contrib = self.contributions(tid)
+                all_docs = np.concatenate([cand, docs.astype(np.int64)])
+                cand, inv = np.unique(all_docs, return_inverse=True)
+                cand_scores = np.bincount(inv, weights=np.concatenate([cand_scores, w * contrib]),
+                                          minlength=len(cand))
+
+        matched = cand
+        if len(cand) > k:
+            theta = _kth_largest(cand_scores, k)
+            sel = cand_scores >= theta   # keep boundary ties; doc id decides below
+            cand, cand_scores = cand[sel], cand_scores[sel]
+        if len(cand) < min(k, self.n_docs) or (len(cand) and cand_scores.min() <= 0):
+            # unmatched docs score 0 and fill remaining slots in doc-id order (they also
+            # tie with, and can outrank by id, matched docs at zero, e.g. a term with IDF 0)
+            pad = np.setdiff1d(np.arange(min(self.n_docs, k + len(matched)), dtype=np.int64), matched)[:k]
+            cand = np.concatenate([cand, pad])
+            cand_scores = np.concatenate([cand_scores, np.zeros(len(pad))])
+        order = np.lexsort((cand, -cand_scores))[:k]
+        return cand[order], cand_scores[order]
+
+    def resident_bytes(self) -> int:
+        # mmapped arrays are paged in on demand and not counted
+        names = ARRAYS + OPTIONAL_ARRAYS
+        return sum(a.nbytes for a in (getattr(self, n) for n in names)
+                   if a is not None and not isinstance(a, np.memmap))
+
+def _kth_largest(scores: np.ndarray, k: int) -> Optional[float]:
+    if len(scores) < k:
+        return None
+    return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+def open_index(repo_dir: Path) -> Optional[BM25Index]:
+    """Open <repo_dir>/bm25/, falling back to a legacy tokenized.json; None if neither exists."""
+    if (repo_dir / "bm25" / "meta.json").exists():
+        return BM25Index.open(repo_dir / "bm25")
+    tok_path = repo_dir / "tokenized.json"
+    if tok_path.exists():
+        return BM25Index.from_tokenized(json.loads(tok_path.read_text(encoding="utf-8")))
+    return None
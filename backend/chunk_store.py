@@ -0,0 +1,209 @@
+"""
+Compressed chunk store: chunk texts and metadata, read back a few rows at a time.
+
+Layout of <repo_dir>/chunks/ (written at ingest, opened with mmap):
+    meta.json          format, n_docs, n_files, n_blocks, codec, raw/stored bytes, version
+    blocks.bin         zlib blocks of concatenated utf-8 chunk texts, back to back
+    block_ptr.npy      int64   (B+1)  byte range of each block in blocks.bin
+    block_docs.npy     int64   (B+1)  first doc of each block (blocks end on chunk boundaries)
+    text_end.npy       uint32  (N)    end of each chunk's text in its decompressed block
+    doc_file.npy       int32   (N)    row of files.json the chunk belongs to
+    doc_pos.npy        int32   (N, 5) chunk_id, start_line, end_line, start_byte, end_byte
+    files.json         [{path, tags, summary}] per-file metadata, stored once
+
+Only files.json is held in memory; a lookup decompresses the (CHUNK_BLOCK_BYTES) blocks
+holding the requested docs. Indexes written before the store keep their corpus.jsonl, whose
+rows are located by byte offset and parsed on demand (JsonlChunks).
+"""
+import os, sys, json, zlib, shutil, hashlib, threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+import numpy as np
+from .bm25_index import _publish
+
+STORE_FORMAT = 1
+CHUNK_BLOCK_BYTES = int(os.getenv("CHUNK_BLOCK_BYTES", "65536"))   # uncompressed text per block
+ZLIB_LEVEL = 6
+POS_FIELDS = ("chunk_id", "start_line", "end_line", "start_byte", "end_byte")
+ARRAYS = ("block_ptr", "block_docs", "text_end", "doc_file", "doc_pos")
+
+def _object_bytes(obj: Any) -> int:
+    # a parsed JSON value: containers plus their contents (dict keys are shared and not counted)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_object_bytes(v) for v in obj.values())
+    if isinstance(obj, list):
+        return sys.getsizeof(obj) + sum(_object_bytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class ChunkWriter:
+    """
+    Streaming store writer. Texts are buffered until a block is full and appended compressed,
+    so resident memory is one block plus a few ints per chunk; file tags and summaries are
+    only known after tagging and are passed to finish().
+    """
+    def __init__(self, store_dir: Path, block_bytes: int = CHUNK_BLOCK_BYTES):
+        self.store_dir, self.block_bytes = store_dir, max(1, block_bytes)
+        self.tmp = store_dir.with_name(store_dir.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.files: Dict[str, int] = {}   # path -> file id, first-seen order
+        self.n_docs = 0
+        self.raw_bytes = 0
+        self._block = bytearray()
+        self._text_end, self._doc_file, self._doc_pos = array("I"), array("i"), array("i")
+        self._block_ptr, self._block_docs = array("q", [0]), array("q", [0])
+        self._digest = hashlib.sha1()
+        self._fh = open(self.tmp / "blocks.bin", "ab")
+
+    def add(self, text: str, meta: Dict[str, Any]) -> int:
+        """Append one chunk (meta: path plus POS_FIELDS); returns its doc id."""
+        doc = self.n_docs
+        data = text.encode("utf-8")
+        self._block += data
+        self._text_end.append(len(self._block))
+        self._doc_file.append(self.files.setdefault(meta["path"], len(self.files)))
+        self._doc_pos.extend(int(meta.get(k, 0)) for k in POS_FIELDS)
+        self._digest.update(json.dumps([meta["path"], [meta.get(k, 0) for k in POS_FIELDS]]).encode("utf-8"))
+        self._digest.update(data)
+        self.n_docs += 1
+        self.raw_bytes += len(data)
+        if len(self._block) >= self.block_bytes:
+            self._flush()
+        return doc
+
+    def _flush(self) -> None:
+        if self._block_docs[-1] == self.n_docs:
+            return
+        z = zlib.compress(bytes(self._block), ZLIB_LEVEL)
+        self._fh.write(z)
+        self._block_ptr.append(self._block_ptr[-1] + len(z))
+        self._block_docs.append(self.n_docs)
+        self._block = bytearray()
+
+    def finish(self, file_meta: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Write the arrays and the file table (tags/summary from file_meta, keyed by path) and publish."""
+        self._flush()
+        self._fh.close()
+        file_meta = file_meta or {}
+        table = [{"path": p, "tags": file_meta.get(p, {}).get("tags", []),
+                  "summary": file_meta.get(p, {}).get("summary", "")} for p in self.files]
+        body = json.dumps(table, ensure_ascii=False)
+        self._digest.update(body.encode("utf-8"))
+        (self.tmp / "files.json").write_text(body, encoding="utf-8")
+        arrays = {
+            "block_ptr": np.frombuffer(self._block_ptr, dtype=np.int64),
+            "block_docs": np.frombuffer(self._block_docs, dtype=np.int64),
+            "text_end": np.frombuffer(self._text_end, dtype=np.uint32),
+            "doc_file": np.frombuffer(self._doc_file, dtype=np.int32),
+            "doc_pos": np.frombuffer(self._doc_pos, dtype=np.int32).reshape(-1, len(POS_FIELDS)),
+        }
+        for name, arr in arrays.items():
+            np.save(self.tmp / f"{name}.npy", arr)
+        meta = {"format": STORE_FORMAT, "n_docs": self.n_docs, "n_files": len(table),
+                "n_blocks": len(self._block_ptr) - 1, "codec": "zlib",
+                "raw_bytes": self.raw_bytes, "stored_bytes": int(self._block_ptr[-1]),
+                "version": self._digest.hexdigest()[:16]}
+        (self.tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        _publish(self.tmp, self.store_dir)
+        return meta
+
+    def abort(self) -> None:
+        self._fh.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+class ChunkStore:
+    def __init__(self, store_dir: Path):
+        self.meta = json.loads((store_dir / "meta.json").read_text(encoding="utf-8"))
+        if self.meta.get("format") != STORE_FORMAT:
+            raise ValueError(f"Unsupported chunk store format {self.meta.get('format')} in {store_dir}")
+        self.n_docs = int(self.meta["n_docs"])
+        self.version = self.meta.get("version", "")
+        blocks = store_dir / "blocks.bin"
+        self.blocks = (np.memmap(blocks, dtype=np.uint8, mode="r") if blocks.stat().st_size
+                       else np.empty(0, dtype=np.uint8))
+        for name in ARRAYS:
+            setattr(self, name, np.load(store_dir / f"{name}.npy", mmap_mode="r"))
+        self.files: List[Dict[str, Any]] = json.loads((store_dir / "files.json").read_text(encoding="utf-8"))
+        self._files_bytes = _object_bytes(self.files)
+
+    def _block(self, b: int) -> bytes:
+        return zlib.decompress(self.blocks[int(self.block_ptr[b]):int(self.block_ptr[b + 1])].tobytes())
+
+    def _meta(self, d: int) -> Dict[str, Any]:
+        f = self.files[int(self.doc_file[d])]
+        return {"path": f["path"], **dict(zip(POS_FIELDS, map(int, self.doc_pos[d]))),
+                "tags": list(f["tags"]), "summary": f["summary"]}
+
+    def rows(self, docs: Sequence[int]) -> List[Dict[str, Any]]:
+        """[{text, meta}] for docs, in the given order; each block involved is decompressed once."""
+        docs = [int(d) for d in docs]
+        blocks: Dict[int, bytes] = {}
+        out = []
+        for d, b in zip(docs, np.searchsorted(self.block_docs, docs, side="right") - 1):
+            b = int(b)
+            if b not in blocks:
+                blocks[b] = self._block(b)
+            start = 0 if d == self.block_docs[b] else int(self.text_end[d - 1])
+            out.append({"text": blocks[b][start:int(self.text_end[d])].decode("utf-8"), "meta": self._meta(d)})
+        return out
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Every row in doc order, one block in memory at a time."""
+        for b in range(len(self.block_ptr) - 1):
+            raw, start = self._block(b), 0
+            for d in range(int(self.block_docs[b]), int(self.block_docs[b + 1])):
+                end = int(self.text_end[d])
+                yield {"text": raw[start:end].decode("utf-8"), "meta": self._meta(d)}
+                start = end
+
+    def resident_bytes(self) -> int:
+        # mmapped arrays are paged in on demand and not counted; the file table is always in memory
+        arrays = [self.blocks, *(getattr(self, n) for n in ARRAYS)]
+        return sum(a.nbytes for a in arrays if not isinstance(a, np.memmap)) + self._files_bytes
+
+class JsonlChunks:
+    """corpus.jsonl of an index written before the chunk store, read by row offset."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.version = ""
+        self._offsets: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _line_offsets(self) -> np.ndarray:
+        # byte offset of every row, found once with a block-wise newline scan
+        with self._lock:
+            if self._offsets is None:
+                starts, base = [np.zeros(1, dtype=np.int64)], 0
+                with self.path.open("rb") as fh:
+                    while block := fh.read(16 << 20):
+                        starts.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + base + 1)
+                        base += len(block)
+                self._offsets = np.concatenate(starts)
+            return self._offsets
+
+    def rows(self, docs: Sequence[int]) -> List[Dict[str, Any]]:
+        offsets = self._line_offsets()
+        out = []
+        with self.path.open("rb") as fh:
+            for d in docs:
+                fh.seek(int(offsets[d]))
+                out.append(json.loads(fh.readline()))
+        return out
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with self.path.open("r", encoding="utf-8") as fh:
+            for line in fh:
+                yield json.loads(line)
+
+    def resident_bytes(self) -> int:
+        offsets = self._offsets
+        return offsets.nbytes if offsets is not None else 0
+
+def open_chunks(repo_dir: Path) -> Optional[Union[ChunkStore, JsonlChunks]]:
+    """Open <repo_dir>/chunks/, falling back to a legacy corpus.jsonl; None if neither exists."""
+    if (repo_dir / "chunks" / "meta.json").exists():
+        return ChunkStore(repo_dir / "chunks")
+    if (repo_dir / "corpus.jsonl").exists():
+        return JsonlChunks(repo_dir / "corpus.jsonl")
+    return None
@@ -0,0 +1,150 @@
+"""
+Line- and definition-aware chunking. Files are split into lines, every line is token-counted
+in one encode_ordinary_batch() call per batch of files, and lines are packed into chunks of at most
+CHUNK_TOKENS tokens, preferring to cut at top-level definitions (def/class/func/fn/…, markdown
+headings). Each chunk records 1-based inclusive start_line/end_line and [start_byte, end_byte)
+UTF-8 offsets into the file. A single line longer than the budget is split on token boundaries.
+"""
+import os, re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from tiktoken import get_encoding
+
+ENC = get_encoding("cl100k_base")
+
+CHUNK_TOKENS  = int(os.getenv("CHUNK_TOKENS", "450"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))   # tokens of trailing lines repeated at the next chunk's start
+CHUNKER_VERSION = 2   # bump when chunk boundaries change; forces a full re-ingest
+
+_LINE = re.compile(r"[^\n]*\n|[^\n]+")
+
+_C_COMMENTS = ("//", "/*", "*", "///")
+_JS_DEF = r"(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:async\s+)?(?:function\*?|class|interface|type|enum|const|let|var)\b"
+_JVM_DEF = r"(?:@|(?:(?:public|private|protected|internal|abstract|final|sealed|data|open|static|case)\s+)*(?:class|interface|object|enum|record|trait|fun|def)\b)"
+_C_DEF = r"(?:struct|class|namespace|template|typedef|enum|union)\b|[A-Za-z_][\w:<>,\*& ]*[\s\*&]\**[A-Za-z_~][\w:]*\s*\([^;]*$"
+# ext -> (top-level definition pattern matched at column 0, comment prefixes that stick to the definition)
+BOUNDARIES: Dict[str, Tuple[re.Pattern, Tuple[str, ...]]] = {
+    ".py":  (re.compile(r"(?:async\s+def|def|class)\s|@"), ("#",)),
+    ".js":  (re.compile(_JS_DEF), _C_COMMENTS),
+    ".jsx": (re.compile(_JS_DEF), _C_COMMENTS),
+    ".ts":  (re.compile(_JS_DEF), _C_COMMENTS),
+    ".tsx": (re.compile(_JS_DEF), _C_COMMENTS),
+    ".go":  (re.compile(r"(?:func|type|var|const)\b"), ("//",)),
+    ".rs":  (re.compile(r"(?:#\[|(?:pub(?:\([^)]*\))?\s+)?(?:async\s+|unsafe\s+)?(?:fn|struct|enum|trait|impl|mod|type|const|static|macro_rules!))"), ("//",)),
+    ".java": (re.compile(_JVM_DEF), _C_COMMENTS),
+    ".kt":   (re.compile(_JVM_DEF), _C_COMMENTS),
+    ".scala": (re.compile(_JVM_DEF), _C_COMMENTS),
+    ".c":   (re.compile(_C_DEF), _C_COMMENTS),
+    ".h":   (re.compile(_C_DEF), _C_COMMENTS),
+    ".cpp": (re.compile(_C_DEF), _C_COMMENTS),
+    ".hpp": (re.compile(_C_DEF), _C_COMMENTS),
+    ".md":  (re.compile(r"#{1,6}\s"), ()),
+}
+
+def _boundaries(path: str, lines: List[str]) -> List[bool]:
+    """bounds[i] = a chunk may preferably start at line i."""
+    ext = os.path.splitext(path)[1].lower()
+    rule = BOUNDARIES.get(ext)
+    bounds = [False] * len(lines)
+    if rule is None:
+        return bounds
+    pat, comments = rule
+    prev = False
+    for i, line in enumerate(lines):
+        hit = pat.match(line) is not None
+        if hit and not prev:   # "@decorator\ndef f" and runs of consts start one unit
+            j = i
+            while j > 0 and comments and lines[j - 1].lstrip().startswith(comments):
+                j -= 1         # leading comment block belongs to the definition below it
+            bounds[j] = True
+        prev = hit
+    return bounds
+
+def _pack(counts: List[int], bounds: List[bool], max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Greedy packing of lines into [a, b) ranges: whole definition runs when they fit, else lines."""
+    n = len(counts)
+    starts = [0] + [i for i in range(1, n) if bounds[i]]
+    out: List[Tuple[int, int]] = []
+    a = b = fresh = 0   # current chunk is [a, b); lines before `fresh` are overlap from the previous one
+    cur = 0
+
+    def emit():
+        nonlocal a, cur, fresh
+        out.append((a, b))
+        a, cur = b, 0
+        while a > out[-1][0] + 1 and cur + counts[a - 1] <= overlap:   # never repeat the whole chunk
+            a -= 1
+            cur += counts[a]
+        fresh = b
+
+    def fit(need: int):
+        # make room for `need` tokens: flush if there is new content, else drop overlap lines
+        nonlocal a, cur
+        if b > fresh:
+            emit()
+        while a < b and cur + need > max_tokens:
+            cur -= counts[a]
+            a += 1
+
+    for s, e in zip(starts, starts[1:] + [n]):
+        seg = sum(counts[s:e])
+        if cur + seg > max_tokens and b > a:
+            fit(seg)
+        if cur + seg <= max_tokens:
+            b, cur = e, cur + seg
+            continue
+        for i in range(s, e):   # definition longer than the budget: fall back to line granularity
+            if cur + counts[i] > max_tokens and b > a:
+                fit(counts[i])
+            b, cur = i + 1, cur + counts[i]
+    if b > fresh:
+        out.append((a, b))
+    return out
+
+def _split_long_line(line: str, line_no: int, start_byte: int, max_tokens: int) -> List[Dict[str, Any]]:
+    toks = ENC.encode_ordinary(line)
+    out = []
+    for i in range(0, len(toks), max_tokens):
+        raw = ENC.decode_bytes(toks[i:i + max_tokens])
+        out.append({"text": raw.decode("utf-8", errors="ignore"), "start_line": line_no, "end_line": line_no,
+                    "start_byte": start_byte, "end_byte": start_byte + len(raw)})
+        start_byte += len(raw)
+    return out
+
+def _chunk_lines(path: str, lines: List[str], counts: List[int], ascii_only: bool,
+                 max_tokens: int, overlap: int) -> List[Dict[str, Any]]:
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + (len(line) if ascii_only else len(line.encode("utf-8"))))
+    chunks = []
+    for a, b in _pack(counts, _boundaries(path, lines), max_tokens, overlap):
+        if b - a == 1 and counts[a] > max_tokens:
+            chunks.extend(_split_long_line(lines[a], a + 1, offsets[a], max_tokens))
+            continue
+        chunks.append({"text": "".join(lines[a:b]), "start_line": a + 1, "end_line": b,
+                       "start_byte": offsets[a], "end_byte": offsets[b]})
+    return chunks
+
+def chunk_texts(docs: Sequence[Tuple[str, str]], max_tokens: Optional[int] = None,
+                overlap: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Chunk many (path, text) pairs with a single batched token count over all their lines.
+    Returns one list of {"text", "start_line", "end_line", "start_byte", "end_byte"} per doc.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    overlap = min(CHUNK_OVERLAP if overlap is None else overlap, max_tokens // 2)
+    split = [_LINE.findall(text) for _, text in docs]
+    flat = [line for lines in split for line in lines]
+    counts = [len(t) for t in ENC.encode_ordinary_batch(flat)] if flat else []
+    out, pos = [], 0
+    for (path, text), lines in zip(docs, split):
+        out.append(_chunk_lines(path, lines, counts[pos:pos + len(lines)], text.isascii(), max_tokens, overlap))
+        pos += len(lines)
+    return out
+
+def chunk_text(text: str, path: str = "", max_tokens: Optional[int] = None,
+               overlap: Optional[int] = None) -> List[Dict[str, Any]]:
+    return chunk_texts([(path, text)], max_tokens, overlap)[0]
+
+def chunker_config() -> Dict[str, int]:
+    """Stored in state.json: an index built with different settings is rebuilt from scratch."""
+    return {"version": CHUNKER_VERSION, "tokens": CHUNK_TOKENS, "overlap": CHUNK_OVERLAP}
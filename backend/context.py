@@ -0,0 +1,142 @@
+"""
+Token-budgeted prompt context. Retrieved chunks are merged when they are adjacent in the same
+file, near-duplicates are dropped (MMR over word-shingle Jaccard), and the best evidence is
+packed into a per-mode token budget counted with the chunker's tiktoken encoding.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from .chunker import ENC
+
+CONTEXT_TOKENS     = int(os.getenv("CONTEXT_TOKENS", "3000"))      # default budget for retrieved evidence
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "24"))    # chunks retrieved before packing
+MMR_LAMBDA         = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))  # relevance vs. novelty
+DUP_THRESHOLD      = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.8"))  # shingle Jaccard above which a block is dropped
+MIN_PARTIAL_TOKENS = 120   # don't bother squeezing in a truncated block smaller than this
+SHINGLE = 3
+
+# evidence budget per mode; CONTEXT_TOKENS_<MODE> overrides one
+MODE_BUDGETS = {
+    mode: int(os.getenv(f"CONTEXT_TOKENS_{mode.upper()}", str(default)))
+    for mode, default in {"explain": CONTEXT_TOKENS, "stack": CONTEXT_TOKENS * 2 // 3,
+                          "run": CONTEXT_TOKENS, "deploy": CONTEXT_TOKENS, "test": CONTEXT_TOKENS * 2 // 3}.items()
+}
+
+def count_tokens(text: str) -> int:
+    return len(ENC.encode_ordinary(text))
+
+def prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    # chat framing adds ~4 tokens per message plus 3 for the reply primer
+    return sum(count_tokens(m["content"]) + 4 for m in messages) + 3
+
+def _header(i: int, meta: Dict[str, Any]) -> str:
+    lines = f" LINES={meta['start_line']}-{meta['end_line']}" if "start_line" in meta else ""
+    return f"[{i}] PATH={meta['path']}{lines} TAGS={meta.get('tags', [])}\n"
+
+def _adjacent(prev: Dict[str, Any], nxt: Dict[str, Any]) -> bool:
+    pm, nm = prev["meta"], nxt["meta"]
+    if "start_byte" in pm and "start_byte" in nm:
+        return nm["start_byte"] <= pm["end_byte"]   # touching or overlapping (CHUNK_OVERLAP)
+    return nm.get("chunk_id", -2) == pm.get("chunk_id", -9) + 1
+
+def _append(block: Dict[str, Any], hit: Dict[str, Any]) -> None:
+    bm, hm = block["meta"], hit["meta"]
+    text = hit["text"]
+    if "end_byte" in bm and hm.get("start_byte", bm["end_byte"]) < bm["end_byte"]:
+        raw = text.encode("utf-8")   # drop the part already present in the block
+        text = raw[bm["end_byte"] - hm["start_byte"]:].decode("utf-8", errors="ignore")
+    block["text"] += text
+    for k in ("end_line", "end_byte"):
+        if k in hm:
+            bm[k] = max(bm.get(k, hm[k]), hm[k])
+    bm["chunk_id"] = hm.get("chunk_id", bm.get("chunk_id"))
+    block["score"] = max(block["score"], hit["score"])
+    block["docs"].append(hit["doc"])
+
+def merge_adjacent(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fold hits that are consecutive in the same file into one block (score = best member)."""
+    by_pos = sorted(hits, key=lambda h: (h["meta"]["path"], h["meta"].get("start_byte", 0), h["meta"].get("chunk_id", 0)))
+    blocks: List[Dict[str, Any]] = []
+    for h in by_pos:
+        last = blocks[-1] if blocks else None
+        if last is not None and last["meta"]["path"] == h["meta"]["path"] and _adjacent(last, h):
+            _append(last, h)
+        else:
+            blocks.append({"text": h["text"], "meta": dict(h["meta"]), "score": h["score"], "docs": [h["doc"]]})
+    return sorted(blocks, key=lambda b: -b["score"])
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) < SHINGLE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)}
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _mmr(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Reorder by maximal marginal relevance; returns (kept, n_dropped_as_duplicates)."""
+    if not blocks:
+        return [], 0
+    top = max(b["score"] for b in blocks) or 1.0
+    sh = [_shingles(b["text"]) for b in blocks]
+    rest, picked, dropped = list(range(len(blocks))), [], 0
+    sim = [0.0] * len(blocks)   # max similarity to anything picked so far
+    while rest:
+        best = max(rest, key=lambda i: MMR_LAMBDA * blocks[i]["score"] / top - (1 - MMR_LAMBDA) * sim[i])
+        rest.remove(best)
+        if sim[best] >= DUP_THRESHOLD:
+            dropped += 1
+            continue
+        picked.append(best)
+        for i in rest:
+            sim[i] = max(sim[i], _jaccard(sh[best], sh[i]))
+    return [blocks[i] for i in picked], dropped
+
+def _truncate(block: Dict[str, Any], header: str, budget: int) -> Optional[Dict[str, Any]]:
+    """Keep the leading lines of `block` that fit in `budget` tokens (header included)."""
+    left = budget - count_tokens(header)
+    kept, used = [], 0
+    for line in block["text"].splitlines(keepends=True):
+        n = count_tokens(line)
+        if used + n > left:
+            break
+        kept.append(line)
+        used += n
+    if not kept:
+        return None
+    meta = dict(block["meta"])
+    if "start_line" in meta:
+        meta["end_line"] = meta["start_line"] + len(kept) - 1
+    if "start_byte" in meta:
+        meta["end_byte"] = meta["start_byte"] + len("".join(kept).encode("utf-8"))
+    return {**block, "text": "".join(kept), "meta": meta, "truncated": True}
+
+def build_context(hits: List[Dict[str, Any]], budget: int) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    hits: Retriever.topk() output. Returns (context_text, blocks_used, stats) where each block has
+    text/meta/score/docs and stats reports retrieved/merged/deduplicated/used counts and token totals.
+    """
+    hits = [h for h in hits if h["score"] > 0] or hits   # zero-score padding only if nothing matched
+    blocks = merge_adjacent(hits)
+    ranked, dropped = _mmr(blocks)
+    parts, used, tokens = [], [], 0
+    for b in ranked:
+        header = _header(len(used), b["meta"])
+        n = count_tokens(header) + count_tokens(b["text"])
+        if tokens + n > budget:
+            if budget - tokens < MIN_PARTIAL_TOKENS:
+                continue   # a smaller block further down may still fit
+            b = _truncate(b, header, budget - tokens)
+            if b is None:
+                continue
+            header = _header(len(used), b["meta"])
+            n = count_tokens(header) + count_tokens(b["text"])
+        parts.append(header + b["text"])
+        used.append(b)
+        tokens += n
+    stats = {"retrieved": len(hits), "blocks": len(blocks), "merged": len(hits) - len(blocks),
+             "duplicates": dropped, "used": len(used), "truncated": sum(1 for b in used if b.get("truncated")),
+             "context_tokens": tokens, "budget": budget}
+    return "\n\n".join(parts), used, stats
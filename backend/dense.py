@@ -0,0 +1,322 @@
+"""
+Optional dense retrieval, fused with BM25 by reciprocal rank.
+
+Layout of <repo_dir>/dense/ (written at ingest when DENSE_RETRIEVAL=1, opened with mmap):
+    meta.json          format, n_docs, dim, dtype, embedder (name, version, dim, model), ivf lists
+    vectors.npy        float16|int8 (N, dim)  L2-normalized chunk embeddings, chunks/ (doc id) order
+    scale.npy          float32 (N)            per-row dequantization scale (int8 only)
+    centroids.npy      float32 (L, dim)       IVF coarse centroids (only above DENSE_IVF_MIN_DOCS)
+    ivf_ptr.npy        int64   (L+1)          slice of ivf_docs per list
+    ivf_docs.npy       int32   (N)            doc ids grouped by list, ascending within a list
+
+Embedders are pluggable: "hashing" is an offline signed feature-hashing projection of the
+code analyzer's terms (deterministic, no model download; good for tests and as a lexical
+backstop), "sentence-transformers" runs a local model when that package is installed.
+"""
+import json, math, os, shutil, hashlib
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+import numpy as np
+from .analyzer import CodeAnalyzer, DEFAULT_STOPWORDS
+from .bm25_index import _publish
+
+DENSE_FORMAT = 1
+DENSE_RETRIEVAL   = os.getenv("DENSE_RETRIEVAL", "0") == "1"   # embed at ingest and fuse with BM25 at query time
+EMBEDDER          = os.getenv("EMBEDDER", "hashing")            # hashing | sentence-transformers
+EMBED_DIM         = int(os.getenv("EMBED_DIM", "256"))          # hashing embedder only
+EMBED_MODEL       = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BATCH       = int(os.getenv("EMBED_BATCH", "64"))         # chunks per embed() call at ingest
+DENSE_DTYPE       = os.getenv("DENSE_DTYPE", "float16")         # float16 | int8
+DENSE_IVF_MIN_DOCS = int(os.getenv("DENSE_IVF_MIN_DOCS", "50000"))  # brute force below this
+DENSE_IVF_NPROBE  = int(os.getenv("DENSE_IVF_NPROBE", "8"))     # lists scanned per query
+HYBRID_DEPTH      = int(os.getenv("HYBRID_DEPTH", "50"))        # candidates per retriever before fusion
+RRF_K             = int(os.getenv("RRF_K", "60"))
+IVF_SAMPLE = 50_000   # rows used to train the centroids
+IVF_ITERS = 10
+BLOCK = 1 << 16       # rows scored / copied per step
+
+class Embedder:
+    name = "base"
+    version = 1
+    dim = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """float32 (len(texts), dim), rows L2-normalized (all-zero rows stay zero)."""
+        raise NotImplementedError
+
+    def spec(self) -> Dict[str, Any]:
+        return {"name": self.name, "version": self.version, "dim": self.dim}
+
+_HASH_ANALYZER = CodeAnalyzer(DEFAULT_STOPWORDS)   # fixed, so vectors don't depend on BM25_* settings
+
+@lru_cache(maxsize=1 << 16)
+def _bucket(term: str, dim: int) -> Tuple[int, float]:
+    h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, (1.0 if (h >> 63) else -1.0)
+
+class HashingEmbedder(Embedder):
+    """Signed feature hashing of analyzer terms with sublinear tf: a sparse random projection."""
+    name = "hashing"
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tf: Dict[str, int] = {}
+            for term in _HASH_ANALYZER.analyze(text):
+                tf[term] = tf.get(term, 0) + 1
+            vec = out[row]
+            for term, n in tf.items():
+                i, sign = _bucket(term, self.dim)
+                vec[i] += sign * (1.0 + math.log(n))
+        return _normalize(out)
+
+class SentenceTransformerEmbedder(Embedder):
+    name = "sentence-transformers"
+
+    def __init__(self, model: str = EMBED_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDER=sentence-transformers needs `pip install sentence-transformers`") from e
+        self.model_name = model
+        self.model = SentenceTransformer(model)
+        self.dim = int(self.model.get_sentence_embedding_dimension())
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vecs = self.model.encode(list(texts), batch_size=max(1, len(texts)), convert_to_numpy=True,
+                                 show_progress_bar=False)
+        return _normalize(np.asarray(vecs, dtype=np.float32))
+
+    def spec(self) -> Dict[str, Any]:
+        return {**super().spec(), "model": self.model_name}
+
+EMBEDDERS: Dict[str, Type[Embedder]] = {"hashing": HashingEmbedder, "sentence-transformers": SentenceTransformerEmbedder}
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return np.divide(m, norms, out=np.zeros_like(m), where=norms > 0)
+
+@lru_cache(maxsize=4)
+def _load_embedder(name: str, arg: Any) -> Embedder:
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder {name!r}; choose one of {sorted(EMBEDDERS)}")
+    return EMBEDDERS[name](arg)   # models are loaded once per process
+
+def current_embedder() -> Embedder:
+    """The embedder new indexes are built with (EMBEDDER, EMBED_DIM / EMBED_MODEL)."""
+    return _load_embedder(EMBEDDER, EMBED_MODEL if EMBEDDER == "sentence-transformers" else EMBED_DIM)
+
+def embedder_for_index(spec: Dict[str, Any]) -> Embedder:
+    """Rebuild the embedder a dense index was written with, so queries land in the same space."""
+    cls = EMBEDDERS.get(spec.get("name"))
+    if cls is None or cls.version != spec.get("version"):
+        raise ValueError(f"Dense index was built with embedder {spec.get('name')} v{spec.get('version')}, "
+                         f"which this version cannot reproduce; re-ingest with full=true")
+    return _load_embedder(spec["name"], spec.get("model") or spec["dim"])
+
+def dense_config() -> Optional[Dict[str, Any]]:
+    """Stored in state.json; None when dense retrieval is off."""
+    if not DENSE_RETRIEVAL:
+        return None
+    return {"embedder": current_embedder().spec(), "dtype": DENSE_DTYPE}
+
+def _quantize(vecs: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if dtype == "float16":
+        return vecs.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.abs(vecs).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        return np.round(vecs / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+    raise ValueError(f"Unsupported DENSE_DTYPE {dtype!r}; use float16 or int8")
+
+class DenseWriter:
+    """
+    Streaming vector writer. Texts are embedded EMBED_BATCH at a time and appended (already
+    quantized) to a raw file, so resident memory is one batch regardless of repo size;
+    finish() copies them into vectors.npy and trains the IVF lists from a bounded sample.
+    """
+    def __init__(self, index_dir: Path, embedder: Embedder, dtype: str = DENSE_DTYPE, batch: int = EMBED_BATCH):
+        _quantize(np.zeros((1, 1), dtype=np.float32), dtype)   # fail fast on a bad dtype
+        self.index_dir, self.embedder, self.dtype, self.batch = index_dir, embedder, dtype, max(1, batch)
+        self.tmp = index_dir.with_name(index_dir.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.n_docs = 0
+        self._pending: List[str] = []
+        self._scale = array("f")
+        self._fh = open(self.tmp / "vectors.bin", "ab")
+
+    def compatible(self, prev_dir: Path) -> bool:
+        """True if prev_dir holds vectors from the same embedder and dtype (reusable as-is)."""
+        try:
+            meta = json.loads((prev_dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return (meta.get("format") == DENSE_FORMAT and meta.get("embedder") == self.embedder.spec()
+                and meta.get("dtype") == self.dtype)
+
+    def add(self, text: str) -> None:
+        self._pending.append(text)
+        if len(self._pending) >= self.batch:
+            self._flush()
+
+    def add_existing(self, prev_dir: Path, keep: np.ndarray) -> None:
+        """Copy the vectors of docs with keep[doc] from a compatible index; must come before add()."""
+        if self.n_docs or self._pending:
+            raise RuntimeError("add_existing() must come before add()")
+        old = DenseIndex.open(prev_dir)
+        rows = np.flatnonzero(keep)
+        for s in range(0, len(rows), BLOCK):
+            idx = rows[s:s + BLOCK]
+            np.asarray(old.vectors[idx]).tofile(self._fh)
+            if old.scale is not None:
+                self._scale.frombytes(np.asarray(old.scale[idx], dtype=np.float32).tobytes())
+        self.n_docs += len(rows)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        vecs, scale = _quantize(self.embedder.embed(self._pending), self.dtype)
+        vecs.tofile(self._fh)
+        if scale is not None:
+            self._scale.frombytes(scale.tobytes())
+        self.n_docs += len(self._pending)
+        self._pending = []
+
+    def finish(self) -> Dict[str, Any]:
+        self._flush()
+        self._fh.close()
+        dim, n = self.embedder.dim, self.n_docs
+        raw_path = self.tmp / "vectors.bin"
+        if n:
+            raw = np.memmap(raw_path, dtype=self.dtype, mode="r", shape=(n, dim))
+            vectors = np.lib.format.open_memmap(self.tmp / "vectors.npy", mode="w+", dtype=self.dtype, shape=(n, dim))
+            for s in range(0, n, BLOCK):
+                vectors[s:s + BLOCK] = raw[s:s + BLOCK]
+            vectors.flush()
+            del raw
+        else:
+            vectors = np.empty((0, dim), dtype=self.dtype)
+            np.save(self.tmp / "vectors.npy", vectors)
+        scale = np.frombuffer(self._scale, dtype=np.float32) if self.dtype == "int8" else None
+        if scale is not None:
+            np.save(self.tmp / "scale.npy", scale)
+        n_lists = 0
+        if n >= DENSE_IVF_MIN_DOCS:
+            centroids, ptr, docs = _train_ivf(vectors, scale)
+            n_lists = len(centroids)
+            for name, arr in (("centroids", centroids), ("ivf_ptr", ptr), ("ivf_docs", docs)):
+                np.save(self.tmp / f"{name}.npy", arr)
+        del vectors
+        raw_path.unlink()
+        meta = {"format": DENSE_FORMAT, "n_docs": n, "dim": dim, "dtype": self.dtype,
+                "embedder": self.embedder.spec(), "ivf_lists": n_lists}
+        (self.tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        _publish(self.tmp, self.index_dir)
+        return meta
+
+    def abort(self) -> None:
+        self._fh.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def _rows(vectors: np.ndarray, scale: Optional[np.ndarray], idx) -> np.ndarray:
+    m = np.asarray(vectors[idx], dtype=np.float32)
+    if scale is not None:
+        m *= np.asarray(scale[idx], dtype=np.float32)[:, None]
+    return m
+
+def _train_ivf(vectors: np.ndarray, scale: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Spherical k-means on a sample, then a blockwise assignment of every row."""
+    n = len(vectors)
+    n_lists = max(1, int(math.sqrt(n)))
+    rng = np.random.default_rng(0)
+    sample = _rows(vectors, scale, np.sort(rng.choice(n, size=min(n, IVF_SAMPLE), replace=False)))
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+    for _ in range(IVF_ITERS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]   # reseed empty lists
+        centroids = _normalize(sums)
+    assign = np.empty(n, dtype=np.int32)
+    for s in range(0, n, BLOCK):
+        assign[s:s + BLOCK] = np.argmax(_rows(vectors, scale, slice(s, s + BLOCK)) @ centroids.T, axis=1)
+    docs = np.argsort(assign, kind="stable").astype(np.int32)
+    ptr = np.zeros(n_lists + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+    return centroids.astype(np.float32), ptr, docs
+
+class DenseIndex:
+    def __init__(self, arrays: Dict[str, Optional[np.ndarray]], meta: Dict[str, Any]):
+        self.meta = meta
+        self.n_docs = int(meta["n_docs"])
+        self.vectors = arrays["vectors"].reshape(self.n_docs, int(meta["dim"]))
+        self.scale = arrays.get("scale")
+        self.centroids = arrays.get("centroids")
+        self.ivf_ptr = arrays.get("ivf_ptr")
+        self.ivf_docs = arrays.get("ivf_docs")
+
+    @classmethod
+    def open(cls, index_dir: Path) -> "DenseIndex":
+        meta = json.loads((index_dir / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format") != DENSE_FORMAT:
+            raise ValueError(f"Unsupported dense index format {meta.get('format')} in {index_dir}")
+        arrays = {}
+        for name in ("vectors", "scale", "centroids", "ivf_ptr", "ivf_docs"):
+            if (index_dir / f"{name}.npy").exists():
+                arrays[name] = np.load(index_dir / f"{name}.npy", mmap_mode="r")
+        if "centroids" in arrays:
+            arrays["centroids"] = np.asarray(arrays["centroids"])   # small; scored on every query
+        return cls(arrays, meta)
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = DENSE_IVF_NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k docs by cosine similarity: (doc_ids, scores), best first, ties by doc id."""
+        if k <= 0 or self.n_docs == 0 or not query.any():
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        query = query.astype(np.float32)
+        if self.centroids is not None and nprobe < len(self.centroids):
+            lists = np.argsort(-(self.centroids @ query))[:nprobe]
+            cand = np.sort(np.concatenate([np.asarray(self.ivf_docs[self.ivf_ptr[l]:self.ivf_ptr[l + 1]])
+                                           for l in lists]).astype(np.int64))
+            return _top(cand, _rows(self.vectors, self.scale, cand) @ query, k)
+        ids, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        for s in range(0, self.n_docs, BLOCK):   # brute force, keeping a running top-k
+            block = np.arange(s, min(s + BLOCK, self.n_docs), dtype=np.int64)
+            ids, scores = _top(np.concatenate([ids, block]),
+                               np.concatenate([scores, _rows(self.vectors, self.scale, slice(s, s + BLOCK)) @ query]), k)
+        return ids, scores
+
+    def resident_bytes(self) -> int:
+        return 0 if self.centroids is None else int(self.centroids.nbytes)
+
+def _top(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(ids) > k:
+        sel = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[sel], scores[sel]
+    order = np.lexsort((ids, -scores))
+    return ids[order], scores[order]
+
+def open_dense(repo_dir: Path) -> Optional[DenseIndex]:
+    """Open <repo_dir>/dense/ if ingest wrote one."""
+    if (repo_dir / "dense" / "meta.json").exists():
+        return DenseIndex.open(repo_dir / "dense")
+    return None
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int, rrf_k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked doc-id lists: score(d) = Σ 1/(rrf_k + rank). Returns the top k, ties by doc id."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking.tolist(), start=1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (rrf_k + rank)
+    if not fused:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+    order = np.lexsort((ids, -scores))[:k]
+    return ids[order], scores[order]
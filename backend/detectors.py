@@ -1,63 +1,93 @@
-import json
+"""
+Mode availability from signals gathered during ingest: file paths seen by the walker, the
+contents of indexed Python/dependency files, and LLM tags. Ingest persists them as
+signals.json in the index version, so detect_modes is a single small file read.
+"""
+import json, re
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, List, Set
+from .storage import active_dir
 
-def detect_modes(repo_dir: Path) -> Dict[str, bool]:
-    """
-    Heuristic mode detection using files.json (LLM tags) and filenames.
-    Returns keys expected by the frontend: run, test, deploy, understand, stack.
-    """
-    files_json = repo_dir / "files.json"
-    tags_by_path = {}
-    if files_json.exists():
-        try:
-            arr = json.loads(files_json.read_text(encoding="utf-8"))
-            for row in arr:
-                tags_by_path[row.get("path","")] = set(
-                    (row.get("tags") or [])
-                )
-        except Exception:
-            pass
-
-    has_tests = False
-    has_docker = False
-    has_fastapi_or_uvicorn = False
-
-    # Scan tags and filenames (cheap & robust)
-    for p, tags in tags_by_path.items():
-        pl = p.lower()
-        if "test" in pl or "tests/" in pl or "pytest" in tags:
-            has_tests = True
-        if "docker" in tags or "dockerfile" in pl:
-            has_docker = True
-        if "fastapi" in tags or "uvicorn" in tags or "fastapi" in pl or "uvicorn" in pl:
-            has_fastapi_or_uvicorn = True
-
-    # Fallback: a quick filename pass if files.json is absent/sparse
-    if not files_json.exists() or not tags_by_path:
-        for p in (repo_dir.parent / repo_dir.name).rglob("*"):
-            if not p.is_file(): 
-                continue
-            pl = p.name.lower()
-            if pl.startswith("dockerfile") or pl == "dockerfile":
-                has_docker = True
-            if "test" in pl:
-                has_tests = True
-            if pl.endswith(".py"):
-                txt = ""
-                try:
-                    txt = p.read_text(encoding="utf-8", errors="ignore")[:8000]
-                except Exception:
-                    pass
-                low = txt.lower()
-                if "fastapi(" in low or "uvicorn" in low:
-                    has_fastapi_or_uvicorn = True
-
-    modes = {
+SIGNALS_VERSION = 1
+SIGNAL_KINDS = ("tests", "docker", "web")
+MAX_EVIDENCE = 5    # example paths kept per signal
+DOCKER_NAMES = {"docker-compose.yml", "docker-compose.yaml", "compose.yml", "compose.yaml"}
+DEP_FILES = re.compile(r"(^|/)(requirements[^/]*\.txt|pyproject\.toml|Pipfile|setup\.(py|cfg))$")
+WEB_CODE = re.compile(r"fastapi\s*\(|\buvicorn\b")
+WEB_DEPS = re.compile(r"\b(fastapi|uvicorn)\b")
+TAG_SIGNALS = {"pytest": "tests", "docker": "docker", "fastapi": "web", "uvicorn": "web"}
+
+def path_signals(rel: str) -> Set[str]:
+    low = rel.lower()
+    name = low.rsplit("/", 1)[-1]
+    out = set()
+    if "test" in low:
+        out.add("tests")
+    if name.startswith("dockerfile") or name in DOCKER_NAMES:
+        out.add("docker")
+    if "fastapi" in low or "uvicorn" in low:
+        out.add("web")
+    return out
+
+def wants_content(rel: str) -> bool:
+    """Files whose text can carry a signal (checked by the ingest workers that read them anyway)."""
+    return rel.endswith(".py") or bool(DEP_FILES.search(rel))
+
+def content_signals(rel: str, text: str) -> List[str]:
+    if not wants_content(rel):
+        return []
+    low = text.lower()
+    pat = WEB_CODE if rel.endswith(".py") else WEB_DEPS
+    return ["web"] if pat.search(low) else []
+
+class Signals:
+    """A few evidence paths per signal kind, in the order they were seen."""
+    def __init__(self):
+        self.paths: Dict[str, List[str]] = {k: [] for k in SIGNAL_KINDS}
+
+    def add(self, kinds: Iterable[str], rel: str) -> None:
+        for kind in kinds:
+            seen = self.paths[kind]
+            if len(seen) < MAX_EVIDENCE and rel not in seen:
+                seen.append(rel)
+
+    def add_tags(self, rel: str, tags: Iterable[str]) -> None:
+        self.add({TAG_SIGNALS[t] for t in tags or () if t in TAG_SIGNALS}, rel)
+
+    def write(self, out_dir: Path) -> None:
+        payload = {"version": SIGNALS_VERSION, "signals": self.paths}
+        (Path(out_dir) / "signals.json").write_text(json.dumps(payload, indent=2), encoding="utf-8")
+
+def _modes(found: Set[str]) -> Dict[str, bool]:
+    return {
         "run": True,                   # always possible to propose local run steps
-        "test": has_tests,
-        "deploy": has_docker or has_fastapi_or_uvicorn,
+        "test": "tests" in found,
+        "deploy": "docker" in found or "web" in found,
         "understand": True,
         "stack": True
     }
-    return modes
+
+def _legacy_signals(index_dir: Path) -> Set[str]:
+    # indexes written before signals.json: tags and paths of the tagged files only
+    found: Set[str] = set()
+    try:
+        rows = json.loads((index_dir / "files.json").read_text(encoding="utf-8"))
+    except Exception:
+        return found
+    for row in rows:
+        found |= path_signals(row.get("path", ""))
+        found |= {TAG_SIGNALS[t] for t in row.get("tags") or () if t in TAG_SIGNALS}
+    return found
+
+def detect_modes(repo_dir: Path) -> Dict[str, bool]:
+    """
+    Mode availability for the active index from its signals.json.
+    Returns keys expected by the frontend: run, test, deploy, understand, stack.
+    """
+    index_dir = active_dir(repo_dir)
+    try:
+        data = json.loads((index_dir / "signals.json").read_text(encoding="utf-8"))
+        found = {k for k, paths in data["signals"].items() if paths}
+    except Exception:
+        found = _legacy_signals(index_dir)
+    return _modes(found)
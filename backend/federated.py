@@ -0,0 +1,235 @@
+"""
+Federated BM25 search over many ingested repos (all of INDEX_ROOT or a chosen set).
+
+Each repo is a shard: its mmapped bm25/ index plus on-demand reads from its chunk store, which
+is only opened once the shard contributes a hit, so only index pages touched by the query and
+the winning chunks' text are brought into memory.
+A query runs in three parallel rounds over the shards:
+    1. document frequency of the query terms, document count and total length per shard,
+    2. top-k per shard scored with the summed (corpus-wide) IDF and average length, so scores
+       can be merged directly; they equal what one BM25 index over all the repos would give,
+       except that negative IDFs are floored with an approximate vocabulary mean,
+    3. text and metadata of the merged top-k, fetched from the shards that own them.
+Hits cite `repo_id:path:chunk_id`. Dense vectors are not used: fused rank scores are not
+comparable across indexes.
+"""
+import os, heapq, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Tuple
+import numpy as np
+from .analyzer import analyzer_for_index
+from .bm25_index import EPSILON, open_index
+from .chunk_store import open_chunks
+from .context import CONTEXT_CANDIDATES, MODE_BUDGETS, build_context, prompt_tokens
+from .llm import ChatStream, chat_result, chat_stream
+from .llm_cache import cache_key
+from .retriever import ANSWER_PROMPT_VERSION, INSTRUCTIONS, SYSTEM_PROMPT
+from .retriever_cache import _index_stamp
+from .storage import active_dir
+from .telemetry import inc, span
+
+FEDERATED_WORKERS = int(os.getenv("FEDERATED_WORKERS", "8"))       # shards searched at once
+FEDERATED_OPEN_SHARDS = int(os.getenv("FEDERATED_OPEN_SHARDS", "256"))  # shard handles kept open (LRU)
+FEDERATED_MAX_REPOS = int(os.getenv("FEDERATED_MAX_REPOS", "1000"))  # refuse queries over more repos than this
+MULTI_REPO_NOTE = "Evidence comes from several repositories; PATH is repo_id:path. Cite inline like [repo_id:path:start-end]."
+
+def list_repos(data_root: Path) -> List[str]:
+    """repo_ids with a BM25 index under data_root (service dirs such as _cache/_mirrors are skipped)."""
+    data_root, out = Path(data_root), []
+    if not data_root.is_dir():
+        return out
+    for d in sorted(data_root.iterdir()):
+        if not d.is_dir() or d.name.startswith(("_", ".")):
+            continue
+        vdir = active_dir(d)
+        if (vdir / "bm25" / "meta.json").exists() or (vdir / "tokenized.json").exists():
+            out.append(d.name)
+    return out
+
+class Shard:
+    """One repo's index for federated search: mmapped BM25 plus its chunk store (opened lazily)."""
+    def __init__(self, repo_id: str, repo_dir: Path):
+        self.repo_id = repo_id
+        self.dir = active_dir(Path(repo_dir))
+        self.bm25 = open_index(self.dir)
+        if self.bm25 is None or not ((self.dir / "chunks" / "meta.json").exists()
+                                     or (self.dir / "corpus.jsonl").exists()):
+            raise FileNotFoundError(f"Missing index files in {self.dir}")
+        self.analyzer, self.analyzer_mismatch = analyzer_for_index(self.bm25.analyzer)
+        self.total_len = self.bm25.avgdl * self.bm25.n_docs
+        idf_mean = self.bm25.meta.get("idf_mean")   # absent in indexes written before it was stored
+        self.idf_mean = (float(idf_mean) if idf_mean is not None
+                         else float(np.mean(self.bm25.idf)) if self.bm25.n_terms else 0.0)
+        self._chunks = None
+        self._chunks_lock = threading.Lock()
+
+    @property
+    def chunks(self):
+        # most shards of a query never contribute a hit, so they never read files.json
+        with self._chunks_lock:
+            if self._chunks is None:
+                self._chunks = open_chunks(self.dir)
+                if self._chunks is None:
+                    raise FileNotFoundError(f"Missing chunk store in {self.dir}")
+            return self._chunks
+
+    def doc_freqs(self, terms: List[str]) -> Dict[str, int]:
+        ptr, out = self.bm25.postings_ptr, {}
+        for t in terms:
+            tid = self.bm25.term_id(t)
+            if tid >= 0:
+                out[t] = int(ptr[tid + 1] - ptr[tid])
+        return out
+
+    def rows(self, docs: List[int]) -> List[Dict[str, Any]]:
+        return self.chunks.rows(docs)
+
+class ShardCache:
+    """Thread-safe LRU of open shards; a re-ingested repo is reopened at its new version."""
+    def __init__(self, max_entries: int = FEDERATED_OPEN_SHARDS):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Shard, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, repo_id: str, repo_dir: Path) -> Shard:
+        stamp = _index_stamp(repo_dir)
+        with self._lock:
+            entry = self._entries.get(repo_id)
+            if entry and entry[1] == stamp:
+                self._entries.move_to_end(repo_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        shard = Shard(repo_id, repo_dir)   # cheap (mmap + meta.json); a racing duplicate open is harmless
+        with self._lock:
+            self._entries[repo_id] = (shard, stamp)
+            self._entries.move_to_end(repo_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return shard
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+SHARDS = ShardCache()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _map(fn, items: List[Any]) -> List[Any]:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, FEDERATED_WORKERS), thread_name_prefix="federated")
+    return list(_pool.map(fn, items))
+
+def _global_idf(n_docs: int, df: Dict[str, int], idf_mean: float) -> Dict[str, float]:
+    # BM25Okapi IDF over the union of the shards; negative IDFs are floored like compute_idf,
+    # with the vocabulary mean approximated by the doc-weighted mean of the shards' means
+    idf = {t: float(np.log(n_docs - f + 0.5) - np.log(f + 0.5)) for t, f in df.items()}
+    return {t: (EPSILON * idf_mean if w < 0 else w) for t, w in idf.items()}
+
+class FederatedSearch:
+    def __init__(self, data_root: Path, repo_ids: Optional[List[str]] = None, shards: ShardCache = SHARDS):
+        self.data_root = Path(data_root)
+        self.repo_ids = list(dict.fromkeys(repo_ids)) if repo_ids else list_repos(self.data_root)
+        if len(self.repo_ids) > FEDERATED_MAX_REPOS:
+            raise ValueError(f"{len(self.repo_ids)} repos requested; FEDERATED_MAX_REPOS is {FEDERATED_MAX_REPOS}")
+        self.shards = shards
+        self.errors: Dict[str, str] = {}      # repo_id -> why it was skipped
+        self.versions: Dict[str, str] = {}    # repo_id -> index version searched
+        self.stale: List[str] = []            # repos whose index predates the configured analyzer
+
+    def _open(self, repo_id: str) -> Optional[Shard]:
+        try:
+            return self.shards.get(repo_id, self.data_root / repo_id)
+        except Exception as e:
+            self.errors[repo_id] = str(e)   # one broken index must not fail the whole query
+            return None
+
+    def topk(self, query: str, k: int = 12) -> List[Dict[str, Any]]:
+        """Global top-k: [{text, meta, score, doc, repo_id, citation}], best first."""
+        inc("retrieval_queries_total", retrieval="federated")
+        with span("federated.stats"):
+            shards = [s for s in _map(self._open, self.repo_ids) if s is not None]
+            self.versions = {s.repo_id: s.bm25.version for s in shards}
+            self.stale = [s.repo_id for s in shards if s.analyzer_mismatch]
+            tokens = {s.repo_id: s.analyzer.analyze(query) for s in shards}
+            per_shard = _map(lambda s: (s, s.doc_freqs(sorted(set(tokens[s.repo_id])))), shards)
+            n_docs = sum(s.bm25.n_docs for s in shards)
+            df: Dict[str, int] = {}
+            for _, freqs in per_shard:
+                for t, f in freqs.items():
+                    df[t] = df.get(t, 0) + f
+            avgdl = sum(s.total_len for s in shards) / max(1, n_docs)
+            idf_mean = sum(s.idf_mean * s.bm25.n_docs for s in shards) / max(1, n_docs)
+            idf = _global_idf(n_docs, df, idf_mean)
+
+        def search(item: Tuple[Shard, Dict[str, int]]) -> List[Tuple[float, str, int]]:
+            shard, freqs = item
+            if not freqs:
+                return []
+            view = shard.bm25.with_stats({t: idf[t] for t in freqs}, avgdl)
+            docs, scores = view.topk(tokens[shard.repo_id], k)
+            return [(float(sc), shard.repo_id, int(d)) for d, sc in zip(docs, scores) if sc > 0]
+        with span("federated.topk"):
+            ranked = heapq.nsmallest(k, (h for hs in _map(search, per_shard) for h in hs),
+                                     key=lambda h: (-h[0], h[1], h[2]))
+
+        with span("federated.fetch"):
+            by_shard: Dict[str, List[int]] = {}
+            for _, repo_id, d in ranked:
+                by_shard.setdefault(repo_id, []).append(d)
+            owners = {s.repo_id: s for s in shards}
+            fetched = dict(zip(by_shard, _map(lambda r: owners[r].rows(by_shard[r]), list(by_shard))))
+        out, pos = [], {r: 0 for r in by_shard}
+        for i, (score, repo_id, d) in enumerate(ranked):
+            row = fetched[repo_id][pos[repo_id]]
+            pos[repo_id] += 1
+            meta = row["meta"]
+            out.append({"text": row["text"], "meta": meta, "score": score, "doc": i, "repo_id": repo_id,
+                        "citation": f"{repo_id}:{meta['path']}:{meta.get('chunk_id', d)}"})
+        return out
+
+    def answer_with_stats(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain",
+                          k: int = CONTEXT_CANDIDATES, cache: bool = True) -> Dict[str, Any]:
+        msgs, key, context = self._prompt(query, mode, k)
+        with span("llm"):
+            res = chat_result(msgs, temperature=0.1, key=key, cache=cache)
+        return {"answer": res.text, "llm": res.stats(), "context": context}
+
+    def answer_stream(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain",
+                      k: int = CONTEXT_CANDIDATES, cache: bool = True) -> ChatStream:
+        msgs, key, context = self._prompt(query, mode, k)
+        stream = chat_stream(msgs, temperature=0.1, key=key, cache=cache)
+        stream.context = context
+        return stream
+
+    def _prompt(self, query: str, mode: str, k: int) -> Tuple[List[Dict[str, str]], Optional[str], Dict[str, Any]]:
+        hits = self.topk(query, k=k)
+        # repo-qualified paths keep blocks from different repos apart and show up in the headers
+        scoped = [{**h, "meta": {**h["meta"], "path": f"{h['repo_id']}:{h['meta']['path']}"}} for h in hits]
+        with span("retrieve.context"):
+            evidence, blocks, context = build_context(scoped, MODE_BUDGETS[mode])
+        msgs = [
+            {"role":"system","content": SYSTEM_PROMPT},
+            {"role":"user","content": f"{INSTRUCTIONS[mode]}\n{MULTI_REPO_NOTE}\n\nUser intent: {mode}\n\nContext:\n{evidence}"}
+        ]
+        context["prompt_tokens"] = prompt_tokens(msgs)
+        context["retrieval"] = "federated"
+        context["repos"] = len(self.repo_ids) - len(self.errors)
+        context["citations"] = [hits[d]["citation"] for b in blocks for d in b["docs"]]
+        if self.errors:
+            context["skipped"] = self.errors
+        if self.stale:
+            context["analyzer_stale"] = self.stale
+        # same evidence from the same index versions → cached answer
+        versions = sorted({(h["repo_id"], self.versions[h["repo_id"]]) for h in hits})
+        key = (cache_key("answer-federated", ANSWER_PROMPT_VERSION, MULTI_REPO_NOTE, query, mode,
+                         context["citations"], context["budget"], versions)
+               if versions and all(v for _, v in versions) else None)
+        return msgs, key, context
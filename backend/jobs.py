@@ -0,0 +1,125 @@
+import os, time, uuid, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+from .telemetry import inc
+
+INGEST_JOBS  = int(os.getenv("INGEST_JOBS", "2"))      # ingests running at once
+INGEST_QUEUE = int(os.getenv("INGEST_QUEUE", "16"))    # ingests waiting for a worker
+JOB_HISTORY  = 500                                     # finished jobs kept for /jobs/{id}
+
+class QueueFullError(RuntimeError):
+    pass
+
+class JobConflictError(RuntimeError):
+    pass
+
+@dataclass
+class Job:
+    id: str
+    repo_id: str
+    repo_url: str
+    full: bool = False
+    status: str = "queued"            # queued | running | succeeded | failed
+    stage: str = "queued"             # clone | read | chunk | tag | index | persist | blueprints | done
+    progress: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)   # seconds spent per stage
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    _stage_t0: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def update(self, stage: str, **counters: Any) -> None:
+        """Progress callback handed to build_index."""
+        with self._lock:
+            now = time.perf_counter()
+            if stage != self.stage:
+                if self.stage not in ("queued", "done"):
+                    self.timings[self.stage] = round(self.timings.get(self.stage, 0.0) + now - self._stage_t0, 3)
+                self.stage, self._stage_t0 = stage, now
+            self.progress.update(counters)
+
+    def finish(self, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            if self.stage not in ("queued", "done"):
+                self.timings[self.stage] = round(self.timings.get(self.stage, 0.0) + time.perf_counter() - self._stage_t0, 3)
+            if status == "succeeded":
+                self.stage = "done"   # a failed job keeps the stage it failed in
+            self.status, self.result, self.error, self.finished = status, result, error, time.time()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id, "repo_id": self.repo_id, "source_url": self.repo_url,
+                "status": self.status, "stage": self.stage, "progress": dict(self.progress),
+                "timings": dict(self.timings), "created": self.created, "started": self.started,
+                "finished": self.finished, "result": self.result, "error": self.error,
+            }
+
+class JobManager:
+    """
+    Bounded background ingest queue. At most one job per repo_id is active: a second
+    request for the same repo attaches to the running job instead of starting another;
+    one for a different URL that maps to the same repo_id is refused (JobConflictError).
+    """
+    def __init__(self, run: Callable[[Job], Dict[str, Any]], workers: int = INGEST_JOBS, max_queue: int = INGEST_QUEUE):
+        self._run_fn = run
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest")
+        self._capacity = max(1, workers) + max(0, max_queue)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[str, Job] = {}    # repo_id -> queued/running job
+        self._lock = threading.Lock()
+
+    def submit(self, repo_id: str, repo_url: str, full: bool = False) -> Tuple[Job, bool]:
+        """Returns (job, attached) where attached means an existing job was reused."""
+        with self._lock:
+            job = self._active.get(repo_id)
+            if job is not None:
+                if job.repo_url != repo_url:
+                    raise JobConflictError(f"repo_id {repo_id!r} is being ingested from {job.repo_url}, not {repo_url}")
+                return job, True
+            if len(self._active) >= self._capacity:
+                raise QueueFullError(f"Ingest queue full ({len(self._active)} jobs), retry later")
+            job = Job(id=uuid.uuid4().hex[:12], repo_id=repo_id, repo_url=repo_url, full=full)
+            self._jobs[job.id] = job
+            self._active[repo_id] = job
+            while len(self._jobs) > JOB_HISTORY:
+                old_id, old = next(iter(self._jobs.items()))
+                if old.repo_id in self._active and self._active[old.repo_id] is old:
+                    break
+                self._jobs.pop(old_id)
+        self._pool.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job) -> None:
+        with job._lock:
+            job.status, job.started = "running", time.time()
+        result, error = None, None
+        try:
+            result = self._run_fn(job)
+        except Exception as e:
+            error = f"Ingest failed: {e}"
+        with self._lock:
+            if self._active.get(job.repo_id) is job:
+                del self._active[job.repo_id]
+        job.finish("failed" if error else "succeeded", result=result, error=error)
+        inc("ingest_jobs_total", status=job.status)
+        job._done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for j in self._active.values() if j.status == "running")
+            return {"active": len(self._active), "running": running,
+                    "queued": len(self._active) - running, "capacity": self._capacity}
@@ -1,41 +1,437 @@
-import os, time, json, requests
+import os, time, json, random, asyncio, weakref, threading, requests
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+import httpx
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+from .llm_cache import CACHE, LLM_CACHE, cache_key   # after load_dotenv so .env settings apply
+from .telemetry import inc, observe
+
 AIML_API_KEY  = os.environ["AIML_API_KEY"]
 AIML_API_BASE = os.getenv("AIML_API_BASE", "https://api.aimlapi.com/v1")
 CHAT_MODEL    = os.getenv("CHAT_MODEL_ID", "openai/gpt-5-2025-08-07")
 
-def _post(payload: dict, retries: int = 3, timeout: int = 60) -> dict:
-    url = f"{AIML_API_BASE}/chat/completions"
-    headers = {
+LLM_POOL_SIZE     = int(os.getenv("LLM_POOL_SIZE", "16"))       # keep-alive connections per host
+LLM_RETRIES       = int(os.getenv("LLM_RETRIES", "4"))          # retries after the first attempt
+LLM_TIMEOUT       = float(os.getenv("LLM_TIMEOUT", "60"))       # read timeout per attempt (s)
+LLM_DEADLINE      = float(os.getenv("LLM_DEADLINE", "180"))     # budget per call incl. retries (s)
+LLM_BACKOFF_BASE  = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX   = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))  # consecutive failed calls
+BREAKER_COOLDOWN  = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+CONNECT_TIMEOUT   = 5.0
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+class RateLimitError(RuntimeError):
+    def __init__(self, msg: str, retry_after: float | None = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by concurrent callers.
+    penalize() pauses every caller, e.g. after the provider answers 429.
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def penalize(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+class CircuitBreaker:
+    """
+    Fails fast after `threshold` consecutive failed calls, for `cooldown` seconds.
+    After the cooldown a single trial call is let through (half-open).
+    """
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold, self.cooldown = threshold, cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            trial_pending = self._trial_at is not None and now - self._trial_at < self.cooldown
+            if now - self.opened_at < self.cooldown or trial_pending:
+                raise CircuitOpenError("AIML API circuit open: provider failing, try again shortly")
+            self._trial_at = now
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._trial_at = None
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+BREAKER = CircuitBreaker()
+
+@dataclass
+class ChatResult:
+    text: str
+    latency: float            # wall time incl. retries (s)
+    retries: int
+    usage: Dict[str, Any] = field(default_factory=dict)
+    cached: bool = False
+    ttft: Optional[float] = None   # time to first streamed token (s); streaming calls only
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"latency_s": round(self.latency, 3), "retries": self.retries, "usage": self.usage,
+               "cached": self.cached}
+        if self.ttft is not None:
+            out["ttft_s"] = round(self.ttft, 3)
+        return out
+
+class UsageMeter:
+    """Thread-safe running totals over many ChatResults (e.g. one ingest)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = self.retries = self.prompt_tokens = self.completion_tokens = 0
+        self.cache_hits = 0
+        self.latency = 0.0
+
+    def add(self, res: ChatResult) -> None:
+        with self._lock:
+            self.calls += 1
+            self.cache_hits += int(res.cached)
+            self.retries += res.retries
+            self.prompt_tokens += int(res.usage.get("prompt_tokens") or 0)
+            self.completion_tokens += int(res.usage.get("completion_tokens") or 0)
+            self.latency += res.latency
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "cache_hits": self.cache_hits, "retries": self.retries,
+                    "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                    "latency_s": round(self.latency, 3)}
+
+_session: Optional[requests.Session] = None
+# an AsyncClient's connections belong to the event loop that opened them: one client per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+def _url() -> str:
+    return f"{AIML_API_BASE}/chat/completions"
+
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {AIML_API_KEY}",
         "Content-Type": "application/json",
     }
-    for attempt in range(retries):
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
-        if resp.status_code == 200:
-            return resp.json()
-        # simple backoff on transient errors
-        if resp.status_code in (429, 500, 502, 503, 504) and attempt < retries - 1:
-            time.sleep(1.5 * (attempt + 1))
-            continue
-        raise RuntimeError(f"AIML API error {resp.status_code}: {resp.text}")
 
-def chat(messages: list[dict], temperature: float = 0.0) -> str:
-    """
-    messages = [{"role":"system"|"user"|"assistant", "content":"..."}]
-    returns assistant text content
-    """
-    payload = {
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _client_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+def _get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = _async_clients[loop] = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+            )
+    return client
+
+def _retry_after(headers) -> float | None:
+    try:
+        return float(headers.get("Retry-After", ""))
+    except (TypeError, ValueError):
+        return None
+
+def _backoff(attempt: int, retry_after: float | None) -> float:
+    if retry_after is not None:
+        return min(retry_after, LLM_BACKOFF_MAX)
+    # exponential backoff with full jitter
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def _provider_failure(status: int | None, retry_after: float | None) -> bool:
+    # 5xx, timeouts and unreachable count against the breaker; rate limiting (429, or 408 with
+    # Retry-After) means the provider is up and pacing us, and must not fail unrelated calls
+    if status is None or status >= 500:
+        return True
+    return status == 408 and retry_after is None
+
+def _fail(status: int | None, text: str, retry_after: float | None, err: Exception | None):
+    BREAKER.record(not _provider_failure(status, retry_after))
+    inc("llm_errors_total", status=status or "unreachable")
+    if status == 429:
+        return RateLimitError(f"AIML API error 429: {text}", retry_after)
+    if status is None:
+        return RuntimeError(f"AIML API unreachable: {err}")
+    return RuntimeError(f"AIML API error {status}: {text}")
+
+def _post(payload: dict, retries: int = LLM_RETRIES, timeout: float = LLM_TIMEOUT,
+          deadline: float | None = None) -> tuple[dict, int]:
+    """POST with pooled keep-alive connections. Returns (json, retries_used)."""
+    resp, retries = _send(payload, retries, timeout, deadline)
+    return resp.json(), retries
+
+def _send(payload: dict, retries: int = LLM_RETRIES, timeout: float = LLM_TIMEOUT,
+          deadline: float | None = None, stream: bool = False) -> tuple[requests.Response, int]:
+    # retries cover connecting and the status line only; a stream that breaks mid-body is not replayed
+    BREAKER.allow()
+    end = time.monotonic() + (deadline or LLM_DEADLINE)
+    status, text, retry_after, err = None, "", None, None
+    for attempt in range(retries + 1):
+        left = end - time.monotonic()
+        if left <= 0:
+            break
+        try:
+            resp = _get_session().post(_url(), headers=_headers(), json=payload, stream=stream,
+                                       timeout=(min(CONNECT_TIMEOUT, left), min(timeout, left)))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            status, text, retry_after, err = None, "", None, e
+        else:
+            if resp.status_code == 200:
+                BREAKER.record(True)
+                return resp, attempt
+            status, text, retry_after = resp.status_code, resp.text, _retry_after(resp.headers)
+            if status not in RETRY_STATUS:
+                BREAKER.record(True)   # a client error says nothing about provider health
+                inc("llm_errors_total", status=status)
+                raise RuntimeError(f"AIML API error {status}: {text}")
+        delay = _backoff(attempt, retry_after)
+        if attempt == retries or time.monotonic() + delay >= end:
+            break
+        time.sleep(delay)
+    raise _fail(status, text, retry_after, err)
+
+async def _apost(payload: dict, retries: int = LLM_RETRIES, timeout: float = LLM_TIMEOUT,
+                 deadline: float | None = None) -> tuple[dict, int]:
+    """Async twin of _post on the running loop's httpx connection pool."""
+    BREAKER.allow()
+    end = time.monotonic() + (deadline or LLM_DEADLINE)
+    status, text, retry_after, err = None, "", None, None
+    for attempt in range(retries + 1):
+        left = end - time.monotonic()
+        if left <= 0:
+            break
+        try:
+            resp = await _get_async_client().post(
+                _url(), headers=_headers(), json=payload,
+                timeout=httpx.Timeout(min(timeout, left), connect=min(CONNECT_TIMEOUT, left)),
+            )
+        except httpx.TransportError as e:
+            status, text, retry_after, err = None, "", None, e
+        else:
+            if resp.status_code == 200:
+                BREAKER.record(True)
+                return resp.json(), attempt
+            status, text, retry_after = resp.status_code, resp.text, _retry_after(resp.headers)
+            if status not in RETRY_STATUS:
+                BREAKER.record(True)
+                inc("llm_errors_total", status=status)
+                raise RuntimeError(f"AIML API error {status}: {text}")
+        delay = _backoff(attempt, retry_after)
+        if attempt == retries or time.monotonic() + delay >= end:
+            break
+        await asyncio.sleep(delay)
+    raise _fail(status, text, retry_after, err)
+
+def _payload(messages: list[dict], temperature: float) -> dict:
+    return {
         "model": CHAT_MODEL,
         "messages": messages,
         "temperature": temperature,
     }
-    data = _post(payload)
+
+def _sse_events(resp: requests.Response) -> Iterator[dict]:
+    """
+    Parse the provider's `data: {...}` server-sent events until `data: [DONE]`.
+    Raises on an in-band error event and on a stream that closes before [DONE] without any
+    choice having a finish_reason, so a partial completion is never taken for a whole one.
+    """
+    finished = False
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue   # blank separators, comments and keep-alives
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            event = json.loads(data)
+        except ValueError as e:
+            raise RuntimeError(f"Unexpected AIML stream event: {data[:500]}") from e
+        if event.get("error"):
+            raise RuntimeError(f"AIML API stream error: {json.dumps(event['error'])[:500]}")
+        finished = finished or any(c.get("finish_reason") for c in event.get("choices") or [])
+        yield event
+    if not finished:
+        raise RuntimeError("AIML API stream ended before the completion did")
+
+def _result(data: dict, started: float, retries: int) -> ChatResult:
     try:
-        return data["choices"][0]["message"]["content"]
+        text = data["choices"][0]["message"]["content"]
     except Exception as e:
         raise RuntimeError(f"Unexpected AIML response: {json.dumps(data)[:500]}") from e
+    return ChatResult(text=text, latency=time.perf_counter() - started, retries=retries,
+                      usage=data.get("usage") or {})
+
+def _record(res: ChatResult, stream: bool = False) -> ChatResult:
+    """Export one finished call to the metrics registry."""
+    cached = "true" if res.cached else "false"
+    inc("llm_calls_total", cached=cached, stream="true" if stream else "false")
+    if res.retries:
+        inc("llm_retries_total", res.retries)
+    for kind in ("prompt", "completion"):
+        n = res.usage.get(f"{kind}_tokens")
+        if n:
+            inc("llm_tokens_total", n, kind=kind)
+    observe("llm_latency_seconds", res.latency, cached=cached)
+    if res.ttft is not None and not res.cached:
+        observe("llm_ttft_seconds", res.ttft)
+    return res
+
+def _cache_key(messages: list[dict], temperature: float, key: str | None) -> str:
+    # callers may pass a semantic key (e.g. blob hash + prompt); the model id always participates
+    return cache_key(CHAT_MODEL, key) if key else cache_key(CHAT_MODEL, temperature, messages)
+
+def _from_cache(value: dict, started: float, hit: bool, res: ChatResult | None) -> ChatResult:
+    if not hit and res is not None:
+        return res
+    return ChatResult(text=value["text"], latency=time.perf_counter() - started, retries=0,
+                      usage=value.get("usage") or {}, cached=True)
+
+def chat_result(messages: list[dict], temperature: float = 0.0, deadline: float | None = None,
+                cache: bool = True, key: str | None = None, retries: int = LLM_RETRIES) -> ChatResult:
+    """
+    Like chat(), but also returns latency, retry count, token usage and whether it was a cache hit.
+    With cache=True, completions are stored in the on-disk LLM cache under `key`
+    (default: hash of model id + messages + temperature).
+    """
+    started = time.perf_counter()
+    def call() -> ChatResult:
+        data, used = _post(_payload(messages, temperature), retries=retries, deadline=deadline)
+        return _result(data, started, used)
+    if not (cache and LLM_CACHE):
+        return _record(call())
+    fresh: list[ChatResult] = []
+    def compute() -> dict:
+        fresh.append(call())
+        return {"text": fresh[0].text, "usage": fresh[0].usage}
+    value, hit = CACHE.get_or_compute(_cache_key(messages, temperature, key), compute)
+    return _record(_from_cache(value, started, hit, fresh[0] if fresh else None))
+
+async def achat_result(messages: list[dict], temperature: float = 0.0, deadline: float | None = None,
+                       cache: bool = True, key: str | None = None) -> ChatResult:
+    """chat_result() for asyncio callers; same cache entries, the SQLite work runs in a thread."""
+    started = time.perf_counter()
+    ck = _cache_key(messages, temperature, key) if cache and LLM_CACHE else None
+    if ck:
+        value = await asyncio.to_thread(CACHE.lookup, ck)
+        if value is not None:
+            return _record(_from_cache(value, started, True, None))
+    data, retries = await _apost(_payload(messages, temperature), deadline=deadline)
+    res = _result(data, started, retries)
+    if ck:
+        await asyncio.to_thread(CACHE.put, ck, {"text": res.text, "usage": res.usage})
+    return _record(res)
+
+class ChatStream:
+    """
+    Iterate to receive the completion as text deltas; `result` holds the ChatResult
+    (with ttft) once the stream is exhausted. A cache hit is replayed as a single delta.
+    """
+    def __init__(self, messages: list[dict], temperature: float = 0.0, deadline: float | None = None,
+                 cache: bool = True, key: str | None = None):
+        self.messages, self.temperature, self.deadline = messages, temperature, deadline
+        self._key = _cache_key(messages, temperature, key) if cache and LLM_CACHE else None
+        self.result: Optional[ChatResult] = None
+        self.context: Optional[Dict[str, Any]] = None   # prompt context stats, set by the caller
+
+    def __iter__(self) -> Iterator[str]:
+        started = time.perf_counter()
+        value = CACHE.lookup(self._key) if self._key else None
+        if value is not None:
+            self.result = _from_cache(value, started, True, None)
+            self.result.ttft = self.result.latency
+            _record(self.result, stream=True)
+            yield value["text"]
+            return
+        payload = {**_payload(self.messages, self.temperature), "stream": True,
+                   "stream_options": {"include_usage": True}}
+        resp, retries = _send(payload, deadline=self.deadline, stream=True)
+        parts, usage, ttft = [], {}, None
+        try:
+            for event in _sse_events(resp):
+                usage = event.get("usage") or usage   # the last event carries usage
+                for choice in event.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        parts.append(delta)
+                        yield delta
+        except requests.RequestException as e:
+            raise RuntimeError(f"AIML API stream interrupted: {e}") from e
+        finally:
+            resp.close()
+        # only a complete stream gets here: errors and truncation raised above, so nothing partial is cached
+        text = "".join(parts)
+        self.result = ChatResult(text=text, latency=time.perf_counter() - started, retries=retries,
+                                 usage=usage, ttft=ttft)
+        _record(self.result, stream=True)
+        if self._key:
+            CACHE.put(self._key, {"text": text, "usage": usage})
+
+def chat_stream(messages: list[dict], temperature: float = 0.0, deadline: float | None = None,
+                cache: bool = True, key: str | None = None) -> ChatStream:
+    """Streaming chat_result(): same cache keys, so streamed and blocking calls share entries."""
+    return ChatStream(messages, temperature, deadline=deadline, cache=cache, key=key)
+
+def chat(messages: list[dict], temperature: float = 0.0) -> str:
+    """
+    messages = [{"role":"system"|"user"|"assistant", "content":"..."}]
+    returns assistant text content
+    """
+    return chat_result(messages, temperature).text
+
+async def achat(messages: list[dict], temperature: float = 0.0) -> str:
+    return (await achat_result(messages, temperature)).text
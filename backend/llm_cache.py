@@ -0,0 +1,130 @@
+import os, json, time, hashlib, sqlite3, threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+LLM_CACHE         = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH    = Path(os.getenv("LLM_CACHE_PATH", str(Path(os.getenv("INDEX_ROOT", "data")) / "_cache" / "llm.sqlite")))
+LLM_CACHE_TTL     = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))   # seconds
+LLM_CACHE_MAX_MB  = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+EVICT_EVERY = 64   # puts between size checks
+
+def cache_key(*parts: Any) -> str:
+    """Content address for a cached completion: sha256 over the JSON of `parts`."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    Persistent SQLite cache of LLM completions with TTL and size-based LRU eviction.
+    get_or_compute() is single-flight: concurrent callers with the same key share one upstream call.
+    """
+    def __init__(self, path: Path = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_bytes: int = LLM_CACHE_MAX_MB * 1024 * 1024):
+        self.path, self.ttl, self.max_bytes = Path(path), ttl, max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._puts = 0
+        self.hits = self.misses = self.shared = self.evictions = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        conn, now = self._conn(), time.time()
+        row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() counted as a hit or miss, for callers that produce the value themselves (streams)."""
+        value = self.get(key)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        raw, now = json.dumps(value, ensure_ascii=False), time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, raw, len(raw), now, now),
+        )
+        with self._lock:
+            self._puts += 1
+            check = self._puts % EVICT_EVERY == 0
+        if check:
+            self.evict()
+
+    def evict(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop least recently used rows until we're back under 90% of the budget
+        excess, dropped = total - int(self.max_bytes * 0.9), []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if excess <= 0:
+                break
+            dropped.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", dropped)
+        with self._lock:
+            self.evictions += len(dropped)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """Returns (value, hit). Waiting on another caller's in-flight computation counts as a hit."""
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value, True
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return fut.result(), True
+        try:
+            value = compute()
+            self.put(key, value)
+            fut.set_result(value)
+            return value, False
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "shared": self.shared,
+                    "evictions": self.evictions, "enabled": LLM_CACHE}
+
+CACHE = LLMCache()
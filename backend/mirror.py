@@ -0,0 +1,149 @@
+"""
+Persistent bare mirrors of ingested repositories under INDEX_ROOT/_mirrors/.
+
+The first ingest of a URL makes a shallow partial clone (--filter=blob:limit) so blobs larger
+than MAX_FILE_BYTES never leave the server; later ingests fetch the new HEAD into the same
+mirror, unless MAX_FILE_BYTES has changed since the clone (git records the filter as
+remote.origin.partialclonefilter), in which case the mirror is cloned again under the new
+filter so blobs between the old and new limit are not left missing. The ingest checkout is an export of only the paths the walker would index, streamed
+out of the mirror by one `git cat-file --batch` fed only blobs the mirror has (per
+`rev-list --missing=print`); on git >= 2.44 it also runs with --no-lazy-fetch, so a filtered
+blob is an error rather than a download. Older git has no way to turn lazy fetching off and
+relies on the missing-blob check alone. A lock file per mirror serializes ingests of the same
+URL across threads and processes.
+"""
+import os, re, time, fcntl, shutil, hashlib, threading, subprocess, uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+from .walker import MAX_FILE_BYTES
+
+MIRROR_CACHE = os.getenv("MIRROR_CACHE", "1") == "1"   # 0 = plain shallow clone into a temp dir per ingest
+MIRROR_ROOT = Path(os.getenv("INDEX_ROOT", "data")) / "_mirrors"
+MIRROR_LOCK_TIMEOUT = float(os.getenv("MIRROR_LOCK_TIMEOUT", "600"))   # seconds to wait for another ingest's fetch
+BLOB_FILTER = f"blob:limit={MAX_FILE_BYTES + 1}"   # omits blobs of at least this many bytes
+NO_LAZY_FETCH_GIT = (2, 44)   # first git with --no-lazy-fetch (and GIT_NO_LAZY_FETCH)
+
+def mirror_path(repo_url: str) -> Path:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", repo_url.rstrip("/").removesuffix(".git"))[-60:]
+    return MIRROR_ROOT / f"{slug}-{hashlib.sha1(repo_url.encode('utf-8')).hexdigest()[:12]}.git"
+
+@contextmanager
+def mirror_lock(path: Path, timeout: float = MIRROR_LOCK_TIMEOUT) -> Iterator[None]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    with open(path.with_suffix(".lock"), "a") as fh:
+        while True:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"mirror {path.name} is locked by another ingest")
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _git(cwd: Path, *args: str) -> str:
+    return subprocess.check_output(["git", *args], cwd=cwd, text=True)
+
+@lru_cache(maxsize=1)
+def git_version() -> Tuple[int, ...]:
+    m = re.search(r"(\d+)\.(\d+)(?:\.(\d+))?", subprocess.check_output(["git", "--version"], text=True))
+    return tuple(int(g or 0) for g in m.groups()) if m else (0,)
+
+def _no_lazy_fetch() -> List[str]:
+    return ["--no-lazy-fetch"] if git_version() >= NO_LAZY_FETCH_GIT else []
+
+def _upload_pack(repo_url: str) -> List[str]:
+    # git serves local repos itself, with filters off unless the source repo allows them
+    return ["--upload-pack=git -c uploadpack.allowFilter=true upload-pack"] if repo_url.startswith("file://") else []
+
+def _clone(repo_url: str, path: Path) -> None:
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        subprocess.check_call(["git", "clone", "--quiet", "--bare", "--depth", "1", "--no-tags",
+                               f"--filter={BLOB_FILTER}", *_upload_pack(repo_url), repo_url, str(tmp)])
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _clone_filter(path: Path) -> str:
+    try:
+        return _git(path, "config", "--get", "remote.origin.partialclonefilter").strip()
+    except subprocess.CalledProcessError:
+        return ""
+
+def update_mirror(repo_url: str) -> Tuple[Path, str]:
+    """Bring the mirror of repo_url up to the remote HEAD; returns (mirror dir, commit). Hold mirror_lock."""
+    path = mirror_path(repo_url)
+    if (path / "HEAD").exists() and _clone_filter(path) == BLOB_FILTER:
+        try:
+            # only the new objects come over the wire, under the filter recorded at clone time
+            _git(path, "fetch", "--quiet", "--depth", "1", *_upload_pack(repo_url), "origin", "HEAD")
+            _git(path, "update-ref", "HEAD", "FETCH_HEAD")
+        except subprocess.CalledProcessError:
+            _clone(repo_url, path)   # damaged mirror: replaced only if a fresh clone succeeds
+    else:
+        _clone(repo_url, path)   # new URL, or a mirror filtered at another MAX_FILE_BYTES
+    return path, _git(path, "rev-parse", "HEAD").strip()
+
+def export_tree(mirror: Path, commit: str, dest: Path, want: Callable[[str], bool]) -> Dict[str, str]:
+    """
+    Write the blobs of `commit` whose path passes want() (and that the filter kept) under dest.
+    Returns path -> blob sha for every file in the commit, exported or not.
+    """
+    blobs: Dict[str, str] = {}
+    todo: List[Tuple[str, str]] = []
+    missing = {line[1:] for line in _git(mirror, "rev-list", "--objects", "--missing=print", commit).splitlines()
+               if line.startswith("?")}
+    for entry in _git(mirror, "ls-tree", "-r", "-z", commit).split("\0"):
+        if not entry:
+            continue
+        info, rel = entry.split("\t", 1)
+        mode, kind, sha = info.split()
+        if kind != "blob":
+            continue   # submodules
+        blobs[rel] = sha
+        if mode != "120000" and sha not in missing and want(rel):   # symlinks are not followed
+            todo.append((rel, sha))
+
+    dest.mkdir(parents=True, exist_ok=True)
+    proc = subprocess.Popen(["git", *_no_lazy_fetch(), "cat-file", "--batch"], cwd=mirror,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    def feed() -> None:
+        try:
+            for _, sha in todo:
+                proc.stdin.write(sha.encode("ascii") + b"\n")
+            proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass   # reader gave up and killed cat-file
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        for rel, sha in todo:
+            header = proc.stdout.readline().split()
+            if len(header) != 3 or header[1] != b"blob":
+                raise RuntimeError(f"git cat-file: unexpected reply {header!r} for {rel}")
+            data = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)   # trailing newline
+            target = dest / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+    finally:
+        if proc.poll() is None:
+            proc.kill()   # no-op race on success: everything has been read
+        writer.join()
+        proc.stdout.close()
+        proc.wait()
+    return blobs
+
+def checkout(repo_url: str, dest: Path, want: Callable[[str], bool]) -> Tuple[str, Dict[str, str]]:
+    """Fetch repo_url into its mirror and export the wanted paths of HEAD to dest: (commit, blobs)."""
+    with mirror_lock(mirror_path(repo_url)):
+        mirror, commit = update_mirror(repo_url)
+        return commit, export_tree(mirror, commit, dest, want)
@@ -1,123 +1,410 @@
-import os, re, json, subprocess, tempfile
+import os, re, json, time, shutil, hashlib, contextvars, subprocess, tempfile, multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Iterable
-from tiktoken import get_encoding
-from .llm import chat
-
-ENC = get_encoding("cl100k_base")
-
-DEFAULT_GLOB = [
-    "**/*.py","**/*.ipynb","**/*.md","**/*.txt",
-    "**/*.js","**/*.ts","**/*.tsx","**/*.jsx",
-    "**/*.go","**/*.rs","**/*.java","**/*.scala","**/*.kt",
-    "**/*.c","**/*.cpp","**/*.h","**/*.hpp",
-    "**/*.yaml","**/*.yml","**/*.toml","**/*.ini",
-    "**/Dockerfile","**/Makefile","**/requirements.txt","**/pyproject.toml",
-    "**/package.json","**/README*","**/LICENSE*"
-]
-BINARY_PAT = re.compile(r"\.(png|jpg|jpeg|gif|pdf|mp4|zip|tar|gz|tgz|7z|exe|dylib|so|bin)$", re.I)
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Callable
+import numpy as np
+from .analyzer import current_analyzer
+from .chunker import chunk_texts, chunker_config
+from .llm import BREAKER_COOLDOWN, CircuitOpenError, RateLimitError, TokenBucket, UsageMeter, _backoff, chat_result
+from .llm_cache import cache_key
+from .bm25_index import BM25Index, IndexBuilder
+from .telemetry import StageSpans, inc, span
+from .dense import DENSE_RETRIEVAL, DenseWriter, current_embedder, dense_config
+from .chunk_store import ChunkWriter, open_chunks
+from .detectors import SIGNALS_VERSION, content_signals, wants_content
+from .walker import MAX_FILE_BYTES, exportable, walk_repo
+from .mirror import MIRROR_CACHE, checkout as mirror_checkout
+
 TOP_TAG_FILES = int(os.getenv("TOP_TAG_FILES", "20"))
+TAG_CONCURRENCY = int(os.getenv("TAG_CONCURRENCY", "4"))
+TAG_RPS = float(os.getenv("TAG_RPS", "2"))          # sustained tag requests per second
+TAG_RETRIES = int(os.getenv("TAG_RETRIES", "4"))    # extra attempts per file (429, 5xx, open breaker)
+TAG_PROMPT_VERSION = 1   # bump when the tag prompt changes to invalidate cached tags
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))  # chunk/tokenize processes
+INGEST_MEMORY_MB = int(os.getenv("INGEST_MEMORY_MB", "512"))   # peak working-set budget for one ingest
+FILE_WORKSET_BYTES = 4 << 20   # rough peak per in-flight batch: 200 KB text → chunks + term counts
+FILE_BATCH_BYTES = 200_000     # files are chunked in batches of up to this much text (one encode call each)
+FILE_BATCH_FILES = 64
+CHUNK_META = ("start_line", "end_line", "start_byte", "end_byte")
+# the API process has live threads (tag workers, job runner, HTTP pools): fork would copy locks
+# they hold, so workers start from a single-threaded forkserver (spawn where there is none)
+_MP = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+if _MP.get_start_method() == "forkserver":
+    _MP.set_forkserver_preload([__name__])   # workers fork with the chunker and tokenizer already imported
+ANALYZER = current_analyzer()   # BM25_ANALYZER / BM25_STOPWORDS; the retriever reloads it from bm25/meta.json
 
 def _shallow_clone(repo_url: str, workdir: Path) -> Path:
     repo_dir = workdir / "repo"
     subprocess.check_call(["git","clone","--depth","1", repo_url, str(repo_dir)])
     return repo_dir
 
-def _read_files(repo_dir: Path) -> Iterable[Dict[str,Any]]:
-    seen: set[str] = set()
-    for pat in DEFAULT_GLOB:
-        for p in repo_dir.glob(pat):
-            if not p.is_file(): 
-                continue
-            rel = p.relative_to(repo_dir).as_posix()
-            if rel in seen:       # <— dedupe (README.md etc.)
-                continue
-            if BINARY_PAT.search(rel):
-                continue
-            seen.add(rel)
-            try:
-                txt = p.read_text(encoding="utf-8", errors="ignore")
-            except Exception:
-                continue
-            if len(txt) > 200_000:
-                continue
-            yield {"path": rel, "text": txt, "size": len(txt)}
-
-def _chunk(text: str, max_tokens=450) -> List[str]:
-    toks = ENC.encode(text)
-    return [ENC.decode(toks[i:i+max_tokens]) for i in range(0, len(toks), max_tokens)]
-
-def build_index(repo_url: str, out_dir: Path) -> Dict[str, Any]:
-    # Always write index INSIDE out_dir (per-repo)
-    out_dir.mkdir(parents=True, exist_ok=True)
+def _git(repo_dir: Path, *args: str) -> str:
+    return subprocess.check_output(["git", *args], cwd=repo_dir, text=True)
 
-    with tempfile.TemporaryDirectory() as td:
-        repo_dir = _shallow_clone(repo_url, Path(td))
-        docs = list(_read_files(repo_dir))
-
-    # sample preview to prove we're indexing the right repo
-    sample_paths = [d["path"] for d in docs[:10]]
-    (out_dir / "sample_paths.json").write_text(json.dumps(sample_paths, indent=2), encoding="utf-8")
-
-    # LLM tag pass on top-N files (uses your AIML ChatGPT-5 client)
-    tag_targets = sorted(docs, key=lambda d: d["size"], reverse=True)[:min(TOP_TAG_FILES, len(docs))]
-    file_summaries = []
-    for f in tag_targets:
-        msg = [
-            {"role":"system","content":"Label repository files for RAG. Output strict JSON."},
-            {"role":"user","content":(
-                f"Path: {f['path']}\n\nSample:\n{f['text'][:1600]}\n\n"
-                "Return JSON keys: path, brief_summary (<=25 words), "
-                "tags (<=5, e.g., data-loader, docker, training-loop, infra, api, tests), language."
-            )},
-        ]
+def _remote_head(repo_url: str) -> Optional[str]:
+    try:
+        out = subprocess.check_output(["git","ls-remote", repo_url, "HEAD"], text=True, timeout=60)
+    except Exception:
+        return None
+    return out.split()[0] if out.strip() else None
+
+def _checkout(repo_url: str, workdir: Path) -> tuple[Path, str, Dict[str, str]]:
+    """HEAD of repo_url on disk under workdir: (repo_dir, commit, path -> blob sha)."""
+    if MIRROR_CACHE:
+        repo_dir = workdir / "repo"
+        commit, blobs = mirror_checkout(repo_url, repo_dir, exportable)
+        return repo_dir, commit, blobs
+    repo_dir = _shallow_clone(repo_url, workdir)
+    return repo_dir, _git(repo_dir, "rev-parse", "HEAD").strip(), _tree_blobs(repo_dir)
+
+def _tree_blobs(repo_dir: Path) -> Dict[str, str]:
+    """path -> git blob sha for every file at HEAD (no file contents are read)."""
+    out = _git(repo_dir, "ls-tree", "-r", "-z", "HEAD")
+    blobs = {}
+    for entry in out.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        _, kind, sha = info.split()
+        if kind == "blob":
+            blobs[path] = sha
+    return blobs
+
+def _list_files(repo_dir: Path) -> Iterable[tuple[Path, str]]:
+    for p, rel, _ in walk_repo(repo_dir).files:
+        yield p, rel
+
+def _read_file(p: Path, rel: str) -> Optional[Dict[str,Any]]:
+    try:
+        # no newline translation, so chunk byte offsets point into the file as stored
+        raw = p.read_bytes()
+    except Exception:
+        return None
+    if len(raw) > MAX_FILE_BYTES:   # grew since the walk's stat
+        return None
+    return {"path": rel, "text": raw.decode("utf-8", errors="ignore"), "size": len(raw), "blob": _blob_sha(raw)}
+
+def _process_batch(items: List[tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+    """Read → chunk → tokenize a batch of files. Runs in a worker process."""
+    docs = [_read_file(Path(path), rel) for path, rel in items]
+    texts = [(d["path"], d["text"]) for d in docs if d is not None]
+    chunked = iter(chunk_texts(texts))   # one batched token count for the whole batch
+    out = []
+    for doc in docs:
+        if doc is None:
+            out.append(None)
+            continue
+        chunks = next(chunked)
+        tfs, lens = [], []
+        for ch in chunks:
+            toks = ANALYZER.analyze(ch["text"])
+            tfs.append(Counter(toks))
+            lens.append(len(toks))
+        out.append({"path": doc["path"], "size": doc["size"], "chunks": chunks, "tfs": tfs, "lens": lens,
+                    "signals": content_signals(doc["path"], doc["text"])})
+    return out
+
+def _batches(items: Iterable[tuple[Path, str]], sizes: Dict[str, int]) -> Iterator[List[tuple[str, str]]]:
+    batch, total = [], 0
+    for p, rel in items:
+        if batch and (total + sizes.get(rel, 0) > FILE_BATCH_BYTES or len(batch) >= FILE_BATCH_FILES):
+            yield batch
+            batch, total = [], 0
+        batch.append((str(p), rel))
+        total += sizes.get(rel, 0)
+    if batch:
+        yield batch
+
+def _stream_map(fn: Callable, items: Iterable, workers: int, window: int) -> Iterator:
+    """Ordered map over a process pool with at most `window` items in flight."""
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_MP) as ex:
+        pending: deque = deque()
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _blob_sha(data: bytes) -> str:
+    # same id git gives the file's blob (hashed over the bytes as stored, not the decoded text)
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _strip_fence(content: str) -> str:
+    return re.sub(r"^```json|```$", "", content.strip(), flags=re.M)
+
+def _tag_file(f: Dict[str, Any], bucket: TokenBucket, meter: UsageMeter) -> Dict[str, Any]:
+    msg = [
+        {"role":"system","content":"Label repository files for RAG. Output strict JSON."},
+        {"role":"user","content":(
+            f"Path: {f['path']}\n\nSample:\n{f['text'][:1600]}\n\n"
+            "Return JSON keys: path, brief_summary (<=25 words), "
+            "tags (<=5, e.g., data-loader, docker, training-loop, infra, api, tests), language."
+        )},
+    ]
+    error = ""
+    for attempt in range(TAG_RETRIES + 1):
+        bucket.acquire()
+        try:
+            # identical file content → cached tags, regardless of path or repo; one HTTP attempt
+            # per try, so the first 429 pauses every tag worker instead of one worker's retries
+            res = chat_result(msg, temperature=0.0, retries=0,
+                              key=cache_key("tag", TAG_PROMPT_VERSION, f["blob"]))
+        except RateLimitError as e:
+            bucket.penalize(e.retry_after or 2 ** attempt)   # slow down every tag worker
+            error = str(e)
+            continue
+        except CircuitOpenError as e:
+            bucket.penalize(BREAKER_COOLDOWN)   # provider failing: wait out the cooldown together
+            error = str(e)
+            continue
+        except Exception as e:   # 5xx, timeouts, unreachable
+            error = str(e)
+            if attempt < TAG_RETRIES:
+                time.sleep(_backoff(attempt, None))
+            continue
+        meter.add(res)
+        try:
+            js = json.loads(_strip_fence(res.text))
+        except ValueError:
+            error = "tag reply is not JSON"
+            break
+        js["path"] = f["path"]
+        return js
+    # marked, so the next ingest tags the file again even if it is unchanged
+    return {"path": f["path"], "brief_summary":"", "tags": [], "language":"unknown", "error": error}
+
+def _tag_path(p: Path, rel: str, bucket: TokenBucket, meter: UsageMeter) -> Optional[Dict[str, Any]]:
+    f = _read_file(p, rel)
+    return _tag_file(f, bucket, meter) if f else None
+
+def _repo_map(file_summaries: List[Dict[str, Any]], out_dir: Path, meter: UsageMeter) -> None:
+    with span("ingest.repo_map"):
         try:
-            content = chat(msg, temperature=0.0)
-            content = re.sub(r"^```json|```$", "", content.strip(), flags=re.M)
-            js = json.loads(content)
-            js["path"] = f["path"]
+            res = chat_result(
+                [
+                    {"role":"system","content":"Produce a concise architecture map. Output JSON only."},
+                    {"role":"user","content": json.dumps(file_summaries) + 
+                     "\nSummarize the repo: components[], entry_points[], services[], dependencies[], deployment[]"}
+                ],
+                temperature=0.0
+            )
+            meter.add(res)
+            (out_dir / "repo_map.json").write_text(_strip_fence(res.text), encoding="utf-8")
         except Exception:
-            js = {"path": f["path"], "brief_summary":"", "tags": [], "language":"unknown"}
-        file_summaries.append(js)
-
-    (out_dir / "files.json").write_text(json.dumps(file_summaries, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    # Build BM25 corpus (ALL files → chunks)
-    from rank_bm25 import BM25Okapi
-    corpus, meta = [], []
-    tag_map = {x["path"]: x for x in file_summaries}
-    for f in docs:
-        for idx, ch in enumerate(_chunk(f["text"])):
-            corpus.append(ch)
-            meta.append({
-                "path": f["path"],
-                "chunk_id": idx,
-                "tags": tag_map.get(f["path"], {}).get("tags", []),
-                "summary": tag_map.get(f["path"], {}).get("brief_summary",""),
-            })
-    tokenized = [c.lower().split() for c in corpus]
-    bm25 = BM25Okapi(tokenized)
-
-    # Persist inside out_dir
-    (out_dir / "corpus.jsonl").write_text(
-        "\n".join(json.dumps({"text":t, "meta":m}) for t,m in zip(corpus, meta)),
-        encoding="utf-8"
-    )
-    (out_dir / "tokenized.json").write_text(json.dumps(tokenized), encoding="utf-8")
-
-    # Repo map (nice to have)
+            pass
+
+def _load_state(out_dir: Path) -> Optional[Dict[str, Any]]:
+    # incremental ingest needs the previous state and a non-legacy index
+    paths = [out_dir / "state.json", out_dir / "bm25" / "meta.json"]
+    if not all(p.exists() for p in paths) or open_chunks(out_dir) is None:
+        return None
+    try:
+        return json.loads(paths[0].read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def _load_summaries(out_dir: Path) -> Dict[str, Dict[str, Any]]:
     try:
-        repo_map = chat(
-            [
-                {"role":"system","content":"Produce a concise architecture map. Output JSON only."},
-                {"role":"user","content": json.dumps(file_summaries) + 
-                 "\nSummarize the repo: components[], entry_points[], services[], dependencies[], deployment[]"}
-            ],
-            temperature=0.0
-        )
-        repo_map = re.sub(r"^```json|```$", "", repo_map.strip(), flags=re.M)
-        (out_dir / "repo_map.json").write_text(repo_map, encoding="utf-8")
+        return {x["path"]: x for x in json.loads((out_dir / "files.json").read_text(encoding="utf-8"))}
     except Exception:
-        pass
+        return {}
+
+def build_index(repo_url: str, out_dir: Path, full: bool = False, prev_dir: Optional[Path] = None,
+                progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """
+    Clone, chunk, tag and index `repo_url` into out_dir as a streaming pipeline:
+    walk → read → chunk → tokenize (process pool) → append to the chunk store and BM25 segments,
+    with peak memory bounded by INGEST_MEMORY_MB regardless of repo size.
+    Re-ingests are incremental unless full=True: the previous index in prev_dir (default: out_dir)
+    is diffed by git blob hash, only added/modified files are processed and re-tagged, removed
+    ones are dropped, and kept chunks' postings are reused.
+    progress(stage, **counters) is called as the pipeline advances
+    (stages: clone, read, chunk, tag, index, persist); each stage is also an "ingest.<stage>" span.
+    """
+    stages = StageSpans("ingest")
+    def report(stage: str, **counters: Any) -> None:
+        stages.enter(stage)
+        if progress is not None:
+            progress(stage, **counters)
+    try:
+        return _build_index(repo_url, out_dir, full, prev_dir, report)
+    finally:
+        stages.close()
+
+def _build_index(repo_url: str, out_dir: Path, full: bool, prev_dir: Optional[Path],
+                 report: Callable[..., None]) -> Dict[str, Any]:
+    prev_dir = prev_dir or out_dir
+    # Always write index INSIDE out_dir (per-repo)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state = None if full else _load_state(prev_dir)
+    if state and (state.get("repo_url") != repo_url or state.get("chunker") != chunker_config()
+                  or state.get("analyzer") != ANALYZER.spec()):
+        state = None   # same repo_id, different source, chunking or analyzer: start over
+    prev_files: Dict[str, Dict[str, Any]] = state["files"] if state else {}
+
+    # Nothing new upstream → nothing to do
+    report("clone")
+    if (state and state.get("dense") == dense_config() and state.get("signals") == SIGNALS_VERSION
+            and _remote_head(repo_url) == state.get("commit")):
+        sample_paths = json.loads((prev_dir / "sample_paths.json").read_text(encoding="utf-8"))
+        return {"n_files": len(prev_files), "n_chunks": state["n_chunks"], "sample_paths": sample_paths,
+                "incremental": True, "unchanged": True}
+
+    budget = INGEST_MEMORY_MB << 20
+    window = max(1, (budget // 2) // FILE_WORKSET_BYTES)   # half the budget for file batches in flight
+
+    with tempfile.TemporaryDirectory() as td:
+        repo_dir, commit, blobs = _checkout(repo_url, Path(td))
+
+        report("read")
+
+        walk = walk_repo(repo_dir)
+        listed = [(p, rel) for p, rel, _ in walk.files]
+        unchanged = {rel for _, rel in listed if rel in prev_files and prev_files[rel]["blob"] == blobs.get(rel)}
+        changed = [(p, rel) for p, rel in listed if rel not in unchanged]
+        sizes = {rel: prev_files[rel]["size"] for rel in unchanged}
+        stat_sizes = {rel: size for _, rel, size in walk.files if rel not in unchanged}
+        # content signals (web framework use) come from the workers that read each file;
+        # unchanged files keep theirs from state.json
+        file_signals = {rel: prev_files[rel].get("signals", []) for rel in unchanged}
+        if state and state.get("signals") != SIGNALS_VERSION:
+            file_signals.update({rel: content_signals(rel, (_read_file(p, rel) or {"text": ""})["text"])
+                                 for p, rel in listed if rel in unchanged and wants_content(rel)})
+        report("read", files_total=len(listed), files_changed=len(changed), files_unchanged=len(unchanged),
+               files_too_large=walk.skipped["too_large"], dirs_pruned=walk.skipped["dirs"])
+        inc("ingest_files_total", len(listed), kind="listed")
+        inc("ingest_files_total", len(changed), kind="changed")
+
+        with ThreadPoolExecutor(max_workers=max(1, TAG_CONCURRENCY), thread_name_prefix="tag") as pool:
+            # LLM tag pass on top-N files, fanned out and rate limited (uses your AIML ChatGPT-5 client).
+            # Unchanged files keep their previous tags; others are (re)tagged.
+            tag_targets = sorted(listed, key=lambda x: sizes.get(x[1], stat_sizes.get(x[1], 0)), reverse=True)[:TOP_TAG_FILES]
+            prev_summaries = _load_summaries(prev_dir) if state else {}
+            bucket = TokenBucket(rate=TAG_RPS, burst=max(1, TAG_CONCURRENCY))
+            meter = UsageMeter()
+            t0 = time.perf_counter()
+            reuse_tags = {rel for rel in unchanged if "error" not in prev_summaries.get(rel, {"error": "untagged"})}
+            tag_futures = [prev_summaries[rel] if rel in reuse_tags
+                           else pool.submit(_tag_path, p, rel, bucket, meter) for p, rel in tag_targets]
+            tags_total = sum(1 for x in tag_futures if not isinstance(x, dict))
+
+            # Stream chunks to disk while tags are in flight; tags are merged into metadata at the end
+            builder = IndexBuilder(out_dir / "bm25", buffer_bytes=budget // 4)
+            # chunk embeddings (optional) are written in the same doc order, EMBED_BATCH at a time
+            dense = DenseWriter(out_dir / "dense", current_embedder()) if DENSE_RETRIEVAL else None
+            # chunk texts go to compressed blocks; tags/summaries are stored per file at finish
+            chunks = ChunkWriter(out_dir / "chunks")
+            # unchanged files stay in state.json even when they have no chunks (e.g. empty files)
+            n_chunks_by_file: Dict[str, int] = dict.fromkeys(unchanged, 0)
+            try:
+                if state:
+                    keep = []
+                    reuse = dense is not None and dense.compatible(prev_dir / "dense")
+                    for row in open_chunks(prev_dir):
+                        rel = row["meta"]["path"]
+                        keep.append(rel in unchanged)
+                        if keep[-1]:
+                            chunks.add(row["text"], row["meta"])
+                            n_chunks_by_file[rel] = n_chunks_by_file.get(rel, 0) + 1
+                            if dense is not None and not reuse:
+                                dense.add(row["text"])
+                    old_index = BM25Index.open(prev_dir / "bm25")
+                    builder.add_existing(old_index, np.asarray(keep, dtype=bool))
+                    if reuse:
+                        dense.add_existing(prev_dir / "dense", np.asarray(keep, dtype=bool))
+                    del old_index, keep
+
+                report("chunk", files_done=0, files_todo=len(changed))
+                n_done = 0
+                for batch in _stream_map(_process_batch, _batches(changed, stat_sizes), INGEST_WORKERS, window):
+                    n_done += len(batch)
+                    for res in batch:
+                        if res is None:
+                            continue
+                        sizes[res["path"]] = res["size"]
+                        file_signals[res["path"]] = res["signals"]
+                        n_chunks_by_file[res["path"]] = len(res["chunks"])
+                        inc("ingest_chunks_total", len(res["chunks"]))
+                        for idx, (ch, tf, n) in enumerate(zip(res["chunks"], res["tfs"], res["lens"])):
+                            chunks.add(ch["text"], {"path": res["path"], "chunk_id": idx, **{k: ch[k] for k in CHUNK_META}})
+                            builder.add(tf, n)
+                            if dense is not None:
+                                dense.add(ch["text"])
+                    report("chunk", files_done=n_done, chunks=builder.n_docs)
+
+                file_summaries, tags_done, tags_failed = [], 0, 0
+                report("tag", tags_total=tags_total, tags_done=0)
+                for x in tag_futures:   # files.json order
+                    if not isinstance(x, dict):
+                        x = x.result()
+                        tags_done += 1
+                        tags_failed += bool(x and "error" in x)
+                        report("tag", tags_done=tags_done, tags_failed=tags_failed)
+                    if x:
+                        file_summaries.append(x)
+                tag_seconds = time.perf_counter() - t0
+                (out_dir / "files.json").write_text(json.dumps(file_summaries, ensure_ascii=False, indent=2), encoding="utf-8")
+                signals = walk.signals
+                for x in file_summaries:
+                    signals.add_tags(x["path"], x.get("tags"))
+
+                # Repo map (nice to have) runs while the corpus is persisted
+                map_future = pool.submit(contextvars.copy_context().run, _repo_map, file_summaries, out_dir, meter)
+
+                report("index", chunks=builder.n_docs)
+                # tags and summaries are stored once per file, not on every chunk
+                file_meta = {x["path"]: {"tags": x.get("tags", []), "summary": x.get("brief_summary", "")}
+                             for x in file_summaries}
+                with span("ingest.chunks"):
+                    store_meta = chunks.finish(file_meta)   # published as out_dir/chunks (a fresh dir; old readers keep theirs)
+                with span("ingest.bm25"):
+                    bm25_meta = builder.finish(version=store_meta["version"], analyzer=ANALYZER.spec())   # mmappable inverted index
+                if dense is not None:
+                    with span("ingest.dense"):
+                        dense.finish()
+                else:
+                    shutil.rmtree(out_dir / "dense", ignore_errors=True)   # in-place rebuild with dense turned off
+            except BaseException:
+                chunks.abort()
+                builder.abort()
+                if dense is not None:
+                    dense.abort()
+                raise
+            report("persist")
+            for legacy in ("tokenized.json", "corpus.jsonl"):   # superseded legacy formats
+                (out_dir / legacy).unlink(missing_ok=True)
+
+            order = [rel for _, rel in listed if rel in n_chunks_by_file]
+            # sample preview to prove we're indexing the right repo
+            sample_paths = order[:10]
+            (out_dir / "sample_paths.json").write_text(json.dumps(sample_paths, indent=2), encoding="utf-8")
+            for rel in order:
+                signals.add(file_signals.get(rel, ()), rel)
+            signals.write(out_dir)   # detect_modes reads only this
+            new_state = {
+                "repo_url": repo_url,
+                "commit": commit,
+                "chunker": chunker_config(),
+                "analyzer": ANALYZER.spec(),
+                "dense": dense_config(),
+                "n_chunks": bm25_meta["n_docs"],
+                "signals": SIGNALS_VERSION,
+                "files": {rel: {"blob": blobs.get(rel, ""), "size": sizes[rel], "n_chunks": n_chunks_by_file[rel],
+                                **({"signals": file_signals[rel]} if file_signals.get(rel) else {})} for rel in order},
+            }
+            (out_dir / "state.json").write_text(json.dumps(new_state), encoding="utf-8")
+            map_future.result()
 
-    return {"n_files": len(docs), "n_chunks": len(corpus), "sample_paths": sample_paths}
+    added = sum(1 for rel in order if rel not in prev_files)
+    return {"n_files": len(order), "n_chunks": bm25_meta["n_docs"], "sample_paths": sample_paths,
+            "tag_seconds": round(tag_seconds, 3), "tags_failed": tags_failed, "llm": meter.snapshot(),
+            "incremental": state is not None, "commit": commit,
+            "changed": {"added": added,
+                        "modified": len(order) - added - len(unchanged),
+                        "removed": sum(1 for rel in prev_files if rel not in n_chunks_by_file),
+                        "unchanged": len(unchanged)}}
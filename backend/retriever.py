@@ -1,48 +1,101 @@
-import json
 from pathlib import Path
-from typing import List, Dict, Any, Literal
-from rank_bm25 import BM25Okapi
-from .llm import chat
+from typing import List, Dict, Any, Literal, Optional, Tuple
+from .analyzer import analyzer_for_index
+from .bm25_index import open_index
+from .chunk_store import open_chunks
+from .dense import DENSE_RETRIEVAL, HYBRID_DEPTH, embedder_for_index, open_dense, reciprocal_rank_fusion
+from .storage import active_dir
+from .llm import ChatStream, chat_result, chat_stream
+from .llm_cache import cache_key
+from .telemetry import inc, span
+from .context import CONTEXT_CANDIDATES, MODE_BUDGETS, build_context, prompt_tokens
+
+SYSTEM_PROMPT = "You are Repo-Ops: concise, precise, evidence-backed. If unsure, give 2 options."
+INSTRUCTIONS = {
+    "explain": "Explain concisely with evidence; cite paths inline like [path:start-end].",
+    "stack":   "List frameworks/libs & versions from evidence.",
+    "run":     "Give exact local run steps (install, env, entrypoint).",
+    "deploy":  "Propose minimal Docker+service plan. Call out secrets and ports.",
+    "test":    "Show how to run the tests (pytest/coverage) with minimal commands."
+}
+# part of every answer cache key: edits to the prompt texts invalidate cached answers by
+# themselves; bump the number when the message template in _prompt changes
+ANSWER_PROMPT_VERSION = cache_key(1, SYSTEM_PROMPT, INSTRUCTIONS)[:16]
 
 class Retriever:
     def __init__(self, repo_dir: Path):
-        self.repo_dir = Path(repo_dir)
+        self.repo_dir = active_dir(Path(repo_dir))   # the published index version
         self._load()
 
     def _load(self):
-        corpus_path = self.repo_dir / "corpus.jsonl"
-        tok_path    = self.repo_dir / "tokenized.json"
-        if not corpus_path.exists() or not tok_path.exists():
+        self.chunks = open_chunks(self.repo_dir)   # mmapped chunks/ or legacy corpus.jsonl; rows read per query
+        self.bm25 = open_index(self.repo_dir)      # mmapped bm25/ or legacy tokenized.json
+        if self.chunks is None or self.bm25 is None:
             raise FileNotFoundError(f"Missing index files in {self.repo_dir}")
-        self.corpus, self.meta = [], []
-        with corpus_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                row = json.loads(line)
-                self.corpus.append(row["text"])
-                self.meta.append(row["meta"])
-        tokenized = json.loads(tok_path.read_text(encoding="utf-8"))
-        self.bm25 = BM25Okapi(tokenized)
+        # queries must be tokenized like the index was; a stale analyzer is reported, not fatal
+        self.analyzer, self.analyzer_mismatch = analyzer_for_index(self.bm25.analyzer)
+        self.dense = open_dense(self.repo_dir) if DENSE_RETRIEVAL else None   # only if ingest embedded chunks
+        if self.dense is not None:
+            if self.dense.n_docs != self.bm25.n_docs:
+                raise ValueError(f"Dense index in {self.repo_dir} does not match the corpus; re-ingest with full=true")
+            self.embedder = embedder_for_index(self.dense.meta["embedder"])
+
+    def approx_bytes(self) -> int:
+        # rough resident size: per-file metadata + non-mmapped index arrays (chunk text stays on disk)
+        dense = self.dense.resident_bytes() if self.dense is not None else 0
+        return self.chunks.resident_bytes() + self.bm25.resident_bytes() + dense
 
     def topk(self, query: str, k: int = 12) -> List[Dict[str,Any]]:
-        scores = self.bm25.get_scores(query.lower().split())
-        idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
-        return [{"text": self.corpus[i], "meta": self.meta[i], "score": float(scores[i])} for i in idxs]
-
-    def answer(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain", k: int = 12) -> str:
-        ctx = self.topk(query, k=k)
-        instruction = {
-            "explain": "Explain concisely with evidence; cite paths inline like [path:chunk].",
-            "stack":   "List frameworks/libs & versions from evidence.",
-            "run":     "Give exact local run steps (install, env, entrypoint).",
-            "deploy":  "Propose minimal Docker+service plan. Call out secrets and ports.",
-            "test":    "Show how to run the tests (pytest/coverage) with minimal commands."
-        }[mode]
+        inc("retrieval_queries_total", retrieval="bm25" if self.dense is None else "hybrid")
+        with span("retrieve.topk"):
+            tokens = self.analyzer.analyze(query)
+            if self.dense is None:
+                idxs, scores = self.bm25.topk(tokens, k)
+            else:
+                # hybrid: BM25 and vector candidates fused by reciprocal rank (score = fused RRF score)
+                depth = max(k, HYBRID_DEPTH)
+                b_idx, b_scores = self.bm25.topk(tokens, depth)
+                d_idx, d_scores = self.dense.search(self.embedder.embed([query])[0], depth)
+                idxs, scores = reciprocal_rank_fusion([b_idx[b_scores > 0], d_idx[d_scores > 0]], k)
+        with span("retrieve.fetch"):
+            rows = self.chunks.rows(idxs)
+        return [{**row, "score": float(s), "doc": int(i)} for row, i, s in zip(rows, idxs, scores)]
+
+    def answer(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain", k: int = CONTEXT_CANDIDATES) -> str:
+        return self.answer_with_stats(query, mode=mode, k=k)["answer"]
+
+    def answer_with_stats(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain", k: int = CONTEXT_CANDIDATES,
+                          cache: bool = True) -> Dict[str,Any]:
+        """answer() plus the LLM call's latency, retries and token usage, and the prompt's context stats."""
+        msgs, key, context = self._prompt(query, mode, k)
+        with span("llm"):
+            res = chat_result(msgs, temperature=0.1, key=key, cache=cache)
+        return {"answer": res.text, "llm": res.stats(), "context": context}
+
+    def answer_stream(self, query: str, mode: Literal["explain","stack","run","deploy","test"] = "explain", k: int = CONTEXT_CANDIDATES,
+                      cache: bool = True) -> ChatStream:
+        """Streaming answer(): iterate for text deltas, then read .result for latency/ttft/usage."""
+        msgs, key, context = self._prompt(query, mode, k)
+        stream = chat_stream(msgs, temperature=0.1, key=key, cache=cache)
+        stream.context = context
+        return stream
+
+    def _prompt(self, query: str, mode: str, k: int) -> Tuple[List[Dict[str,str]], Optional[str], Dict[str,Any]]:
+        # top-k candidates → merged, de-duplicated and packed into the mode's token budget
+        hits = self.topk(query, k=k)
+        with span("retrieve.context"):
+            evidence, blocks, context = build_context(hits, MODE_BUDGETS[mode])
         msgs = [
-            {"role":"system","content":"You are Repo-Ops: concise, precise, evidence-backed. If unsure, give 2 options."},
-            {"role":"user","content":
-                f"{instruction}\n\nUser intent: {mode}\n\nContext:\n" +
-                "\n\n".join(f"[{i}] PATH={c['meta']['path']} TAGS={c['meta'].get('tags',[])}\n{c['text']}"
-                            for i,c in enumerate(ctx))
-            }
+            {"role":"system","content": SYSTEM_PROMPT},
+            {"role":"user","content": f"{INSTRUCTIONS[mode]}\n\nUser intent: {mode}\n\nContext:\n{evidence}"}
         ]
-        return chat(msgs, temperature=0.1)
+        context["prompt_tokens"] = prompt_tokens(msgs)
+        context["analyzer"] = self.analyzer.name
+        context["retrieval"] = "bm25" if self.dense is None else "hybrid"
+        if self.analyzer_mismatch:
+            context["analyzer_stale"] = True   # index predates BM25_ANALYZER/BM25_STOPWORDS; re-ingest with full=true
+        # same question over the same evidence in the same index version → cached answer
+        key = (cache_key("answer", ANSWER_PROMPT_VERSION, query, mode, [b["docs"] for b in blocks],
+                         context["budget"], self.bm25.version)
+               if self.bm25.version else None)
+        return msgs, key, context
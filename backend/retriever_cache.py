@@ -0,0 +1,106 @@
+import os, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Iterable
+from .retriever import Retriever
+from .storage import active_dir
+from .telemetry import span
+
+CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVER_CACHE_SIZE", "8"))
+CACHE_MAX_MB      = int(os.getenv("RETRIEVER_CACHE_MB", "1024"))
+WARM_REPOS        = [r.strip() for r in os.getenv("WARM_REPOS", "").split(",") if r.strip()]
+
+def _index_stamp(repo_dir: Path) -> tuple[str, float]:
+    # the active version dir changes on every publish; mtime covers legacy in-place indexes
+    vdir = active_dir(repo_dir)
+    for name in ("chunks/meta.json", "corpus.jsonl"):
+        try:
+            return vdir.name, (vdir / name).stat().st_mtime
+        except OSError:
+            pass
+    return vdir.name, 0.0
+
+class RetrieverCache:
+    """
+    Process-wide, thread-safe LRU of loaded Retrievers keyed by repo_id.
+    Bounded by entry count and by an approximate memory budget.
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_MB * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple[Retriever, tuple, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}   # <— one loader per repo_id
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, repo_id: str, repo_dir: Path) -> Retriever:
+        repo_dir = Path(repo_dir)
+        stamp = _index_stamp(repo_dir)
+        with self._lock:
+            entry = self._entries.get(repo_id)
+            if entry and entry[1] == stamp:
+                self._entries.move_to_end(repo_id)
+                self.hits += 1
+                return entry[0]
+            load_lock = self._loading.setdefault(repo_id, threading.Lock())
+
+        # Load outside the global lock so other repos stay servable
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(repo_id)
+                if entry and entry[1] == stamp:
+                    self._entries.move_to_end(repo_id)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            with span("retriever.load"):
+                r = Retriever(repo_dir)
+            with self._lock:
+                self._entries[repo_id] = (r, stamp, r.approx_bytes())
+                self._entries.move_to_end(repo_id)
+                self._evict()
+            return r
+
+    def invalidate(self, repo_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(repo_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def warm(self, data_root: Path, repo_ids: Iterable[str] = WARM_REPOS) -> None:
+        for repo_id in repo_ids:
+            try:
+                self.get(repo_id, Path(data_root) / repo_id)
+            except Exception:
+                pass   # a missing/broken index must not block startup
+
+    def _evict(self) -> None:
+        # caller holds self._lock; always keep the most recent entry
+        total = sum(e[2] for e in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e[2] for e in self._entries.values()),
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "repos": list(self._entries.keys()),
+            }
+
+RETRIEVERS = RetrieverCache()
+
+def get_retriever(repo_dir: Path) -> Retriever:
+    repo_dir = Path(repo_dir)
+    return RETRIEVERS.get(repo_dir.name, repo_dir)
@@ -0,0 +1,48 @@
+"""
+Versioned per-repo storage. Each ingest writes a fresh data/<repo_id>/v-<stamp>/ directory
+and then atomically repoints data/<repo_id>/CURRENT at it, so readers never see a half-written
+index. Repos ingested before versioning (files directly in data/<repo_id>/) still resolve.
+"""
+import os, time, shutil, uuid
+from pathlib import Path
+
+POINTER = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("KEEP_VERSIONS", "2"))   # current + previous
+LEGACY_ARTIFACTS = ("corpus.jsonl", "chunks", "tokenized.json", "bm25", "files.json", "sample_paths.json",
+                    "repo_map.json", "state.json")
+
+def active_dir(repo_dir: Path) -> Path:
+    repo_dir = Path(repo_dir)
+    try:
+        name = (repo_dir / POINTER).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return repo_dir   # legacy, unversioned layout
+    return repo_dir / name
+
+def new_version_dir(repo_dir: Path) -> Path:
+    vdir = Path(repo_dir) / f"v-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    vdir.mkdir(parents=True)
+    return vdir
+
+def publish(repo_dir: Path, vdir: Path) -> None:
+    """Atomically make `vdir` the active version, then drop old versions."""
+    repo_dir = Path(repo_dir)
+    tmp = repo_dir / f"{POINTER}.{uuid.uuid4().hex}.tmp"
+    tmp.write_text(vdir.name, encoding="utf-8")
+    os.replace(tmp, repo_dir / POINTER)
+    _gc(repo_dir, vdir)
+
+def discard(vdir: Path) -> None:
+    shutil.rmtree(vdir, ignore_errors=True)
+
+def _gc(repo_dir: Path, current: Path) -> None:
+    # open mmaps of removed versions stay valid on POSIX; readers just reload on next lookup
+    versions = sorted((p for p in repo_dir.glob("v-*") if p.is_dir() and p != current), reverse=True)
+    for old in versions[max(KEEP_VERSIONS - 1, 0):]:
+        shutil.rmtree(old, ignore_errors=True)
+    for name in LEGACY_ARTIFACTS:
+        p = repo_dir / name
+        if p.is_dir():
+            shutil.rmtree(p, ignore_errors=True)
+        else:
+            p.unlink(missing_ok=True)
@@ -0,0 +1,165 @@
+"""
+In-process metrics and per-request tracing with no external dependencies.
+
+    with span("ingest.clone"):          # histogram repo_ops_span_seconds{span="ingest.clone"}
+        ...
+    inc("llm_calls_total", cached="false")
+    with trace() as timings:            # spans inside (same thread/context) add up here
+        ...
+    render()                            # Prometheus text exposition for GET /metrics
+
+TELEMETRY=0 turns every call into a no-op (span() returns a shared null context).
+"""
+import os, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+TELEMETRY = os.getenv("TELEMETRY", "1") == "1"
+PREFIX = "repo_ops_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# name -> (type, help); everything recorded must be declared here
+METRICS: Dict[str, Tuple[str, str]] = {
+    "span_seconds":               ("histogram", "Duration of traced stages (ingest, retrieval, LLM)"),
+    "http_request_seconds":       ("histogram", "API request latency until the response starts"),
+    "http_requests_total":        ("counter",   "API requests by route and status"),
+    "llm_calls_total":            ("counter",   "LLM completions, including cache hits"),
+    "llm_retries_total":          ("counter",   "LLM HTTP retries"),
+    "llm_errors_total":           ("counter",   "LLM calls that failed after retries"),
+    "llm_tokens_total":           ("counter",   "LLM tokens reported by the provider"),
+    "llm_latency_seconds":        ("histogram", "LLM call latency including retries"),
+    "llm_ttft_seconds":           ("histogram", "Time to first streamed token"),
+    "ingest_jobs_total":          ("counter",   "Finished ingest jobs by status"),
+    "ingest_files_total":         ("counter",   "Files seen by ingest (listed, changed)"),
+    "ingest_chunks_total":        ("counter",   "Chunks written by ingest"),
+    "retrieval_queries_total":    ("counter",   "Retriever.topk calls"),
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}   # bucket counts…, sum, count
+_gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+_TRACE: ContextVar[Optional[Dict[str, float]]] = ContextVar("repo_ops_trace", default=None)
+_NOOP = nullcontext()
+
+def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1.0, **labels: object) -> None:
+    if not TELEMETRY:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + value
+
+def observe(name: str, seconds: float, **labels: object) -> None:
+    if not TELEMETRY:
+        return
+    k = _key(name, labels)
+    i = bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        if i < len(LATENCY_BUCKETS):
+            h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> None:
+    """Register a value read at scrape time (e.g. queue depth)."""
+    _gauges[name] = (help, fn)
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        observe("span_seconds", dt, span=self.name)
+        timings = _TRACE.get()
+        if timings is not None:
+            with _lock:
+                timings[self.name] = round(timings.get(self.name, 0.0) + dt, 4)
+        return False
+
+def span(name: str):
+    """Time a block; recorded in the span histogram and in the current trace()."""
+    return _Span(name) if TELEMETRY else _NOOP
+
+class StageSpans:
+    """Consecutive stages as spans: enter("read") ends "<prefix>.clone" and starts "<prefix>.read"."""
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._cur: Optional[_Span] = None
+
+    def enter(self, stage: str) -> None:
+        name = f"{self.prefix}.{stage}"
+        if not TELEMETRY or (self._cur is not None and self._cur.name == name):
+            return
+        self.close()
+        self._cur = _Span(name).__enter__()
+
+    def close(self) -> None:
+        if self._cur is not None:
+            self._cur.__exit__(None, None, None)
+            self._cur = None
+
+@contextmanager
+def trace() -> Iterator[Dict[str, float]]:
+    """Collect {span name: seconds} for spans entered in this context (a `timings` block)."""
+    timings: Dict[str, float] = {}
+    token = _TRACE.set(timings)
+    try:
+        yield timings
+    finally:
+        _TRACE.reset(token)
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: Tuple[Tuple[str, str], ...], le: Optional[str] = None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+    lines: List[str] = []
+    for name, (kind, help) in METRICS.items():
+        series = [(k, v) for k, v in (counters if kind == "counter" else histograms).items() if k[0] == name]
+        if not series:
+            continue
+        full = PREFIX + name
+        lines += [f"# HELP {full} {help}", f"# TYPE {full} {kind}"]
+        for (_, labels), v in sorted(series):
+            if kind == "counter":
+                lines.append(f"{full}{_labels(labels)} {v:g}")
+                continue
+            cum = 0.0
+            for le, n in zip(LATENCY_BUCKETS, v):
+                cum += n
+                lines.append(f"{full}_bucket{_labels(labels, f'{le:g}')} {cum:g}")
+            lines.append(f"{full}_bucket{_labels(labels, '+Inf')} {v[-1]:g}")
+            lines.append(f"{full}_sum{_labels(labels)} {v[-2]:.6f}")
+            lines.append(f"{full}_count{_labels(labels)} {v[-1]:g}")
+    for name, (help, fn) in sorted(_gauges.items()):
+        try:
+            value = float(fn())
+        except Exception:
+            continue   # a broken probe must not break the scrape
+        full = PREFIX + name
+        lines += [f"# HELP {full} {help}", f"# TYPE {full} gauge", f"{full} {value:g}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+"""
+Single-pass repository walk for ingest. One os.scandir traversal:
+  - prunes VCS/vendor/build directories (WALK_SKIP_DIRS) and anything .gitignore'd
+    (root and nested .gitignore files; negation, anchoring, dir-only and ** patterns),
+  - keeps files whose name matches the indexed extensions/names, minus binaries,
+  - drops files over MAX_FILE_BYTES from the directory entry's stat, before anything is read,
+  - records the path-based detect_modes signals of every file it sees.
+Symlinks are not followed. Reading happens later, in the ingest worker processes.
+"""
+import os, re
+from collections import Counter
+from pathlib import Path
+from typing import List, Sequence, Tuple
+from .detectors import Signals, path_signals
+
+SKIP_DIRS = frozenset(filter(None, (os.getenv("WALK_SKIP_DIRS") or
+    ".git,.hg,.svn,node_modules,bower_components,__pycache__,.venv,venv,.tox,.nox,.mypy_cache,"
+    ".pytest_cache,.ruff_cache,site-packages,.idea,.next,.gradle,vendor,dist,build,target").split(",")))
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", "200000"))   # larger files are not indexed
+INDEX_EXTS = frozenset(("py ipynb md txt js ts tsx jsx go rs java scala kt c cpp h hpp "
+                        "yaml yml toml ini").split())
+INDEX_NAMES = frozenset(("Dockerfile", "Makefile", "requirements.txt", "pyproject.toml", "package.json"))
+INDEX_PREFIXES = ("README", "LICENSE")
+BINARY_PAT = re.compile(r"\.(png|jpg|jpeg|gif|pdf|mp4|zip|tar|gz|tgz|7z|exe|dylib|so|bin)$", re.I)
+
+Rule = Tuple["re.Pattern[str]", bool, bool]          # (pattern, negated, directories only)
+RuleSet = Tuple[Tuple[str, Tuple[Rule, ...]], ...]   # (dir prefix, rules) from the root down
+
+def _glob_re(pat: str) -> str:
+    out, i = [], 0
+    while i < len(pat):
+        if pat.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pat.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pat[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pat[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pat[i] == "[" and "]" in pat[i + 2:]:
+            j = pat.index("]", i + 2)
+            body = pat[i + 1:j].replace("\\", "\\\\")
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+            i = j + 1
+        elif pat[i] == "\\" and i + 1 < len(pat):
+            out.append(re.escape(pat[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pat[i]))
+            i += 1
+    return "".join(out)
+
+def parse_gitignore(text: str) -> Tuple[Rule, ...]:
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated or line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        # a slash anywhere but the end anchors the pattern to the .gitignore's directory
+        prefix = "" if "/" in line else "(?:.*/)?"
+        rules.append((re.compile(prefix + _glob_re(line.lstrip("/"))), negated, dir_only))
+    return tuple(rules)
+
+def _ignored(rules: RuleSet, rel: str, is_dir: bool) -> bool:
+    ignored = False
+    for base, ruleset in rules:    # deeper .gitignore files and later lines win
+        sub = rel[len(base):]
+        for pat, negated, dir_only in ruleset:
+            if (is_dir or not dir_only) and pat.fullmatch(sub):
+                ignored = not negated
+    return ignored
+
+def indexable(name: str) -> bool:
+    ext = name.rsplit(".", 1)[-1] if "." in name else ""
+    return ((ext in INDEX_EXTS or name in INDEX_NAMES or name.startswith(INDEX_PREFIXES))
+            and not BINARY_PAT.search(name))
+
+def exportable(rel: str) -> bool:
+    """Repo paths a checkout needs for walk_repo: indexable files, .gitignore and Docker files, outside pruned dirs."""
+    *dirs, name = rel.split("/")
+    return ((indexable(name) or name == ".gitignore" or "docker" in path_signals(rel))
+            and not any(d in SKIP_DIRS for d in dirs))
+
+class WalkResult:
+    def __init__(self):
+        self.files: List[Tuple[Path, str, int]] = []   # (path, repo-relative posix path, bytes), walk order
+        self.signals = Signals()
+        self.skipped: Counter = Counter()              # dirs pruned, ignored files, too large
+
+def walk_repo(root: Path, max_bytes: int = MAX_FILE_BYTES, skip_dirs: Sequence[str] = SKIP_DIRS) -> WalkResult:
+    res = WalkResult()
+    skip = frozenset(skip_dirs)
+    stack: List[Tuple[str, str, RuleSet]] = [(str(root), "", ())]
+    while stack:
+        path, prefix, rules = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        for e in entries:
+            if e.name == ".gitignore" and e.is_file(follow_symlinks=False):
+                try:
+                    with open(e.path, encoding="utf-8", errors="ignore") as fh:
+                        rules = rules + ((prefix, parse_gitignore(fh.read())),)
+                except OSError:
+                    pass
+                break
+        subdirs = []
+        for e in entries:
+            rel = prefix + e.name
+            if e.is_dir(follow_symlinks=False):
+                if e.name in skip or _ignored(rules, rel, True):
+                    res.skipped["dirs"] += 1
+                else:
+                    subdirs.append((e.path, rel + "/", rules))
+                continue
+            if not e.is_file(follow_symlinks=False):
+                continue
+            if _ignored(rules, rel, False):
+                res.skipped["ignored"] += 1
+                continue
+            res.signals.add(path_signals(rel), rel)
+            if not indexable(e.name):
+                continue
+            size = e.stat(follow_symlinks=False).st_size
+            if size > max_bytes:
+                res.skipped["too_large"] += 1
+                continue
+            res.files.append((Path(e.path), rel, size))
+        stack.extend(reversed(subdirs))   # depth-first, alphabetical
+    return res
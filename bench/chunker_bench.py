@@ -0,0 +1,69 @@
+"""
+Ingest read/chunk/tokenize throughput: the boundary-aware batched chunker vs the previous
+fixed 450-token slicer (encode → decode every slice, one file per task).
+
+    python -m bench.chunker_bench [repo_dir] [--workers N] [--repeat R]
+
+Prints JSON with files/sec, MB/sec and chunk counts for both, serial and over the process pool.
+No clone, no LLM calls, no index writes.
+"""
+import os, sys, json, time, argparse
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault("AIML_API_KEY", "bench")   # repo_indexer imports the LLM client; nothing is called
+
+from backend.chunker import ENC
+from backend.repo_indexer import (_list_files, _read_file, _process_batch, _batches, _stream_map,
+                                  INGEST_WORKERS, INGEST_MEMORY_MB, FILE_WORKSET_BYTES)
+
+def legacy_chunk(text: str, max_tokens=450) -> List[str]:
+    toks = ENC.encode(text, disallowed_special=())
+    return [ENC.decode(toks[i:i+max_tokens]) for i in range(0, len(toks), max_tokens)]
+
+def legacy_process_file(item: tuple) -> Optional[Dict[str, Any]]:
+    path, rel = item
+    doc = _read_file(Path(path), rel)
+    if doc is None:
+        return None
+    chunks = legacy_chunk(doc["text"])
+    tfs, lens = [], []
+    for ch in chunks:
+        toks = ch.lower().split()
+        tfs.append(Counter(toks))
+        lens.append(len(toks))
+    return {"path": rel, "size": doc["size"], "chunks": chunks, "tfs": tfs, "lens": lens}
+
+def _run(name: str, files: List[tuple], sizes: Dict[str, int], workers: int, repeat: int) -> Dict[str, Any]:
+    window = max(1, ((INGEST_MEMORY_MB << 20) // 2) // FILE_WORKSET_BYTES)
+    best, n_chunks = float("inf"), 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        if name == "legacy":
+            results = list(_stream_map(legacy_process_file, ((str(p), rel) for p, rel in files), workers, window))
+        else:
+            results = [r for batch in _stream_map(_process_batch, _batches(files, sizes), workers, window) for r in batch]
+        best = min(best, time.perf_counter() - t0)
+        n_chunks = sum(len(r["chunks"]) for r in results if r)
+    mb = sum(sizes.values()) / 1e6
+    return {"chunker": name, "workers": workers, "seconds": round(best, 4),
+            "files_per_s": round(len(files) / best, 1), "mb_per_s": round(mb / best, 2), "chunks": n_chunks}
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("repo_dir", nargs="?", default=".")
+    ap.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    files = list(_list_files(Path(args.repo_dir)))
+    sizes = {rel: p.stat().st_size for p, rel in files}
+    runs = [_run(name, files, sizes, w, args.repeat)
+            for w in sorted({1, args.workers}) for name in ("legacy", "batched")]
+    json.dump({"repo_dir": str(Path(args.repo_dir).resolve()), "files": len(files),
+               "bytes": sum(sizes.values()), "runs": runs}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Local stand-in for the AIML chat-completions endpoint, for offline benchmarks.
+
+    python -m bench.mock_llm [--port 8765] [--latency 0.2] [--jitter 0.05] [--error-rate 0.01]
+
+Then point the backend at it with AIML_API_BASE=http://127.0.0.1:8765/v1 (any AIML_API_KEY).
+Supports plain and streamed (SSE) completions, injected latency, 5xx/429 errors at a given
+rate, and answers tag prompts with valid JSON so ingest exercises the same code paths as
+against the real API.
+"""
+import json, random, threading, time, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+ANSWER = ("The entry point is [app/main.py:1-40]; run it with `python -m app.main`. "
+          "Tests live under tests/ and run with `pytest -q`. ").split(" ")
+
+class MockLLM:
+    def __init__(self, port: int = 0, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, token_delay: float = 0.005, seed: int = 0):
+        self.latency, self.jitter, self.token_delay = latency, jitter, token_delay
+        self.error_rate, self.rate_limit_rate = error_rate, rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = self.errors = self.rate_limited = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self) -> "MockLLM":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="mock-llm")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+    def _draw(self) -> tuple[str, float]:
+        # one locked draw per request keeps runs reproducible for a given seed and request order
+        with self._lock:
+            self.requests += 1
+            r = self._rng.random()
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            if r < self.error_rate:
+                self.errors += 1
+                return "error", delay
+            if r < self.error_rate + self.rate_limit_rate:
+                self.rate_limited += 1
+                return "rate_limited", delay
+            return "ok", delay
+
+    def _reply(self, body: Dict[str, Any]) -> str:
+        system = body["messages"][0]["content"] if body.get("messages") else ""
+        if "JSON" in system:
+            user = body["messages"][-1]["content"]
+            path = user.split("\n", 1)[0].removeprefix("Path: ").strip()
+            return json.dumps({"path": path, "brief_summary": f"Synthetic module {path}.",
+                               "tags": ["api", "tests"], "language": path.rsplit(".", 1)[-1]})
+        return " ".join(ANSWER)
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: bytes, headers: Dict[str, str] = {}):
+                self.send_response(status)
+                for k, v in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                outcome, delay = mock._draw()
+                time.sleep(delay)
+                if outcome == "error":
+                    return self._send(503, b'{"error":"mock upstream error"}', {"Retry-After": "0.1"})
+                if outcome == "rate_limited":
+                    return self._send(429, b'{"error":"mock rate limit"}', {"Retry-After": "0.2"})
+                text = mock._reply(body)
+                usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 for m in body.get("messages", [])),
+                         "completion_tokens": len(text) // 4}
+                if not body.get("stream"):
+                    payload = {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage}
+                    return self._send(200, json.dumps(payload).encode())
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for piece in text.split(" "):
+                    delta = {"choices": [{"delta": {"content": piece + " "}}]}
+                    self._chunk(f"data: {json.dumps(delta)}\n\n".encode())
+                    time.sleep(mock.token_delay)
+                self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+        return Handler
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.05, help="seconds before the first byte")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 responses")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of 429 responses")
+    ap.add_argument("--token-delay", type=float, default=0.005, help="seconds between streamed tokens")
+    args = ap.parse_args(argv)
+    mock = MockLLM(args.port, args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.token_delay).start()
+    print(f"mock LLM at {mock.base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+if __name__ == "__main__":
+    main()
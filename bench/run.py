@@ -0,0 +1,246 @@
+"""
+End-to-end benchmark: synthetic repo → ingest (full + incremental) → index load → top-k
+queries → /ask and /ask/stream, all offline against a local mock of the chat endpoint. The API
+is served by uvicorn on a local port and called over HTTP, so streamed responses arrive as sent.
+
+    python -m bench.run [--files 200] [--languages py,js,go,md] [--file-kb 4] [--queries 200]
+                        [--api-queries 40] [--concurrency 4] [--latency 0.05] [--error-rate 0]
+                        [--out result.json] [--baseline base.json] [--tolerance 0.25]
+
+Prints JSON: ingest throughput and per-stage timings, index load time, p50/p95/p99 latency of
+Retriever.topk and the API endpoints, time to first token as seen by the client and as reported
+by the server (llm.ttft_s), symbol recall@k, peak RSS and on-disk index size.
+With --baseline, exits 1 if any gated metric regressed by more than --tolerance.
+The tiktoken cl100k_base file must already be cached (TIKTOKEN_CACHE_DIR) to run offline.
+"""
+import os, re, sys, json, time, random, socket, resource, tempfile, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import numpy as np
+import requests
+
+from bench.mock_llm import MockLLM
+from bench.synth import make_repo, mutate_repo
+
+# (metric path, higher_is_better) compared against --baseline
+GATED = [("ingest.full.seconds", False), ("ingest.incremental.seconds", False), ("load.median_s", False),
+         ("topk.p95_ms", False), ("topk.recall", True), ("api.ask.p95_ms", False),
+         ("api.ask_stream.ttft_p95_ms", False), ("peak_rss_mb", False), ("index_bytes", False)]
+
+def _pct(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": len(ms), "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3), "mean_ms": round(float(ms.mean()), 3)}
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux; children covers the ingest worker processes
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 / (1 << 20) if sys.platform == "darwin" else 1 / 1024
+    return round(max(own, kids) * scale, 1)
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+class _Http(requests.Session):
+    """Session with a base URL, so calls read like the TestClient ones: client.post("/ask", ...)."""
+    def __init__(self, base: str, pool: int):
+        super().__init__()
+        self.base = base
+        self.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=pool))
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, self.base + url, *args, **kwargs)
+
+@contextmanager
+def _serve(app) -> Iterator[str]:
+    """Run the app under uvicorn in a background thread; yields its base URL."""
+    import uvicorn
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True, name="bench-api")
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("API server failed to start")
+            time.sleep(0.01)
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+def _ingest(client, repo_url: str, full: bool, poll: float = 0.05) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    r = client.post("/ingest", json={"repo_url": repo_url, "full": full})
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(poll)
+    seconds = time.perf_counter() - t0
+    if job["status"] == "failed":
+        raise RuntimeError(f"ingest failed: {job['error']}")
+    return {"seconds": round(seconds, 3), "timings": job["timings"], "result": job["result"]}
+
+def _queries(manifest: Dict[str, Any], n: int, seed: int) -> List[Dict[str, str]]:
+    """Half exact identifiers, half natural-language phrasings of their subwords."""
+    rng = random.Random(seed)
+    picks = rng.sample(manifest["symbols"], min(n, len(manifest["symbols"])))
+    out = []
+    for i, s in enumerate(picks):
+        if i % 2:
+            words = " ".join(w for w in re.split(r"_|(?<=[a-z])(?=[A-Z])|(?<=\D)(?=\d)", s["name"]) if w)
+            out.append({"query": f"where is {words.lower()} implemented", "path": s["path"]})
+        else:
+            out.append({"query": s["name"], "path": s["path"]})
+    return out
+
+def _timed(fn: Callable[[], Any]) -> tuple[float, Any]:
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+def _ask_stream(client, repo_id: str, query: str) -> Dict[str, Any]:
+    t0, ttft, server_ttft, ok, event = time.perf_counter(), None, None, False, None
+    with client.post("/ask/stream", json={"repo_id": repo_id, "query": query}, stream=True) as r:
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - t0
+            elif line.startswith("data: ") and event == "done":
+                done = json.loads(line[6:])
+                ok, server_ttft = bool(done.get("ok")), (done.get("llm") or {}).get("ttft_s")
+    return {"total": time.perf_counter() - t0, "ttft": ttft, "server_ttft": server_ttft, "ok": ok}
+
+def _get(d: Dict[str, Any], path: str) -> Optional[float]:
+    for key in path.split("."):
+        if not isinstance(d, dict) or key not in d:
+            return None
+        d = d[key]
+    return d
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Gated metrics that are worse than the baseline by more than `tolerance` (relative)."""
+    regressions = []
+    for path, higher_better in GATED:
+        cur, base = _get(result, path), _get(baseline, path)
+        if cur is None or base is None or base == 0:
+            continue
+        change = (cur - base) / abs(base)
+        if (-change if higher_better else change) > tolerance:
+            regressions.append({"metric": path, "baseline": base, "current": cur, "change": round(change, 3)})
+    return regressions
+
+def run(args) -> Dict[str, Any]:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="repo-ops-bench-"))
+    mock = MockLLM(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                   rate_limit_rate=args.rate_limit_rate, token_delay=args.token_delay, seed=args.seed).start()
+    # the backend reads its configuration at import time
+    os.environ.update({"AIML_API_BASE": mock.base_url, "AIML_API_KEY": "bench",
+                       "INDEX_ROOT": str(workdir / "data"),
+                       "PRECOMPUTE_BLUEPRINTS": "1" if args.blueprints else "0"})
+    from backend.api import app
+    from backend.retriever import Retriever
+    from backend.storage import active_dir
+
+    t_gen, manifest = _timed(lambda: make_repo(workdir / "src" / "synthetic", args.files,
+                                               args.languages.split(","), args.file_kb, args.seed))
+    repo_url, repo_id = f"file://{manifest['path']}", "synthetic"
+    repo_dir = workdir / "data" / repo_id
+    out: Dict[str, Any] = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "repo": {"files": manifest["files"], "bytes": manifest["bytes"], "symbols": len(manifest["symbols"]),
+                 "generate_s": round(t_gen, 3)},
+    }
+    with _serve(app) as base, _Http(base, pool=max(10, args.concurrency)) as client:
+        full = _ingest(client, repo_url, full=True)
+        mb = manifest["bytes"] / 1e6
+        full.update(files_per_s=round(manifest["files"] / full["seconds"], 1), mb_per_s=round(mb / full["seconds"], 3))
+        n_chunks = full.pop("result")["n_chunks"]
+        mutate_repo(Path(manifest["path"]), manifest, args.mutate, seed=args.seed + 1)
+        inc = _ingest(client, repo_url, full=False)
+        inc["changed"] = inc.pop("result").get("changed")
+        out["ingest"] = {"full": full, "incremental": inc, "chunks": n_chunks}
+        out["index_bytes"] = _dir_bytes(active_dir(repo_dir))
+
+        loads = [_timed(lambda: Retriever(repo_dir))[0] for _ in range(args.load_repeat)]
+        out["load"] = {"median_s": round(float(np.median(loads)), 4), "min_s": round(min(loads), 4)}
+
+        retriever = Retriever(repo_dir)
+        queries = _queries(manifest, args.queries, args.seed)
+        lat, hits = [], 0
+        for q in queries:
+            dt, res = _timed(lambda: retriever.topk(q["query"], args.k))
+            lat.append(dt)
+            hits += any(h["meta"]["path"] == q["path"] for h in res)
+        out["topk"] = {**_pct(lat), "k": args.k, "recall": round(hits / max(1, len(queries)), 4)}
+
+        api_qs = [q["query"] for q in queries[:args.api_queries]]
+        def ask(q):
+            dt, r = _timed(lambda: client.post("/ask", json={"repo_id": repo_id, "query": q}))
+            return dt, r.status_code
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            asks = list(pool.map(ask, api_qs))
+            streams = list(pool.map(lambda q: _ask_stream(client, repo_id, q + " (stream)"), api_qs))
+        out["api"] = {
+            "concurrency": args.concurrency,
+            "ask": {**_pct([dt for dt, code in asks if code == 200]), "errors": sum(code != 200 for _, code in asks)},
+            "ask_stream": {**_pct([s["total"] for s in streams if s["ok"]]),
+                           "ttft_p95_ms": _pct([s["ttft"] for s in streams if s["ttft"] is not None]).get("p95_ms"),
+                           "server_ttft_p95_ms": _pct([s["server_ttft"] for s in streams
+                                                       if s["server_ttft"] is not None]).get("p95_ms"),
+                           "errors": sum(not s["ok"] for s in streams)},
+        }
+        out["cache"] = client.get("/cache/stats").json()
+    out["mock_llm"] = mock.stats()
+    out["peak_rss_mb"] = _peak_rss_mb()
+    mock.stop()
+    return out
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--files", type=int, default=200)
+    ap.add_argument("--languages", default="py,js,go,md")
+    ap.add_argument("--file-kb", type=float, default=4.0)
+    ap.add_argument("--mutate", type=float, default=0.05, help="fraction of files changed before the incremental ingest")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--api-queries", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--load-repeat", type=int, default=5)
+    ap.add_argument("--latency", type=float, default=0.05, help="mock LLM seconds before the first byte")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--token-delay", type=float, default=0.002)
+    ap.add_argument("--blueprints", action="store_true", help="precompute blueprints as part of ingest")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", help="keep repos and indexes here (default: a temp dir)")
+    ap.add_argument("--out", help="also write the JSON result to this file")
+    ap.add_argument("--baseline", help="previous result JSON to gate against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = ap.parse_args(argv)
+
+    result = run(args)
+    if args.baseline:
+        result["regressions"] = compare(result, json.loads(Path(args.baseline).read_text()), args.tolerance)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    if result.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Synthetic repository generator for benchmarks: a local git repo of configurable size, mix of
+languages and file sizes, with unique function/class names whose locations are returned so
+query workloads can measure retrieval recall as well as latency.
+
+    python -m bench.synth DEST [--files 200] [--languages py,js,go,md] [--file-kb 4] [--seed 0]
+
+Prints the manifest (files, bytes, symbol → path) as JSON. Ingest it with repo_url=file://DEST.
+"""
+import json, random, shutil, subprocess, sys, argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+WORDS = ("load save parse train model data batch loader config server client request response cache index "
+         "token chunk user repo file path stream queue worker job retry score query vector embed build run "
+         "test deploy docker handler route auth session metric log event schema record table buffer").split()
+COMMENTS = ("Handles the {a} step before the {b} is flushed.", "Returns the {a} for the given {b}.",
+            "Retries the {a} when the {b} is busy.", "Keeps the {a} and {b} in sync.")
+
+def _name(rng: random.Random, style: str, n: int) -> str:
+    parts = rng.sample(WORDS, rng.randint(2, 3))
+    if style == "snake":
+        return "_".join(parts) + f"_{n}"
+    if style == "camel":
+        return parts[0] + "".join(p.title() for p in parts[1:]) + str(n)
+    return "".join(p.title() for p in parts) + str(n)
+
+def _comment(rng: random.Random) -> str:
+    a, b = rng.sample(WORDS, 2)
+    return rng.choice(COMMENTS).format(a=a, b=b)
+
+def _body(rng: random.Random, indent: str, stmt: Callable[[str, str], str], lines: int) -> str:
+    return "".join(indent + stmt(rng.choice(WORDS), rng.choice(WORDS)) + "\n" for _ in range(lines))
+
+# ext -> (identifier style, emit(rng, name, body_lines) -> source of one definition)
+LANGS: Dict[str, tuple] = {
+    "py": ("snake", lambda rng, name, n: f"def {name}(self, {rng.choice(WORDS)}):\n    \"\"\"{_comment(rng)}\"\"\"\n"
+           + _body(rng, "    ", lambda a, b: f"{a} = self.{b}({a!r})", n) + "    return None\n\n"),
+    "js": ("camel", lambda rng, name, n: f"// {_comment(rng)}\nexport function {name}({rng.choice(WORDS)}) {{\n"
+           + _body(rng, "  ", lambda a, b: f"const {a} = {b}.get('{a}');", n) + "}\n\n"),
+    "ts": ("camel", lambda rng, name, n: f"/** {_comment(rng)} */\nexport async function {name}({rng.choice(WORDS)}: string): Promise<void> {{\n"
+           + _body(rng, "  ", lambda a, b: f"await {b}.{a}();", n) + "}\n\n"),
+    "go": ("pascal", lambda rng, name, n: f"// {name} {_comment(rng).lower()}\nfunc {name}({rng.choice(WORDS)} string) error {{\n"
+           + _body(rng, "\t", lambda a, b: f"{a} := {b}.Get(\"{a}\")", n) + "\treturn nil\n}\n\n"),
+    "rs": ("snake", lambda rng, name, n: f"/// {_comment(rng)}\npub fn {name}({rng.choice(WORDS)}: &str) -> Result<(), Error> {{\n"
+           + _body(rng, "    ", lambda a, b: f"let {a} = {b}.get(\"{a}\")?;", n) + "    Ok(())\n}\n\n"),
+    "java": ("pascal", lambda rng, name, n: f"/** {_comment(rng)} */\npublic class {name} {{\n"
+             + _body(rng, "    ", lambda a, b: f"private String {a} = \"{b}\";", n) + "}\n\n"),
+    "md": ("pascal", lambda rng, name, n: f"## {name}\n\n"
+           + "".join(_comment(rng) + " " for _ in range(n)) + "\n\n"),
+}
+HEADER = {"py": "import os\n\n", "go": "package main\n\n", "rs": "use std::error::Error;\n\n", "java": "package bench;\n\n"}
+
+def _git(repo: Path, *args: str) -> None:
+    subprocess.check_call(["git", "-c", "user.email=bench@localhost", "-c", "user.name=bench", *args],
+                          cwd=repo, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _write_file(rng: random.Random, path: Path, ext: str, target: int, counter: List[int],
+                symbols: List[Dict[str, str]], rel: str) -> int:
+    style, emit = LANGS[ext]
+    parts, size = [HEADER.get(ext, "")], 0
+    while size < target:
+        counter[0] += 1
+        name = _name(rng, style, counter[0])
+        src = emit(rng, name, rng.randint(3, 12))
+        parts.append(src)
+        size += len(src)
+        symbols.append({"name": name, "path": rel})
+    text = "".join(parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return len(text.encode("utf-8"))
+
+def make_repo(dest: Path, files: int = 200, languages: Sequence[str] = ("py", "js", "go", "md"),
+              file_kb: float = 4.0, seed: int = 0) -> Dict[str, Any]:
+    """Create a fresh git repo at dest. File sizes are log-normal around file_kb."""
+    unknown = set(languages) - set(LANGS)
+    if unknown:
+        raise ValueError(f"Unsupported languages {sorted(unknown)}; choose from {sorted(LANGS)}")
+    dest = Path(dest)
+    shutil.rmtree(dest, ignore_errors=True)
+    dest.mkdir(parents=True)
+    rng = random.Random(seed)
+    symbols: List[Dict[str, str]] = []
+    counter, total = [0], 0
+    for i in range(files):
+        ext = languages[i % len(languages)]
+        rel = f"docs/{rng.choice(WORDS)}_{i}.md" if ext == "md" else f"src/pkg{i % 10}/{rng.choice(WORDS)}_{i}.{ext}"
+        target = int(rng.lognormvariate(0, 0.6) * file_kb * 1024)
+        total += _write_file(rng, dest / rel, ext, max(256, target), counter, symbols, rel)
+    (dest / "README.md").write_text("# Synthetic benchmark repo\n\nRun with `python -m app`.\n", encoding="utf-8")
+    (dest / "requirements.txt").write_text("fastapi\npytest\n", encoding="utf-8")
+    (dest / "Dockerfile").write_text("FROM python:3.11-slim\nCOPY . /app\nCMD [\"python\", \"-m\", \"app\"]\n", encoding="utf-8")
+    _git(dest, "init", "-q")
+    _git(dest, "add", "-A")
+    _git(dest, "commit", "-qm", "synthetic repo")
+    return {"path": str(dest), "files": files, "bytes": total, "languages": list(languages), "symbols": symbols}
+
+def mutate_repo(dest: Path, manifest: Dict[str, Any], fraction: float = 0.05, seed: int = 1) -> Dict[str, int]:
+    """Append a definition to `fraction` of the files and commit (for incremental re-ingest)."""
+    rng = random.Random(seed)
+    paths = sorted({s["path"] for s in manifest["symbols"]})
+    chosen = rng.sample(paths, max(1, int(len(paths) * fraction)))
+    counter = [len(manifest["symbols"]) + 1_000_000]
+    for rel in chosen:
+        ext = rel.rsplit(".", 1)[-1]
+        style, emit = LANGS[ext]
+        counter[0] += 1
+        name = _name(rng, style, counter[0])
+        with (Path(dest) / rel).open("a", encoding="utf-8") as fh:
+            fh.write(emit(rng, name, 5))
+        manifest["symbols"].append({"name": name, "path": rel})
+    _git(Path(dest), "add", "-A")
+    _git(Path(dest), "commit", "-qm", "mutate")
+    return {"modified": len(chosen)}
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("dest")
+    ap.add_argument("--files", type=int, default=200)
+    ap.add_argument("--languages", default="py,js,go,md")
+    ap.add_argument("--file-kb", type=float, default=4.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    manifest = make_repo(Path(args.dest), args.files, args.languages.split(","), args.file_kb, args.seed)
+    json.dump(manifest, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
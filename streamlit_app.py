@@ -1,4 +1,6 @@
 import os
+import json
+import time
 import requests
 import streamlit as st
 
@@ -12,13 +14,72 @@ API_BASE = st.secrets.get("API_URL", os.getenv("API_URL", "http://localhost:8000
 def api_post(path: str, payload: dict):
     url = f"{API_BASE}{path}"
     try:
-        r = requests.post(url, json=payload, timeout=(5, 900))
+        r = requests.post(url, json=payload, timeout=(5, 300))
         if r.ok:
             return r.json(), None
         return None, f"{r.status_code}: {r.text}"
     except Exception as e:
         return None, str(e)
 
+def api_stream(path: str, payload: dict, as_code: bool = False):
+    """POST to a Server-Sent Events endpoint and render tokens as they arrive. Returns (text, llm_stats, err)."""
+    url = f"{API_BASE}{path}"
+    box = st.empty()
+    text, event = "", "message"
+    try:
+        with requests.post(url, json=payload, stream=True, timeout=(5, 300)) as r:
+            if not r.ok:
+                return None, None, f"{r.status_code}: {r.text}"
+            for line in r.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:])
+                    if event == "token":
+                        text += data["text"]
+                        box.code(text, language="markdown") if as_code else box.markdown(text + "▌")
+                    elif event == "done":
+                        box.code(text, language="markdown") if as_code else box.markdown(text)
+                        return text, data.get("llm", {}), None
+                    elif event == "error":
+                        return text, None, data.get("error", "stream failed")
+        return text, None, "stream ended early"
+    except Exception as e:
+        return text, None, str(e)
+
+def show_latency(llm: dict):
+    if llm:
+        ttft = llm.get("ttft_s")
+        st.caption((f"first token {ttft:.2f}s · " if ttft is not None else "") + f"total {llm.get('latency_s', 0):.2f}s"
+                   + (" · cached" if llm.get("cached") else ""))
+
+def api_get(path: str):
+    url = f"{API_BASE}{path}"
+    try:
+        r = requests.get(url, timeout=(5, 30))
+        if r.ok:
+            return r.json(), None
+        return None, f"{r.status_code}: {r.text}"
+    except Exception as e:
+        return None, str(e)
+
+def wait_for_job(job_id: str, poll_s: float = 1.0):
+    # Poll /jobs/{id} until the ingest finishes, showing stage + counters as it goes
+    status = st.empty()
+    while True:
+        job, err = api_get(f"/jobs/{job_id}")
+        if err:
+            return None, err
+        if job["status"] == "succeeded":
+            status.empty()
+            return job["result"], None
+        if job["status"] == "failed":
+            status.empty()
+            return None, job.get("error") or "Ingest failed"
+        counters = ", ".join(f"{k}: {v}" for k, v in job.get("progress", {}).items())
+        status.info(f"⏳ {job['status']} — stage: {job['stage']}" + (f" ({counters})" if counters else ""))
+        time.sleep(poll_s)
+
 def show_modes(modes: dict):
     # Pretty chips; gray for False
     cols = st.columns(5)
@@ -38,16 +99,15 @@ def show_modes(modes: dict):
                 unsafe_allow_html=True,
             )
 
-def blueprint_block(tab, mode_key: str, label: str, repo_id: str, enabled: bool):
+def blueprint_block(tab, mode_key: str, label: str, repo_id: str, enabled: bool, refresh: bool = False):
     with tab:
         st.caption(f"{label} plan generated from the repo context.")
         if st.button(f"Generate {label}", key=f"btn_{mode_key}", disabled=not enabled, use_container_width=True):
-            with st.spinner("Generating…"):
-                data, err = api_post("/blueprints", {"repo_id": repo_id, "mode": mode_key})
+            _, llm, err = api_stream("/blueprints/stream", {"repo_id": repo_id, "mode": mode_key, "refresh": refresh}, as_code=True)
             if err:
                 st.error(err)
             else:
-                st.code(data.get("answer", ""), language="markdown")
+                show_latency(llm)
 
 # ---- Sidebar: Ingest ----
 st.title("Repo-Ops — GitHub RAG for ML Engineers")
@@ -60,12 +120,18 @@ with st.sidebar:
             st.error("Please paste a valid GitHub repository URL.")
         else:
             with st.spinner("Cloning & indexing…"):
-                data, err = api_post("/ingest", {"repo_url": repo_url.strip()})
+                job, err = api_post("/ingest", {"repo_url": repo_url.strip()})
+                data = None
+                if not err:
+                    data, err = wait_for_job(job["job_id"])
             if err:
                 st.error(err)
             else:
                 st.session_state["repo"] = data
                 st.success(f"✅ Ingested: {data.get('repo_id','(unknown)')}")
+                job_info, _ = api_get(f"/jobs/{job['job_id']}")
+                if job_info and job_info.get("timings"):
+                    st.caption(" · ".join(f"{k} {v:.1f}s" for k, v in job_info["timings"].items()))
                 st.toast("Index built", icon="✅")
 
 # ---- Main: require an ingested repo ----
@@ -90,35 +156,35 @@ with colC:
 
 st.markdown("#### Capabilities detected")
 show_modes(modes)
+refresh = st.checkbox("Regenerate blueprints", value=False,
+                      help="Blueprints are precomputed at ingest; tick to generate fresh ones.")
 st.divider()
 
 # ---- Tabs ----
 tabs = st.tabs(["Run", "Test", "Deploy", "Understand", "Tech Stack", "Chat"])
 
 # Run / Test / Deploy / Understand / Stack blueprints
-blueprint_block(tabs[0], "run", "Run Locally", repo_id, modes.get("run", True))
-blueprint_block(tabs[1], "test", "Test Suite", repo_id, modes.get("test", True))
-blueprint_block(tabs[2], "deploy", "Deploy (Docker/ASGI)", repo_id, modes.get("deploy", True))
+blueprint_block(tabs[0], "run", "Run Locally", repo_id, modes.get("run", True), refresh)
+blueprint_block(tabs[1], "test", "Test Suite", repo_id, modes.get("test", True), refresh)
+blueprint_block(tabs[2], "deploy", "Deploy (Docker/ASGI)", repo_id, modes.get("deploy", True), refresh)
 
 with tabs[3]:
     st.caption("High-level explanation of what this repository does.")
     if st.button("Explain Repository", use_container_width=True):
-        with st.spinner("Generating…"):
-            data, err = api_post("/blueprints", {"repo_id": repo_id, "mode": "understand"})
+        _, llm, err = api_stream("/blueprints/stream", {"repo_id": repo_id, "mode": "understand", "refresh": refresh}, as_code=True)
         if err:
             st.error(err)
         else:
-            st.code(data.get("answer", ""), language="markdown")
+            show_latency(llm)
 
 with tabs[4]:
     st.caption("List the key frameworks, libraries, and config files with evidence.")
     if st.button("Show Tech Stack", use_container_width=True):
-        with st.spinner("Generating…"):
-            data, err = api_post("/blueprints", {"repo_id": repo_id, "mode": "stack"})
+        _, llm, err = api_stream("/blueprints/stream", {"repo_id": repo_id, "mode": "stack", "refresh": refresh}, as_code=True)
         if err:
             st.error(err)
         else:
-            st.code(data.get("answer", ""), language="markdown")
+            show_latency(llm)
 
 # Chat tab
 with tabs[5]:
@@ -137,12 +203,11 @@ with tabs[5]:
         if not q.strip():
             st.error("Please enter a question.")
         else:
-            with st.spinner("Thinking…"):
-                data, err = api_post("/ask", {"repo_id": repo_id, "query": q.strip(), "mode": intent})
+            _, llm, err = api_stream("/ask/stream", {"repo_id": repo_id, "query": q.strip(), "mode": intent})
             if err:
                 st.error(err)
             else:
-                st.markdown(data.get("answer", ""))
+                show_latency(llm)
 
 # Footer tip
 st.markdown(
@@ -0,0 +1,3 @@
+import os
+
+os.environ.setdefault("AIML_API_KEY", "test")   # backend.llm reads it at import; tests never call the API
@@ -0,0 +1,31 @@
+import pytest
+
+from backend import analyzer
+from backend.analyzer import ANALYZERS, Analyzer, CodeAnalyzer, analyzer_for_index, register_analyzer
+
+def test_builtins_are_registered():
+    assert sorted(ANALYZERS) == ["code", "whitespace"]
+
+def test_code_analyzer_keeps_identifiers_and_subwords():
+    toks = CodeAnalyzer({"the"}).analyze("the build_index(repo) calls BM25Okapi; HTTPServer2")
+    assert toks == ["build_index", "build", "index", "repo", "calls", "bm25okapi", "bm25", "okapi",
+                    "httpserver2", "http", "server2"]
+
+def test_registered_analyzer_round_trips_through_index_meta(monkeypatch):
+    monkeypatch.setattr(analyzer, "ANALYZERS", dict(ANALYZERS))
+    @register_analyzer
+    class Upper(Analyzer):
+        name = "upper"
+        def analyze(self, text):
+            return text.upper().split()
+    monkeypatch.setattr(analyzer, "BM25_ANALYZER", "upper")
+    assert isinstance(analyzer.current_analyzer(), Upper)
+    rebuilt, mismatch = analyzer_for_index(analyzer.current_analyzer().spec())
+    assert isinstance(rebuilt, Upper) and not mismatch
+    with pytest.raises(ValueError):
+        analyzer_for_index({"name": "upper", "version": 2, "stopwords": []})
+
+def test_unknown_analyzer_is_rejected(monkeypatch):
+    monkeypatch.setattr(analyzer, "BM25_ANALYZER", "nope")
+    with pytest.raises(ValueError):
+        analyzer.current_analyzer()
@@ -0,0 +1,64 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from backend.bm25_index import BM25Index, IndexBuilder
+
+def _corpus(seed, n_docs, vocab):
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocab)]
+    # Zipf-ish draws so some terms are in most docs (floored negative IDF) and some in one
+    p = 1.0 / np.arange(1, vocab + 1)
+    p /= p.sum()
+    return [list(rng.choice(words, size=rng.integers(0, 40), p=p)) for _ in range(n_docs)]
+
+def _build(tmp_path, docs):
+    builder = IndexBuilder(tmp_path / "bm25", buffer_bytes=0)   # tiny buffer: several segments
+    for toks in docs:
+        builder.add(Counter(toks), len(toks))
+    builder.finish()
+    return BM25Index.open(tmp_path / "bm25")
+
+def _ranking(scores, k):
+    order = np.lexsort((np.arange(len(scores)), -scores))[:k]   # stable: ties by doc id
+    return order, scores[order]
+
+CASES = [(seed, n, v) for seed in range(4) for n, v in ((5, 8), (60, 30), (400, 120))]
+
+@pytest.mark.parametrize("seed,n_docs,vocab", CASES)
+@pytest.mark.parametrize("prune", [True, False])
+def test_topk_matches_full_scoring(tmp_path, seed, n_docs, vocab, prune):
+    index = _build(tmp_path, _corpus(seed, n_docs, vocab))
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(20):
+        query = [f"w{i}" for i in rng.integers(0, vocab + 5, size=rng.integers(1, 6))]   # some OOV
+        full = index.get_scores(query)
+        for k in (1, 3, 10, n_docs + 5):
+            docs, scores = index.topk(query, k, prune=prune)
+            want_docs, want_scores = _ranking(full, k)
+            assert docs.tolist() == want_docs.tolist()
+            assert np.allclose(scores, want_scores, rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize("seed,n_docs,vocab", CASES)
+@pytest.mark.parametrize("prune", [True, False])
+def test_topk_matches_rank_bm25(tmp_path, seed, n_docs, vocab, prune):
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    corpus = _corpus(seed, n_docs, vocab)
+    index = _build(tmp_path, corpus)
+    ref = rank_bm25.BM25Okapi(corpus)
+    rng = np.random.default_rng(seed + 200)
+    for _ in range(20):
+        query = [f"w{i}" for i in rng.integers(0, vocab, size=rng.integers(1, 6))]
+        want = np.round(np.asarray(ref.get_scores(query), dtype=np.float64), 9)
+        k = min(10, n_docs)
+        docs, scores = index.topk(query, k, prune=prune)
+        want_docs, want_scores = _ranking(want, k)
+        assert docs.tolist() == want_docs.tolist()
+        assert np.allclose(scores, want_scores, rtol=0, atol=1e-6)
+
+def test_topk_empty_and_zero_k(tmp_path):
+    index = _build(tmp_path, [["a", "b"], ["b"], []])
+    assert index.topk(["a"], 0)[0].tolist() == []
+    docs, scores = index.topk(["zzz"], 2)   # no match: zero scores in doc-id order
+    assert docs.tolist() == [0, 1] and scores.tolist() == [0.0, 0.0]
@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+import pytest
+
+from backend.chunk_store import POS_FIELDS, ChunkStore, ChunkWriter, JsonlChunks, open_chunks
+
+def _rows(n):
+    texts = ["", "ascii only\n", "naïve café — ünïcödé ✓\n", "x" * 300, "日本語のテキスト\n"]
+    out = []
+    for i in range(n):
+        meta = {"path": f"src/f{i % 4}.py", **{k: i * 10 + j for j, k in enumerate(POS_FIELDS)}}
+        out.append({"text": f"{i}:" + texts[i % len(texts)], "meta": meta})
+    return out
+
+def _write(store_dir, rows, block_bytes):
+    writer = ChunkWriter(store_dir, block_bytes=block_bytes)
+    assert [writer.add(r["text"], r["meta"]) for r in rows] == list(range(len(rows)))
+    file_meta = {"src/f1.py": {"tags": ["api"], "summary": "one"}}
+    return writer.finish(file_meta)
+
+def _expected(row):
+    path = row["meta"]["path"]
+    tags, summary = (["api"], "one") if path == "src/f1.py" else ([], "")
+    return {"text": row["text"], "meta": {**row["meta"], "tags": tags, "summary": summary}}
+
+@pytest.mark.parametrize("block_bytes", [1, 50, 1 << 16])
+def test_round_trip_across_blocks(tmp_path, block_bytes):
+    rows = _rows(37)
+    meta = _write(tmp_path / "chunks", rows, block_bytes)
+    store = ChunkStore(tmp_path / "chunks")
+    assert meta["n_docs"] == store.n_docs == 37 and meta["n_files"] == 4
+    assert (meta["n_blocks"] > 1) is (block_bytes < 1 << 16)
+    assert meta["raw_bytes"] == sum(len(r["text"].encode("utf-8")) for r in rows)
+    assert list(store) == [_expected(r) for r in rows]
+    order = [36, 0, 5, 5, 17, 1, 35]   # random access, repeats, across block boundaries
+    assert store.rows(order) == [_expected(rows[d]) for d in order]
+    assert store.rows([]) == []
+
+def test_version_tracks_content(tmp_path):
+    rows = _rows(5)
+    a = _write(tmp_path / "a", rows, 64)["version"]
+    b = _write(tmp_path / "b", rows, 4096)["version"]
+    rows[3]["text"] += "!"
+    c = _write(tmp_path / "c", rows, 64)["version"]
+    assert a == b != c
+
+def test_empty_store(tmp_path):
+    _write(tmp_path / "chunks", [], 64)
+    store = ChunkStore(tmp_path / "chunks")
+    assert store.n_docs == 0 and list(store) == [] and store.rows([]) == []
+
+def test_abort_leaves_nothing(tmp_path):
+    writer = ChunkWriter(tmp_path / "chunks")
+    writer.add("text", {"path": "a.py"})
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+def test_resident_bytes_counts_loaded_arrays_not_mmapped_ones(tmp_path):
+    _write(tmp_path / "chunks", _rows(200), 256)
+    store = ChunkStore(tmp_path / "chunks")
+    table = store.resident_bytes()
+    assert table > 0 and all(isinstance(getattr(store, n), np.memmap) for n in ("blocks", "doc_pos"))
+    store.doc_pos = np.array(store.doc_pos)   # as if the positions were read into memory
+    assert store.resident_bytes() == table + store.doc_pos.nbytes
+
+def test_jsonl_fallback(tmp_path):
+    rows = [_expected(r) for r in _rows(12)]
+    (tmp_path / "corpus.jsonl").write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows),
+                                           encoding="utf-8")
+    chunks = open_chunks(tmp_path)
+    assert isinstance(chunks, JsonlChunks) and chunks.resident_bytes() == 0
+    assert chunks.rows([11, 0, 4]) == [rows[11], rows[0], rows[4]]
+    assert list(chunks) == rows
+    assert chunks.resident_bytes() > 0   # row offsets, found by the first lookup
+
+def test_open_chunks_prefers_the_store(tmp_path):
+    assert open_chunks(tmp_path) is None
+    (tmp_path / "corpus.jsonl").write_text("", encoding="utf-8")
+    _write(tmp_path / "chunks", _rows(3), 64)
+    assert isinstance(open_chunks(tmp_path), ChunkStore)
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from backend.chunker import ENC, chunk_text, chunk_texts
+
+def _tokens(text):
+    # the chunker budgets per line, so count the same way
+    return sum(len(ENC.encode_ordinary(line)) for line in text.splitlines(keepends=True))
+
+def _python(seed, n_defs):
+    rng = random.Random(seed)
+    out = ["import os\n", "\n"]
+    for i in range(n_defs):
+        out.append("# helper comment\n" if rng.random() < 0.5 else "")
+        out.append(f"def func_{i}(x):\n")
+        for j in range(rng.randint(1, 12)):
+            out.append(f"    y_{j} = x * {j} + len('naïve ✓ {i}')\n")
+        out.append("    return x\n\n")
+    return "".join(out)
+
+def _assert_covers(text, chunks):
+    data, lines = text.encode("utf-8"), text.splitlines(keepends=True)
+    assert chunks[0]["start_byte"] == 0 and chunks[-1]["end_byte"] == len(data)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert prev["end_byte"] == nxt["start_byte"]
+    for ch in chunks:
+        assert data[ch["start_byte"]:ch["end_byte"]] == ch["text"].encode("utf-8")
+        assert ch["text"] in "".join(lines[ch["start_line"] - 1:ch["end_line"]])
+    assert "".join(ch["text"] for ch in chunks) == text
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_tokens", [40, 120, 450])
+def test_chunks_cover_file_bytes_within_budget(seed, max_tokens):
+    text = _python(seed, 15)
+    chunks = chunk_text(text, "mod.py", max_tokens=max_tokens, overlap=0)
+    _assert_covers(text, chunks)
+    assert all(_tokens(ch["text"]) <= max_tokens for ch in chunks)
+
+def test_cuts_prefer_definitions():
+    text = _python(0, 6)
+    starts = {i + 1 for i, line in enumerate(text.splitlines()) if line.startswith(("def ", "# helper"))}
+    chunks = chunk_text(text, "mod.py", max_tokens=400, overlap=0)
+    assert len(chunks) > 1
+    assert all(ch["start_line"] in starts for ch in chunks[1:])
+
+def test_long_line_is_split_on_token_boundaries():
+    text = "x = '" + "abc " * 300 + "'\nprint(x)\n"
+    chunks = chunk_text(text, "long.py", max_tokens=50, overlap=0)
+    _assert_covers(text, chunks)
+    assert all(len(ENC.encode_ordinary(ch["text"])) <= 50 for ch in chunks)
+    assert {ch["start_line"] for ch in chunks[:-1]} == {1}
+
+def test_overlap_repeats_trailing_lines_only():
+    text = _python(1, 10)
+    chunks = chunk_text(text, "mod.py", max_tokens=120, overlap=30)
+    assert chunks[0]["start_line"] == 1 and chunks[-1]["end_line"] == len(text.splitlines())
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert prev["start_line"] < nxt["start_line"] <= prev["end_line"] + 1
+    assert all(_tokens(ch["text"]) <= 120 for ch in chunks)
+
+def test_batch_matches_single_and_handles_empty():
+    docs = [("a.py", _python(2, 4)), ("empty.md", ""), ("b.md", "# T\n\nbody ü\n## U\nmore\n")]
+    assert chunk_texts(docs, max_tokens=60) == [chunk_text(t, p, max_tokens=60) for p, t in docs]
+    assert chunk_texts(docs, max_tokens=60)[1] == []
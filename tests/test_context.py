@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from backend.context import _mmr, build_context, count_tokens, merge_adjacent
+
+def _file(path, n_lines, seed=0):
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "load", "save", "index", "query", "token", "cache"]
+    lines = [f"{rng.choice(words)}_{i} = {' '.join(rng.choices(words, k=6))}\n" for i in range(n_lines)]
+    return path, lines
+
+def _hits(path, lines, spans, scores, first_doc=0):
+    """Chunk hits for line spans [a, b) of a file, with byte offsets like the chunker's."""
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line.encode("utf-8")))
+    return [{"text": "".join(lines[a:b]), "score": s, "doc": first_doc + i,
+             "meta": {"path": path, "chunk_id": i, "start_line": a + 1, "end_line": b,
+                      "start_byte": offsets[a], "end_byte": offsets[b]}}
+            for i, ((a, b), s) in enumerate(zip(spans, scores))]
+
+def test_merge_adjacent_touching_and_overlapping():
+    path, lines = _file("a.py", 30)
+    hits = _hits(path, lines, [(0, 10), (10, 20), (18, 25), (27, 30)], [1.0, 3.0, 2.0, 0.5])
+    other = _hits("b.py", _file("b.py", 5, 1)[1], [(0, 5)], [2.5], first_doc=10)
+    blocks = merge_adjacent(list(reversed(hits)) + other)
+    assert [b["docs"] for b in blocks] == [[0, 1, 2], [10], [3]]   # best member's score first
+    merged = blocks[0]
+    assert merged["score"] == 3.0
+    assert merged["text"] == "".join(lines[0:25])   # the overlap is not repeated
+    assert (merged["meta"]["start_line"], merged["meta"]["end_line"]) == (1, 25)
+
+def test_mmr_drops_near_duplicates():
+    path, lines = _file("a.py", 12)
+    text = "".join(lines)
+    blocks = [{"text": text, "meta": {"path": "a.py"}, "score": 2.0, "docs": [0]},
+              {"text": text, "meta": {"path": "vendored/a.py"}, "score": 1.9, "docs": [1]},
+              {"text": "completely different words here now", "meta": {"path": "c.py"}, "score": 1.0, "docs": [2]}]
+    kept, dropped = _mmr(blocks)
+    assert dropped == 1 and [b["docs"] for b in kept] == [[0], [2]]
+
+@pytest.mark.parametrize("budget", [150, 400, 1200, 100_000])
+def test_build_context_stays_within_budget(budget):
+    hits = []
+    for f in range(6):
+        path, lines = _file(f"pkg/m{f}.py", 40, seed=f)
+        hits += _hits(path, lines, [(0, 12), (12, 24), (30, 40)], [10.0 - f, 9.0 - f, 1.0], first_doc=len(hits))
+    text, used, stats = build_context(hits, budget)
+    assert stats["context_tokens"] <= budget
+    assert stats["context_tokens"] == sum(count_tokens(part) for part in text.split("\n\n"))
+    assert stats["used"] == len(used) and stats["retrieved"] == len(hits)
+    assert stats["blocks"] == len(hits) - stats["merged"] == 12
+    for b in used:
+        if b.get("truncated"):
+            full = next(h for h in merge_adjacent(hits) if h["docs"] == b["docs"])
+            assert full["text"].startswith(b["text"]) and b["meta"]["end_line"] < full["meta"]["end_line"]
+    if budget == 100_000:
+        assert stats["used"] == 12 and stats["truncated"] == 0
+
+def test_zero_score_hits_only_when_nothing_matched():
+    path, lines = _file("a.py", 6)
+    hits = _hits(path, lines, [(0, 3), (4, 6)], [0.0, 1.0])
+    _, used, stats = build_context(hits, 1000)
+    assert stats["retrieved"] == 1 and [b["docs"] for b in used] == [[1]]
+    _, used, _ = build_context(_hits(path, lines, [(0, 3)], [0.0]), 1000)
+    assert len(used) == 1
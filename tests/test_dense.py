@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from backend import dense
+from backend.dense import DenseIndex, DenseWriter, Embedder, HashingEmbedder, reciprocal_rank_fusion
+
+class TableEmbedder(Embedder):
+    """Looks texts up as row numbers of a fixed matrix, so tests control the vectors exactly."""
+    name = "table"
+
+    def __init__(self, table: np.ndarray):
+        self.table, self.dim = table, table.shape[1]
+
+    def embed(self, texts):
+        return dense._normalize(self.table[[int(t) for t in texts]].astype(np.float32))
+
+def _clustered(n, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return dense._normalize((centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32))
+
+def _build(path, table, dtype="float16", batch=7):
+    writer = DenseWriter(path, TableEmbedder(table), dtype=dtype, batch=batch)
+    for i in range(len(table)):
+        writer.add(str(i))
+    writer.finish()
+    return DenseIndex.open(path)
+
+def test_int8_quantization_round_trips_within_half_a_step():
+    vecs = np.vstack([_clustered(64, 32, 4), np.zeros((1, 32), dtype=np.float32)])
+    q, scale = dense._quantize(vecs, "int8")
+    assert q.dtype == np.int8 and scale.dtype == np.float32 and np.abs(q).max() == 127
+    back = q.astype(np.float32) * scale[:, None]
+    assert np.all(np.abs(back - vecs) <= scale[:, None] / 2 + 1e-6)
+    assert not back[-1].any() and scale[-1] == 1.0   # zero rows stay zero
+    with pytest.raises(ValueError):
+        dense._quantize(vecs, "int4")
+
+def test_int8_index_ranks_like_float32(tmp_path):
+    table = _clustered(300, 32, 6)
+    index = _build(tmp_path / "dense", table, dtype="int8")
+    assert index.vectors.dtype == np.int8 and index.scale.shape == (300,)
+    for q in table[:20]:
+        ids, scores = index.search(q, 10)
+        exact = np.argsort(-(table @ q), kind="stable")[:10]
+        assert len(set(ids.tolist()) & set(exact.tolist())) >= 9
+        assert np.all(np.diff(scores) <= 0)
+
+def test_ivf_probe_recall_against_exhaustive_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(dense, "DENSE_IVF_MIN_DOCS", 1000)
+    table = _clustered(2000, 32, 40)
+    index = _build(tmp_path / "dense", table, batch=256)
+    n_lists = index.meta["ivf_lists"]
+    assert n_lists == len(index.centroids) == int(np.sqrt(2000))
+    assert index.ivf_ptr[-1] == 2000 and sorted(index.ivf_docs.tolist()) == list(range(2000))
+    rng = np.random.default_rng(1)
+    recall = []
+    for q in dense._normalize(table[rng.choice(2000, 50)] + 0.1 * rng.normal(size=(50, 32)).astype(np.float32)):
+        exact, _ = index.search(q, 10, nprobe=n_lists)   # every list probed: brute force
+        assert np.array_equal(exact, np.argsort(-(dense._rows(index.vectors, None, slice(None)) @ q), kind="stable")[:10])
+        ids, _ = index.search(q, 10, nprobe=8)
+        recall.append(len(set(ids.tolist()) & set(exact.tolist())) / 10)
+    assert np.mean(recall) >= 0.9
+
+def test_reciprocal_rank_fusion():
+    bm25, vec = np.array([3, 1, 2]), np.array([4, 1])
+    ids, scores = reciprocal_rank_fusion([bm25, vec], k=10, rrf_k=60)
+    assert ids.tolist() == [1, 3, 4, 2]   # 1 is in both lists; 3 and 4 tie at rank 1, broken by doc id
+    assert scores.tolist() == pytest.approx([2 / 62, 1 / 61, 1 / 61, 1 / 63])
+    assert reciprocal_rank_fusion([bm25, vec], k=2)[0].tolist() == [1, 3]
+    assert len(reciprocal_rank_fusion([np.array([], dtype=np.int64)], k=5)[0]) == 0
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_add_existing_reuses_vectors_of_kept_docs(tmp_path, dtype):
+    table = _clustered(20, 16, 3)
+    old = _build(tmp_path / "old", table, dtype=dtype)
+    keep = np.zeros(20, dtype=bool)
+    keep[[0, 3, 4, 19]] = True
+    writer = DenseWriter(tmp_path / "new", TableEmbedder(table), dtype=dtype)
+    assert writer.compatible(tmp_path / "old")
+    writer.add_existing(tmp_path / "old", keep)
+    writer.add("7")
+    with pytest.raises(RuntimeError):
+        writer.add_existing(tmp_path / "old", keep)
+    assert writer.finish()["n_docs"] == 5
+    new = DenseIndex.open(tmp_path / "new")
+    rows = [0, 3, 4, 19, 7]
+    assert np.array_equal(np.asarray(new.vectors), np.asarray(old.vectors[rows]))
+    if dtype == "int8":
+        assert np.array_equal(np.asarray(new.scale), np.asarray(old.scale[rows]))
+    assert new.search(table[19], 1)[0].tolist() == [3]   # doc ids follow the new order
+
+def test_compatible_rejects_other_embedders_and_dtypes(tmp_path):
+    _build(tmp_path / "old", _clustered(5, 16, 2))
+    assert not DenseWriter(tmp_path / "a", TableEmbedder(np.eye(16)), dtype="int8").compatible(tmp_path / "old")
+    assert not DenseWriter(tmp_path / "b", HashingEmbedder(16)).compatible(tmp_path / "old")
+    assert not DenseWriter(tmp_path / "c", HashingEmbedder(16)).compatible(tmp_path / "missing")
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    e = HashingEmbedder(64)
+    a, b = e.embed(["def parse_config(path)", ""]), e.embed(["def parse_config(path)", ""])
+    assert np.array_equal(a, b)
+    assert np.linalg.norm(a[0]) == pytest.approx(1.0) and not a[1].any()
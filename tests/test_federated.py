@@ -0,0 +1,128 @@
+import json
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from backend.analyzer import WhitespaceAnalyzer
+from backend.bm25_index import EPSILON, BM25Index, IndexBuilder
+from backend.chunk_store import ChunkWriter
+from backend.federated import FederatedSearch, Shard, ShardCache
+
+def _shards(tmp_path, seed, sizes, common=None):
+    """One repo per size, random docs over a shared vocabulary; `common` goes into ~80% of docs."""
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(60)]
+    p = 1.0 / np.arange(1, len(words) + 1)
+    p /= p.sum()
+    corpora = {}
+    for r, n in enumerate(sizes):
+        repo = tmp_path / f"r{r}"
+        builder, writer = IndexBuilder(repo / "bm25"), ChunkWriter(repo / "chunks", block_bytes=256)
+        docs = []
+        for i in range(n):
+            toks = list(rng.choice(words, size=rng.integers(1, 30), p=p))
+            if common and rng.random() < 0.8:
+                toks.append(common)
+            builder.add(Counter(toks), len(toks))
+            writer.add(" ".join(toks), {"path": f"f{i}.txt", "chunk_id": i})
+            docs.append(toks)
+        builder.finish(analyzer=WhitespaceAnalyzer().spec())
+        writer.finish()
+        corpora[repo.name] = docs
+    return corpora
+
+def _union(corpora):
+    offsets, docs = {}, []
+    for repo_id, corpus in corpora.items():
+        offsets[repo_id] = len(docs)
+        docs += corpus
+    return BM25Index.from_tokenized(docs), offsets
+
+def _check(hits, expected, offsets, k):
+    want = np.sort(expected[expected > 0])[::-1][:k]
+    assert len(hits) == len(want)
+    np.testing.assert_allclose([h["score"] for h in hits], want, rtol=1e-9)
+    for h in hits:   # every hit carries the score its doc has in the union index
+        d = offsets[h["repo_id"]] + h["meta"]["chunk_id"]
+        assert h["score"] == pytest.approx(expected[d], rel=1e-9)
+        assert h["citation"] == f"{h['repo_id']}:f{h['meta']['chunk_id']}.txt:{h['meta']['chunk_id']}"
+
+@pytest.mark.parametrize("seed", range(3))
+def test_scores_match_one_union_index(tmp_path, seed):
+    corpora = _shards(tmp_path, seed, [40, 7, 120])
+    union, offsets = _union(corpora)
+    df = Counter(t for docs in corpora.values() for toks in docs for t in set(toks))
+    n = sum(len(docs) for docs in corpora.values())
+    terms = sorted(t for t, f in df.items() if 2 * f < n)   # positive IDF: no flooring involved
+    rng = np.random.default_rng(seed)
+    for _ in range(10):
+        query = list(rng.choice(terms, size=3))
+        for k in (1, 5, 50):
+            hits = FederatedSearch(tmp_path, shards=ShardCache()).topk(" ".join(query), k)
+            _check(hits, union.get_scores(query), offsets, k)
+
+def test_negative_idf_is_floored_with_the_shard_weighted_mean(tmp_path):
+    corpora = _shards(tmp_path, 7, [50, 30, 80], common="everywhere")
+    union, offsets = _union(corpora)
+    n = sum(len(docs) for docs in corpora.values())
+    df = sum("everywhere" in toks for docs in corpora.values() for toks in docs)
+    assert 2 * df > n   # the term's raw IDF is negative
+    rare = next(t for t in (f"w{i}" for i in range(59, 0, -1))
+                if 0 < sum(t in toks for docs in corpora.values() for toks in docs) < n / 4)
+    means = [(float(np.mean(BM25Index.open(tmp_path / r / "bm25").idf)), len(docs)) for r, docs in corpora.items()]
+    floor = EPSILON * sum(m * c for m, c in means) / n
+    assert floor > 0
+    for query in (["everywhere"], ["everywhere", rare]):
+        idf = {t: float(union.idf[union.term_id(t)]) for t in query}
+        idf["everywhere"] = floor
+        expected = union.with_stats(idf, union.avgdl).get_scores(query)
+        hits = FederatedSearch(tmp_path, shards=ShardCache()).topk(" ".join(query), 20)
+        _check(hits, expected, offsets, 20)
+    # a floored term alone ranks exactly like the union index, whose floor uses its own vocabulary mean
+    hits = FederatedSearch(tmp_path, shards=ShardCache()).topk("everywhere", 20)
+    union_ranked = np.lexsort((np.arange(n), -union.get_scores(["everywhere"])))[:20]
+    assert [offsets[h["repo_id"]] + h["meta"]["chunk_id"] for h in hits] == list(union_ranked)
+
+def test_missing_repo_is_skipped(tmp_path):
+    corpora = _shards(tmp_path, 1, [10])
+    search = FederatedSearch(tmp_path, repo_ids=["r0", "nope"], shards=ShardCache())
+    term = corpora["r0"][0][0]
+    assert search.topk(term, 3)
+    assert list(search.errors) == ["nope"]
+
+def test_idf_mean_is_read_from_meta(tmp_path):
+    corpora = _shards(tmp_path, 2, [30, 5])
+    for repo_id in corpora:
+        bm25 = BM25Index.open(tmp_path / repo_id / "bm25")
+        assert bm25.meta["idf_mean"] == pytest.approx(float(np.mean(bm25.idf)))
+    meta_path = tmp_path / "r1" / "bm25" / "meta.json"
+    meta = json.loads(meta_path.read_text())
+    meta_path.write_text(json.dumps({**meta, "idf_mean": 123.0}))
+    assert Shard("r1", tmp_path / "r1").idf_mean == 123.0
+    del meta["idf_mean"]   # written before idf_mean was stored: computed from idf.npy
+    meta_path.write_text(json.dumps(meta))
+    assert Shard("r1", tmp_path / "r1").idf_mean == pytest.approx(float(np.mean(BM25Index.open(meta_path.parent).idf)))
+    assert BM25Index.from_tokenized(corpora["r0"]).meta["idf_mean"] == pytest.approx(
+        float(np.mean(BM25Index.open(tmp_path / "r0" / "bm25").idf)))
+
+def test_chunk_store_is_opened_only_for_shards_with_hits(tmp_path):
+    _shards(tmp_path, 3, [20, 20, 20])
+    for repo_id in ("r0", "r2"):   # words only these repos contain
+        builder, writer = IndexBuilder(tmp_path / f"x{repo_id}" / "bm25"), ChunkWriter(tmp_path / f"x{repo_id}" / "chunks")
+        builder.add(Counter(["needle"]), 1)
+        writer.add("needle", {"path": "n.txt", "chunk_id": 0})
+        builder.finish(analyzer=WhitespaceAnalyzer().spec())
+        writer.finish()
+    cache = ShardCache()
+    hits = FederatedSearch(tmp_path, shards=cache).topk("needle", 5)
+    assert sorted(h["repo_id"] for h in hits) == ["xr0", "xr2"]
+    opened = {repo_id: shard._chunks is not None for repo_id, (shard, _) in cache._entries.items()}
+    assert opened == {"r0": False, "r1": False, "r2": False, "xr0": True, "xr2": True}
+
+def test_shard_without_chunk_store_is_skipped(tmp_path):
+    _shards(tmp_path, 4, [10, 10])
+    (tmp_path / "r1" / "chunks" / "meta.json").unlink()
+    search = FederatedSearch(tmp_path, shards=ShardCache())
+    search.topk("w0", 3)
+    assert list(search.errors) == ["r1"] and "Missing index files" in search.errors["r1"]
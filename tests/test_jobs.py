@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import api
+from backend.jobs import JobConflictError, JobManager
+
+def _blocking_manager():
+    release = threading.Event()
+    def run(job):
+        release.wait(5)
+        return {"ok": True, "repo_id": job.repo_id, "source_url": job.repo_url}
+    return JobManager(run, workers=1, max_queue=2), release
+
+def test_same_url_attaches_other_url_conflicts():
+    jobs, release = _blocking_manager()
+    job, attached = jobs.submit("tool", "https://github.com/a/tool")
+    assert not attached
+    assert jobs.submit("tool", "https://github.com/a/tool") == (job, True)
+    with pytest.raises(JobConflictError):
+        jobs.submit("tool", "https://github.com/b/tool")
+    release.set()
+    assert job.wait(5) and job.status == "succeeded"
+    job2, attached = jobs.submit("tool", "https://github.com/b/tool")   # nothing active any more
+    assert not attached and job2 is not job
+    assert job2.wait(5)
+
+def test_ingest_status_codes(tmp_path, monkeypatch):
+    jobs, release = _blocking_manager()
+    monkeypatch.setattr(api, "JOBS", jobs)
+    monkeypatch.setattr(api, "DATA_ROOT", tmp_path)
+    client = TestClient(api.app)
+    r = client.post("/ingest", json={"repo_url": "https://github.com/a/tool"})
+    assert r.status_code == 202 and r.json()["attached"] is False
+    r = client.post("/ingest", json={"repo_url": "https://github.com/b/tool.git"})
+    assert r.status_code == 409
+    release.set()
+    r = client.post("/ingest", json={"repo_url": "https://github.com/c/other", "wait": True})
+    assert r.status_code == 200 and r.json()["source_url"] == "https://github.com/c/other"
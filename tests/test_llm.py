@@ -0,0 +1,195 @@
+import asyncio, json, threading, time
+
+import httpx
+import pytest
+import requests
+
+from backend import llm
+from backend.llm_cache import LLMCache
+
+OK = {"choices": [{"message": {"content": "hi"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1}}
+
+class Resp:
+    def __init__(self, status, body=None, headers=None):
+        self.status_code, self._body, self.headers = status, body or {}, headers or {}
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+class Session:
+    """Replays a script of responses (or exceptions to raise), one per POST."""
+    def __init__(self, *script):
+        self.script, self.calls = list(script), 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        item = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+@pytest.fixture
+def breaker(monkeypatch):
+    b = llm.CircuitBreaker(threshold=2, cooldown=0.2)
+    monkeypatch.setattr(llm, "BREAKER", b)
+    monkeypatch.setattr(llm, "LLM_BACKOFF_BASE", 0.0)   # no sleeping between attempts
+    return b
+
+def _use(monkeypatch, session):
+    monkeypatch.setattr(llm, "_get_session", lambda: session)
+    return session
+
+def _call(**kwargs):
+    return llm.chat_result([{"role": "user", "content": "x"}], cache=False, **kwargs)
+
+def test_retries_transient_errors_then_succeeds(monkeypatch, breaker):
+    s = _use(monkeypatch, Session(requests.ConnectionError("down"), requests.Timeout("slow"),
+                                  Resp(503), Resp(200, OK)))
+    res = _call()
+    assert (res.text, res.retries, res.usage["prompt_tokens"], s.calls) == ("hi", 3, 3, 4)
+    assert breaker.state == "closed"
+
+def test_client_errors_are_not_retried(monkeypatch, breaker):
+    s = _use(monkeypatch, Session(Resp(400, {"error": "bad"})))
+    with pytest.raises(RuntimeError, match="400"):
+        _call()
+    assert s.calls == 1 and breaker.failures == 0
+
+def test_backoff_honours_retry_after_and_caps():
+    assert llm._backoff(0, 3.0) == 3.0
+    assert llm._backoff(0, 1e6) == llm.LLM_BACKOFF_MAX
+    for attempt in range(8):
+        assert 0 <= llm._backoff(attempt, None) <= min(llm.LLM_BACKOFF_MAX, llm.LLM_BACKOFF_BASE * 2 ** attempt)
+    assert llm._retry_after({"Retry-After": "2.5"}) == 2.5
+    assert llm._retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+
+def test_rate_limit_raises_without_opening_the_breaker(monkeypatch, breaker):
+    s = _use(monkeypatch, Session(Resp(429, {"error": "slow down"}, {"Retry-After": "0"})))
+    for _ in range(3):
+        with pytest.raises(llm.RateLimitError) as e:
+            _call(retries=2)
+        assert e.value.retry_after == 0
+    assert s.calls == 9 and breaker.state == "closed"
+    _use(monkeypatch, Session(Resp(408, headers={"Retry-After": "0"})))
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            _call(retries=0)
+    assert breaker.state == "closed"
+    _use(monkeypatch, Session(Resp(200, OK)))
+    assert _call().text == "hi"   # an unrelated call still goes through
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch, breaker):
+    s = _use(monkeypatch, Session(Resp(502)))
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="502"):
+            _call(retries=0)
+    assert breaker.state == "open"
+    with pytest.raises(llm.CircuitOpenError):
+        _call()
+    assert s.calls == 2   # failing fast: no request sent
+    monkeypatch.setattr(breaker, "opened_at", breaker.opened_at - 0.2)
+    assert breaker.state == "half-open"
+    with pytest.raises(RuntimeError, match="502"):
+        _call(retries=0)   # the trial fails: open again for another cooldown
+    assert breaker.state == "open"
+    monkeypatch.setattr(breaker, "opened_at", breaker.opened_at - 0.2)
+    breaker.allow()   # the trial call
+    with pytest.raises(llm.CircuitOpenError):
+        breaker.allow()   # only one at a time while it is in flight
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_async_client_is_per_event_loop(monkeypatch, breaker):
+    calls = []
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(503) if len(calls) == 1 else httpx.Response(200, json=OK)
+    real = httpx.AsyncClient
+    monkeypatch.setattr(llm.httpx, "AsyncClient",
+                        lambda **kw: real(transport=httpx.MockTransport(handler), **kw))
+    async def ask():
+        client = llm._get_async_client()
+        assert llm._get_async_client() is client
+        return client, await llm.achat_result([{"role": "user", "content": "x"}], cache=False)
+    first, res = asyncio.run(ask())
+    assert (res.text, res.retries) == ("hi", 1)
+    second, res = asyncio.run(ask())   # a new loop must not reuse the first loop's connections
+    assert second is not first and res.text == "hi"
+    assert calls == ["/v1/chat/completions"] * 3
+
+def test_token_bucket_rate_and_burst():
+    bucket = llm.TokenBucket(rate=50, burst=2)
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(3)]) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.monotonic() - t0 >= (12 - 2) / 50 * 0.9   # the burst, then `rate` per second
+
+def test_token_bucket_penalize_pauses_everyone():
+    bucket = llm.TokenBucket(rate=1000, burst=4)
+    bucket.penalize(0.2)
+    t0 = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - t0 >= 0.19
+
+class StreamResp:
+    status_code, headers, text = 200, {}, ""
+
+    def __init__(self, *lines):
+        self.lines, self.closed = lines, False
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+def _delta(text, finish=None):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": text}, "finish_reason": finish}]})
+
+def test_sse_events_parse_until_done():
+    resp = StreamResp(": keep-alive", "", _delta("a"), "event: ignored", _delta("b"), "data: [DONE]", _delta("late"))
+    assert [e["choices"][0]["delta"]["content"] for e in llm._sse_events(resp)] == ["a", "b"]
+    # a finish_reason marks the completion as whole even if [DONE] is missing
+    assert len(list(llm._sse_events(StreamResp(_delta("a"), _delta("", "stop"))))) == 2
+
+@pytest.mark.parametrize("lines,match", [
+    ((_delta("a"), 'data: {"error": {"message": "overloaded"}}', "data: [DONE]"), "overloaded"),
+    ((_delta("a"), _delta("b")), "ended before"),
+    ((_delta("a"), "data: {not json"), "Unexpected"),
+])
+def test_sse_errors_and_truncation_raise(lines, match):
+    with pytest.raises(RuntimeError, match=match):
+        list(llm._sse_events(StreamResp(*lines)))
+
+@pytest.fixture
+def stream_cache(tmp_path, monkeypatch):
+    cache = LLMCache(tmp_path / "llm.sqlite")
+    monkeypatch.setattr(llm, "CACHE", cache)
+    monkeypatch.setattr(llm, "LLM_CACHE", True)
+    return cache
+
+MSGS = [{"role": "user", "content": "x"}]
+
+def test_complete_stream_is_cached(monkeypatch, breaker, stream_cache):
+    _use(monkeypatch, Session(StreamResp(_delta("a"), _delta("b", "stop"), "data: [DONE]")))
+    stream = llm.chat_stream(MSGS, key="k")
+    assert list(stream) == ["a", "b"] and stream.result.text == "ab" and stream.result.ttft is not None
+    assert stream_cache.get(llm._cache_key(MSGS, 0.0, "k"))["text"] == "ab"
+
+def test_broken_stream_is_an_error_event_and_is_not_kept(monkeypatch, tmp_path, breaker, stream_cache):
+    from backend.api import _stream_events
+    from backend.blueprint import BlueprintStream
+    _use(monkeypatch, Session(StreamResp(_delta("partial"), 'data: {"error": {"message": "boom"}}')))
+    bp = BlueprintStream(live=llm.chat_stream(MSGS, key="k"), vdir=tmp_path / "v", version="v1", mode="run")
+    events = list(_stream_events(bp))
+    assert events[0].startswith("event: token") and events[-1].startswith("event: error") and "boom" in events[-1]
+    assert not any(e.startswith("event: done") for e in events)
+    assert stream_cache.get(llm._cache_key(MSGS, 0.0, "k")) is None
+    assert not (tmp_path / "v").exists()   # no blueprint saved
+    _use(monkeypatch, Session(StreamResp(_delta("cut"))))   # connection closed without [DONE]
+    events = list(_stream_events(llm.chat_stream(MSGS, key="k")))
+    assert events[-1].startswith("event: error") and stream_cache.get(llm._cache_key(MSGS, 0.0, "k")) is None
@@ -0,0 +1,43 @@
+import threading, time
+
+from backend import llm
+from backend.llm_cache import LLMCache
+
+def test_get_or_compute_counts_and_single_flight(tmp_path):
+    cache = LLMCache(tmp_path / "llm.sqlite")
+    started, release, calls = threading.Event(), threading.Event(), []
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"text": "x"}
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    follower.start()
+    while cache.stats()["shared"] == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join(); follower.join()
+    assert len(calls) == 1 and sorted(hit for _, hit in results) == [False, True]
+    assert cache.get_or_compute("k", compute) == ({"text": "x"}, True)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1 and cache.stats()["shared"] == 1
+
+def test_lookup_counts_hits_and_misses(tmp_path):
+    cache = LLMCache(tmp_path / "llm.sqlite")
+    assert cache.lookup("k") is None
+    cache.put("k", {"text": "x"})
+    assert cache.lookup("k") == {"text": "x"}
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+def test_stream_served_from_cache_counts_a_hit(tmp_path, monkeypatch):
+    cache = LLMCache(tmp_path / "llm.sqlite")
+    monkeypatch.setattr(llm, "CACHE", cache)
+    monkeypatch.setattr(llm, "LLM_CACHE", True)
+    msgs = [{"role": "user", "content": "hi"}]
+    cache.put(llm._cache_key(msgs, 0.1, "answer"), {"text": "cached answer", "usage": {}})
+    stream = llm.chat_stream(msgs, temperature=0.1, key="answer")
+    assert "".join(stream) == "cached answer"
+    assert stream.result.cached and cache.stats()["hits"] == 1
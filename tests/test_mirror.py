@@ -0,0 +1,137 @@
+import subprocess, threading, time
+
+import pytest
+
+from backend import mirror
+
+def _git(cwd, *args):
+    return subprocess.check_output(["git", "-c", "user.email=t@t", "-c", "user.name=t", *args],
+                                   cwd=cwd, text=True).strip()
+
+def _commit(repo, files, msg="change"):
+    for rel, data in files.items():
+        (repo / rel).parent.mkdir(parents=True, exist_ok=True)
+        (repo / rel).write_bytes(data)
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-qm", msg)
+    return _git(repo, "rev-parse", "HEAD")
+
+@pytest.fixture
+def src(tmp_path, monkeypatch):
+    monkeypatch.setattr(mirror, "MIRROR_ROOT", tmp_path / "_mirrors")
+    repo = tmp_path / "src"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    return repo
+
+def _tree(repo, commit):
+    return {line.split("\t")[1]: line.split()[2] for line in _git(repo, "ls-tree", "-r", commit).splitlines()}
+
+def test_first_clone_is_a_bare_mirror(src, tmp_path):
+    head = _commit(src, {"a.py": b"print(1)\n", "docs/b.md": b"# B\n"})
+    (src / "link.py").symlink_to("a.py")
+    head = _commit(src, {})
+    url = f"file://{src}"
+    commit, blobs = mirror.checkout(url, tmp_path / "out", lambda rel: True)
+    assert commit == head
+    assert blobs == _tree(src, head)
+    assert (tmp_path / "out" / "a.py").read_bytes() == b"print(1)\n"
+    assert (tmp_path / "out" / "docs" / "b.md").read_bytes() == b"# B\n"
+    assert not (tmp_path / "out" / "link.py").exists()   # symlinks are not followed
+    path = mirror.mirror_path(url)
+    assert _git(path, "rev-parse", "--is-bare-repository") == "true"
+    assert _git(path, "rev-parse", "HEAD") == head
+
+def test_reingest_fetches_into_the_same_mirror(src, tmp_path, monkeypatch):
+    url = f"file://{src}"
+    _commit(src, {"a.py": b"v1\n"})
+    mirror.checkout(url, tmp_path / "one", lambda rel: True)
+    head = _commit(src, {"a.py": b"v2\n", "new.py": b"new\n"})
+    def no_clone(*args):
+        raise AssertionError("re-ingest cloned again")
+    monkeypatch.setattr(mirror, "_clone", no_clone)
+    commit, blobs = mirror.checkout(url, tmp_path / "two", lambda rel: True)
+    assert commit == head and set(blobs) == {"a.py", "new.py"}
+    assert (tmp_path / "two" / "a.py").read_bytes() == b"v2\n"
+    assert (tmp_path / "two" / "new.py").read_bytes() == b"new\n"
+
+def test_export_only_writes_wanted_paths(src, tmp_path):
+    head = _commit(src, {"a.py": b"a\n", "b.png": b"\x89PNG", "sub/c.py": b"c\n"})
+    commit, blobs = mirror.checkout(f"file://{src}", tmp_path / "out", lambda rel: rel.endswith(".py"))
+    assert blobs == _tree(src, head)   # every file is reported, for change detection
+    assert sorted(p.relative_to(tmp_path / "out").as_posix()
+                  for p in (tmp_path / "out").rglob("*") if p.is_file()) == ["a.py", "sub/c.py"]
+
+def test_oversized_blobs_stay_on_the_server(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(mirror, "BLOB_FILTER", "blob:limit=100")
+    head = _commit(src, {"small.py": b"x" * 99, "big.py": b"y" * 100})
+    url = f"file://{src}"
+    commit, blobs = mirror.checkout(url, tmp_path / "out", lambda rel: True)
+    assert set(blobs) == {"small.py", "big.py"}
+    assert (tmp_path / "out" / "small.py").exists()
+    assert not (tmp_path / "out" / "big.py").exists()
+    missing = _git(mirror.mirror_path(url), "rev-list", "--objects", "--missing=print", head)
+    assert f"?{blobs['big.py']}" in missing.splitlines()
+
+def test_raising_the_blob_limit_reclones_the_mirror(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(mirror, "BLOB_FILTER", "blob:limit=100")
+    _commit(src, {"small.py": b"x" * 99, "big.py": b"y" * 500})
+    url = f"file://{src}"
+    mirror.checkout(url, tmp_path / "one", lambda rel: True)
+    assert not (tmp_path / "one" / "big.py").exists()
+    monkeypatch.setattr(mirror, "BLOB_FILTER", "blob:limit=1000")
+    head = _commit(src, {"small.py": b"z\n"})
+    commit, _ = mirror.checkout(url, tmp_path / "two", lambda rel: True)
+    assert commit == head
+    assert (tmp_path / "two" / "big.py").read_bytes() == b"y" * 500
+    path = mirror.mirror_path(url)
+    assert _git(path, "config", "remote.origin.partialclonefilter") == "blob:limit=1000"
+    def no_clone(*args):
+        raise AssertionError("unchanged filter cloned again")
+    monkeypatch.setattr(mirror, "_clone", no_clone)
+    mirror.checkout(url, tmp_path / "three", lambda rel: True)
+
+def test_no_lazy_fetch_follows_git_version(monkeypatch):
+    monkeypatch.setattr(mirror, "git_version", lambda: (2, 44, 0))
+    assert mirror._no_lazy_fetch() == ["--no-lazy-fetch"]
+    monkeypatch.setattr(mirror, "git_version", lambda: (2, 39, 5))
+    assert mirror._no_lazy_fetch() == []
+
+def test_concurrent_ingests_of_one_url_are_serialized(src, tmp_path, monkeypatch):
+    head = _commit(src, {"a.py": b"a\n"})
+    url = f"file://{src}"
+    spans, update = [], mirror.update_mirror
+    def slow_update(repo_url):
+        t0 = time.monotonic()
+        time.sleep(0.2)
+        out = update(repo_url)
+        spans.append((t0, time.monotonic()))
+        return out
+    monkeypatch.setattr(mirror, "update_mirror", slow_update)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(
+        mirror.checkout(url, tmp_path / f"out{i}", lambda rel: True)[0])) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [head] * 3
+    spans.sort()
+    assert all(end <= start for (_, end), (start, _) in zip(spans, spans[1:]))
+
+def test_mirror_lock_times_out(tmp_path):
+    path = tmp_path / "m.git"
+    with mirror.mirror_lock(path):
+        errors = []
+        def other():
+            try:
+                with mirror.mirror_lock(path, timeout=0.2):
+                    pass
+            except TimeoutError as e:
+                errors.append(e)
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+    assert len(errors) == 1
+    with mirror.mirror_lock(path, timeout=0):
+        pass
@@ -0,0 +1,145 @@
+import json, subprocess, threading, time
+
+import pytest
+
+from backend import mirror, repo_indexer
+from backend.chunk_store import open_chunks
+from backend.llm import ChatResult, CircuitOpenError, RateLimitError
+from backend.repo_indexer import _blob_sha, _read_file, build_index
+
+def _git(cwd, *args):
+    return subprocess.check_output(["git", "-c", "user.email=t@t", "-c", "user.name=t", *args],
+                                   cwd=cwd, text=True).strip()
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """Ingest without the LLM (no tags, no repo map) and with mirrors under tmp_path."""
+    def no_llm(*args, **kwargs):
+        raise RuntimeError("LLM disabled in tests")
+    monkeypatch.setattr(repo_indexer, "chat_result", no_llm)
+    monkeypatch.setattr(repo_indexer, "INGEST_WORKERS", 1)
+    monkeypatch.setattr(repo_indexer, "TAG_RETRIES", 0)
+    monkeypatch.setattr(repo_indexer, "TAG_RPS", 1000.0)
+    monkeypatch.setattr(mirror, "MIRROR_ROOT", tmp_path / "_mirrors")
+
+def _repo(path, files):
+    path.mkdir()
+    _git(path, "init", "-q")
+    for rel, data in files.items():
+        (path / rel).write_bytes(data)
+    _git(path, "add", "-A")
+    _git(path, "commit", "-qm", "init")
+    return path
+
+def test_blob_sha_matches_git_for_non_utf8(tmp_path):
+    p = tmp_path / "latin1.txt"
+    p.write_bytes("café naïve\n".encode("latin-1"))
+    want = subprocess.check_output(["git", "hash-object", str(p)], text=True).strip()
+    assert _blob_sha(p.read_bytes()) == want
+    f = _read_file(p, "latin1.txt")
+    assert f["blob"] == want and f["size"] == p.stat().st_size
+
+def test_read_file_limit_is_in_bytes(tmp_path, monkeypatch):
+    p = tmp_path / "wide.md"
+    p.write_text("é" * 60, encoding="utf-8")   # 60 characters, 120 bytes
+    monkeypatch.setattr(repo_indexer, "MAX_FILE_BYTES", 100)
+    assert _read_file(p, "wide.md") is None
+
+def test_incremental_keeps_files_without_chunks(tmp_path, offline):
+    src = _repo(tmp_path / "src", {"a.py": b"def a():\n    return 1\n", "empty.py": b"", "b.md": b"# B\ntext\n"})
+    url, out = f"file://{src}", tmp_path / "idx"
+    first = build_index(url, out)
+    assert first["n_files"] == 3
+    (src / "a.py").write_bytes(b"def a():\n    return 2\n")
+    _git(src, "commit", "-qam", "change a")
+    second = build_index(url, out)
+    assert second["changed"] == {"added": 0, "modified": 1, "removed": 0, "unchanged": 2}
+    assert [r["meta"]["path"] for r in open_chunks(out)] == ["b.md", "a.py"]
+
+class FakeTagger:
+    """Stands in for chat_result: per-path delays and failures, with call bookkeeping."""
+    def __init__(self, delays=None, failures=None):
+        self.delays, self.failures = delays or {}, failures or {}
+        self.lock = threading.Lock()
+        self.calls, self.running, self.max_running = [], 0, 0
+
+    def __call__(self, msg, temperature=0.0, retries=None, key=None, **kwargs):
+        content = msg[-1]["content"]
+        if not content.startswith("Path: "):
+            return ChatResult(text="{}", latency=0.0, retries=0)   # repo map
+        path = content.split("\n", 1)[0][6:]
+        with self.lock:
+            self.calls.append((path, time.monotonic(), retries))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            failures = self.failures.get(path) or []
+            err = failures.pop(0) if failures else None
+        try:
+            time.sleep(self.delays.get(path, 0.0))
+            if err is not None:
+                raise err
+            return ChatResult(text=json.dumps({"brief_summary": path, "tags": ["t"], "language": "py"}),
+                              latency=0.0, retries=0)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+@pytest.fixture
+def tagger(offline, monkeypatch):
+    monkeypatch.setattr(repo_indexer, "TAG_RPS", 1000.0)
+    monkeypatch.setattr(repo_indexer, "TAG_CONCURRENCY", 3)
+    monkeypatch.setattr(repo_indexer, "TAG_RETRIES", 2)
+    monkeypatch.setattr(repo_indexer, "BREAKER_COOLDOWN", 0.05)
+    fake = FakeTagger()
+    monkeypatch.setattr(repo_indexer, "chat_result", fake)
+    return fake
+
+def _sized_repo(tmp_path, n=8):
+    # f0.py is the largest; every file gets tagged
+    return _repo(tmp_path / "src", {f"f{i}.py": b"x = 1\n" * (n - i) for i in range(n)})
+
+def test_tags_keep_size_order_and_bounded_concurrency(tmp_path, tagger):
+    src = _sized_repo(tmp_path)
+    tagger.delays = {f"f{i}.py": 0.01 * (8 - i) for i in range(8)}   # the largest file finishes last
+    res = build_index(f"file://{src}", tmp_path / "idx")
+    files = json.loads((tmp_path / "idx" / "files.json").read_text())
+    assert [f["path"] for f in files] == [f"f{i}.py" for i in range(8)]
+    assert all(f["brief_summary"] == f["path"] for f in files)
+    assert res["tags_failed"] == 0 and 1 < tagger.max_running <= 3
+    assert {retries for _, _, retries in tagger.calls} == {0}   # no inner retries behind the bucket
+
+def test_rate_limit_pauses_every_tag_worker(tmp_path, tagger):
+    src = _sized_repo(tmp_path)
+    tagger.failures = {"f0.py": [RateLimitError("429", retry_after=0.3)]}
+    tagger.delays = {f"f{i}.py": 0.05 for i in range(1, 8)}
+    build_index(f"file://{src}", tmp_path / "idx")
+    limited_at = tagger.calls[0][1]   # f0.py goes first and is rate limited straight away
+    # only the other workers' requests already past the bucket may go out during the pause
+    early = [path for path, t, _ in tagger.calls[1:] if t < limited_at + 0.28]
+    assert len(early) <= 2 and len(tagger.calls) == 9
+
+def test_failed_tags_are_marked_and_retried_next_ingest(tmp_path, tagger):
+    src = _sized_repo(tmp_path, n=3)
+    tagger.failures = {"f1.py": [CircuitOpenError("open")] * 3,           # every try of this ingest
+                       "f2.py": [CircuitOpenError("open"), RuntimeError("AIML API error 503")]}
+    url, out = f"file://{src}", tmp_path / "idx"
+    first = build_index(url, out)
+    files = {f["path"]: f for f in json.loads((out / "files.json").read_text())}
+    assert first["tags_failed"] == 1 and files["f1.py"]["error"] == "open" and files["f1.py"]["tags"] == []
+    assert files["f2.py"]["tags"] == ["t"]   # recovered within its retries
+    (src / "new.py").write_bytes(b"y = 2\n")
+    _git(src, "add", "-A")
+    _git(src, "commit", "-qm", "add")
+    tagger.calls.clear()
+    second = build_index(url, out)
+    assert sorted(path for path, _, _ in tagger.calls) == ["f1.py", "new.py"]   # f0/f2 keep their tags
+    files = {f["path"]: f for f in json.loads((out / "files.json").read_text())}
+    assert second["tags_failed"] == 0 and "error" not in files["f1.py"]
+
+def test_process_pool_ingest_matches_in_process(tmp_path, offline, monkeypatch):
+    src = _repo(tmp_path / "src", {f"m{i}.py": f"def f{i}():\n    return {i}\n".encode() for i in range(12)})
+    build_index(f"file://{src}", tmp_path / "one")
+    monkeypatch.setattr(repo_indexer, "INGEST_WORKERS", 2)
+    build_index(f"file://{src}", tmp_path / "two")
+    assert list(open_chunks(tmp_path / "one")) == list(open_chunks(tmp_path / "two"))
+    assert repo_indexer._MP.get_start_method() in ("forkserver", "spawn")
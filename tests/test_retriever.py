@@ -0,0 +1,40 @@
+from collections import Counter
+
+import pytest
+
+from backend import blueprint, retriever
+from backend.analyzer import current_analyzer
+from backend.bm25_index import IndexBuilder
+from backend.chunk_store import ChunkWriter
+from backend.retriever import Retriever
+
+DOCS = {"app.py": "def main():\n    run_server(port=8000)\n", "README.md": "# Demo\nRun the server with main\n"}
+
+@pytest.fixture
+def repo(tmp_path):
+    analyzer = current_analyzer()
+    builder, writer = IndexBuilder(tmp_path / "bm25"), ChunkWriter(tmp_path / "chunks")
+    for i, (path, text) in enumerate(DOCS.items()):
+        toks = analyzer.analyze(text)
+        builder.add(Counter(toks), len(toks))
+        writer.add(text, {"path": path, "chunk_id": 0, "start_line": 1, "end_line": 2})
+    meta = writer.finish()
+    builder.finish(version=meta["version"], analyzer=analyzer.spec())
+    return tmp_path
+
+def test_answer_cache_key_follows_the_prompt_version(repo, monkeypatch):
+    r = Retriever(repo)
+    _, key, _ = r._prompt("how do I run the server", "run", 4)
+    assert key and r._prompt("how do I run the server", "run", 4)[1] == key
+    monkeypatch.setattr(retriever, "ANSWER_PROMPT_VERSION", "edited")
+    assert r._prompt("how do I run the server", "run", 4)[1] != key
+
+def test_stored_blueprint_goes_stale_with_its_prompt(repo, monkeypatch):
+    version = blueprint._index_version(repo)
+    blueprint._save_blueprint(repo, version, "run", "pip install; python app.py", {"latency_s": 1.0})
+    assert blueprint.load_blueprint(repo, "run")["answer"] == "pip install; python app.py"
+    monkeypatch.setitem(blueprint.PROMPTS, "run", blueprint.PROMPTS["run"] + " Mention Docker.")
+    assert blueprint.load_blueprint(repo, "run") is None
+    monkeypatch.undo()
+    monkeypatch.setattr(blueprint, "ANSWER_PROMPT_VERSION", "edited")
+    assert blueprint.load_blueprint(repo, "run") is None
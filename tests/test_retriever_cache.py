@@ -0,0 +1,112 @@
+import os, threading, time
+
+import pytest
+
+from backend import retriever_cache
+from backend.retriever_cache import RetrieverCache
+from backend.storage import new_version_dir, publish
+
+class FakeRetriever:
+    loads, size, delay = [], 100, 0.0
+
+    def __init__(self, repo_dir):
+        FakeRetriever.loads.append(repo_dir.name)
+        time.sleep(FakeRetriever.delay)
+        self.repo_dir = retriever_cache.active_dir(repo_dir)
+
+    def approx_bytes(self):
+        return FakeRetriever.size
+
+@pytest.fixture(autouse=True)
+def fake(monkeypatch):
+    monkeypatch.setattr(retriever_cache, "Retriever", FakeRetriever)
+    monkeypatch.setattr(FakeRetriever, "loads", [])
+    return FakeRetriever
+
+def _version(repo_dir):
+    vdir = new_version_dir(repo_dir)
+    (vdir / "chunks").mkdir()
+    (vdir / "chunks" / "meta.json").write_text("{}")
+    publish(repo_dir, vdir)
+    return vdir
+
+def _repos(tmp_path, *names):
+    for name in names:
+        _version(tmp_path / name)
+    return [tmp_path / name for name in names]
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    a, b, c = _repos(tmp_path, "a", "b", "c")
+    cache = RetrieverCache(max_entries=2, max_bytes=1 << 30)
+    ra = cache.get("a", a)
+    cache.get("b", b)
+    assert cache.get("a", a) is ra   # a is now the most recent
+    cache.get("c", c)
+    stats = cache.stats()
+    assert stats["repos"] == ["a", "c"] and stats["evictions"] == 1
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+    cache.get("b", b)
+    assert FakeRetriever.loads == ["a", "b", "c", "b"]
+
+def test_byte_budget_keeps_the_newest_entry(tmp_path, fake, monkeypatch):
+    a, b, c = _repos(tmp_path, "a", "b", "c")
+    cache = RetrieverCache(max_entries=10, max_bytes=250)
+    for name, d in zip("abc", (a, b, c)):
+        cache.get(name, d)
+    assert cache.stats()["repos"] == ["b", "c"] and cache.stats()["bytes"] == 200
+    monkeypatch.setattr(fake, "size", 1000)   # bigger than the whole budget on its own
+    cache.invalidate("a")
+    cache.get("a", a)
+    assert cache.stats()["repos"] == ["a"]
+
+def test_new_current_version_reloads(tmp_path):
+    (a,) = _repos(tmp_path, "a")
+    cache = RetrieverCache()
+    first = cache.get("a", a)
+    assert cache.get("a", a) is first
+    vdir = _version(a)   # a re-ingest publishes a new version
+    second = cache.get("a", a)
+    assert second is not first and second.repo_dir == vdir
+    assert cache.stats()["misses"] == 2
+    cache.invalidate("a")
+    assert cache.get("a", a) is not second and cache.stats()["invalidations"] == 1
+
+def test_legacy_index_reloads_when_rewritten(tmp_path):
+    legacy = tmp_path / "old"
+    legacy.mkdir()
+    (legacy / "corpus.jsonl").write_text("")
+    cache = RetrieverCache()
+    first = cache.get("old", legacy)
+    st = (legacy / "corpus.jsonl").stat()
+    os.utime(legacy / "corpus.jsonl", (st.st_atime, st.st_mtime + 10))
+    assert cache.get("old", legacy) is not first
+
+def test_concurrent_loads_are_single_flight_per_repo(tmp_path, fake, monkeypatch):
+    a, b = _repos(tmp_path, "a", "b")
+    monkeypatch.setattr(fake, "delay", 0.2)
+    cache = RetrieverCache()
+    got, barrier = [], threading.Barrier(8)
+    def worker(i):
+        barrier.wait()
+        got.append((i % 2, cache.get("ab"[i % 2], (a, b)[i % 2])))
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(FakeRetriever.loads) == ["a", "b"]   # one load per repo
+    assert len({id(r) for i, r in got if i == 0}) == 1 and len({id(r) for i, r in got if i == 1}) == 1
+    assert time.monotonic() - t0 < 0.38   # the two repos loaded in parallel, not one after the other
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 6
+
+def test_warm_skips_broken_repos(tmp_path, fake, monkeypatch):
+    (a,) = _repos(tmp_path, "a")
+    def broken(repo_dir):
+        if repo_dir.name == "missing":
+            raise FileNotFoundError(repo_dir)
+        return FakeRetriever(repo_dir)
+    monkeypatch.setattr(retriever_cache, "Retriever", broken)
+    cache = RetrieverCache()
+    cache.warm(tmp_path, ["missing", "a"])
+    assert cache.stats()["repos"] == ["a"]
@@ -0,0 +1,73 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import api, telemetry
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A fresh, enabled registry for each test."""
+    monkeypatch.setattr(telemetry, "TELEMETRY", True)
+    monkeypatch.setattr(telemetry, "_counters", {})
+    monkeypatch.setattr(telemetry, "_histograms", {})
+    monkeypatch.setattr(telemetry, "_gauges", {})
+    monkeypatch.setattr(telemetry, "LATENCY_BUCKETS", (0.1, 1.0, 10.0))
+
+def _samples(text):
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+def test_counters_render_with_help_type_and_sorted_labels(registry):
+    telemetry.inc("llm_calls_total", cached="true")
+    telemetry.inc("llm_calls_total", 2, cached="false")
+    telemetry.inc("http_requests_total", route="/answer", status=200)
+    assert telemetry.render() == (
+        "# HELP repo_ops_http_requests_total API requests by route and status\n"
+        "# TYPE repo_ops_http_requests_total counter\n"
+        'repo_ops_http_requests_total{route="/answer",status="200"} 1\n'
+        "# HELP repo_ops_llm_calls_total LLM completions, including cache hits\n"
+        "# TYPE repo_ops_llm_calls_total counter\n"
+        'repo_ops_llm_calls_total{cached="false"} 2\n'
+        'repo_ops_llm_calls_total{cached="true"} 1\n')
+
+def test_label_values_are_escaped(registry):
+    telemetry.inc("ingest_jobs_total", status='a\\b "quoted"\nnext')
+    assert _samples(telemetry.render()) == ['repo_ops_ingest_jobs_total{status="a\\\\b \\"quoted\\"\\nnext"} 1']
+
+def test_histogram_buckets_are_cumulative(registry):
+    for seconds in (0.05, 0.1, 0.5, 3.0, 42.0):
+        telemetry.observe("span_seconds", seconds, span="ingest.clone")
+    text = telemetry.render()
+    assert "# TYPE repo_ops_span_seconds histogram" in text
+    assert _samples(text) == [
+        'repo_ops_span_seconds_bucket{span="ingest.clone",le="0.1"} 2',   # le is inclusive
+        'repo_ops_span_seconds_bucket{span="ingest.clone",le="1"} 3',
+        'repo_ops_span_seconds_bucket{span="ingest.clone",le="10"} 4',
+        'repo_ops_span_seconds_bucket{span="ingest.clone",le="+Inf"} 5',
+        'repo_ops_span_seconds_sum{span="ingest.clone"} 45.650000',
+        'repo_ops_span_seconds_count{span="ingest.clone"} 5']
+
+def test_unlabelled_series_gauges_and_broken_probes(registry):
+    telemetry.inc("retrieval_queries_total")
+    telemetry.gauge("queue_depth", "Jobs waiting", lambda: 3)
+    telemetry.gauge("broken", "Raises", lambda: 1 / 0)
+    assert telemetry.render().splitlines() == [
+        "# HELP repo_ops_retrieval_queries_total Retriever.topk calls",
+        "# TYPE repo_ops_retrieval_queries_total counter",
+        "repo_ops_retrieval_queries_total 1",
+        "# HELP repo_ops_queue_depth Jobs waiting",
+        "# TYPE repo_ops_queue_depth gauge",
+        "repo_ops_queue_depth 3"]
+
+def test_disabled_telemetry_records_nothing(registry, monkeypatch):
+    monkeypatch.setattr(telemetry, "TELEMETRY", False)
+    telemetry.inc("llm_calls_total")
+    telemetry.observe("span_seconds", 1.0, span="x")
+    with telemetry.span("x"):
+        pass
+    assert telemetry.render() == "\n"
+
+def test_metrics_endpoint_serves_the_exposition(registry):
+    telemetry.inc("llm_calls_total", cached="false")
+    r = TestClient(api.app).get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'repo_ops_llm_calls_total{cached="false"} 1\n' in r.text
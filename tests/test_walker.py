@@ -0,0 +1,70 @@
+import pytest
+
+from backend.walker import _ignored, parse_gitignore, walk_repo
+
+def ignored(text, rel, is_dir=False):
+    return _ignored((("", parse_gitignore(text)),), rel, is_dir)
+
+@pytest.mark.parametrize("text,rel,is_dir,expected", [
+    # negation re-includes, and the last matching line wins
+    ("*.log\n!keep.log", "a.log", False, True),
+    ("*.log\n!keep.log", "keep.log", False, False),
+    ("*.log\n!keep.log", "sub/keep.log", False, False),
+    ("!keep.log\n*.log", "keep.log", False, True),
+    # a trailing slash only matches directories, at any depth
+    ("build/", "build", True, True),
+    ("build/", "build", False, False),
+    ("build/", "src/build", True, True),
+    # a leading or middle slash anchors to the .gitignore's directory
+    ("/docs", "docs", True, True),
+    ("/docs", "src/docs", True, False),
+    ("a/b.txt", "a/b.txt", False, True),
+    ("a/b.txt", "x/a/b.txt", False, False),
+    ("docs", "src/docs", True, True),
+    # ** spans directories, * and ? do not
+    ("**/gen/*.py", "gen/x.py", False, True),
+    ("**/gen/*.py", "a/b/gen/x.py", False, True),
+    ("**/gen/*.py", "gen/sub/x.py", False, False),
+    ("a/**/z", "a/z", False, True),
+    ("a/**/z", "a/b/c/z", False, True),
+    ("a/**", "a/x/y", False, True),
+    ("*.py", "src/x.py", False, True),
+    ("src/*.py", "src/sub/x.py", False, False),
+    ("?.c", "x.c", False, True),
+    ("?.c", "xy.c", False, False),
+    # character classes and escapes
+    ("[!a]bc", "xbc", False, True),
+    ("[!a]bc", "abc", False, False),
+    ("\\!important", "!important", False, True),
+    ("\\#hash", "#hash", False, True),
+    ("# comment\n\n", "# comment", False, False),
+])
+def test_gitignore_patterns(text, rel, is_dir, expected):
+    assert ignored(text, rel, is_dir) is expected
+
+def test_nested_gitignore_overrides_parent():
+    rules = (("", parse_gitignore("*.md\n")), ("sub/", parse_gitignore("!keep.md\n")))
+    assert _ignored(rules, "sub/keep.md", False) is False
+    assert _ignored(rules, "sub/other.md", False) is True
+    assert _ignored(rules, "keep.md", False) is True
+
+def write(root, rel, text="x"):
+    p = root / rel
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text)
+
+def test_walk_repo_applies_ignores_skips_and_size_limit(tmp_path):
+    write(tmp_path, ".gitignore", "*.md\nout/\n!out/keep.py\n")
+    write(tmp_path, "README.md")
+    write(tmp_path, "main.py")
+    write(tmp_path, "big.py", "x" * 101)
+    write(tmp_path, "logo.png")
+    write(tmp_path, "out/keep.py")           # its directory is excluded, so it cannot be re-included
+    write(tmp_path, "node_modules/lib.js")
+    write(tmp_path, "docs/.gitignore", "!guide.md\n")
+    write(tmp_path, "docs/guide.md")
+    write(tmp_path, "docs/notes.md")
+    res = walk_repo(tmp_path, max_bytes=100)
+    assert [rel for _, rel, _ in res.files] == ["main.py", "docs/guide.md"]   # a directory's files before its subdirectories
+    assert [size for _, _, size in res.files] == [1, 1]
+    assert res.skipped == {"dirs": 2, "ignored": 2, "too_large": 1}